@@ -22,11 +22,11 @@ sleep 10 # wait for daemon to be ready
 echo 'sending requests from client'
 python3 -m TwitterMine.client -c "$CLIENT_CONF" -s "$COMMANDS_FILE" > client.out
 
-echo 'sleep 5 minutes (let daemon digest all requests)'
-sleep 300
+echo 'waiting for the daemon to mine all requests'
+echo 'wait' | python3 -m TwitterMine.client -c "$CLIENT_CONF" -i
 
-echo 'sending shutdown request to daemon (daemon will shutdown after all the data was mined)'
-echo 'server shutdown' | python3 -m TwitterMine.client -c "$CLIENT_CONF -i > /dev/null
+echo 'sending shutdown request to daemon'
+echo 'server shutdown' | python3 -m TwitterMine.client -c "$CLIENT_CONF" -i > /dev/null
 
 echo 'waiting for daemon to finish...'
 wait $DAEMON_PID
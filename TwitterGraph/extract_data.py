@@ -7,6 +7,10 @@ from math import log
 import numpy as np
 from scipy.sparse import lil_matrix
 
+from TwitterMine import neighbors_file
+from TwitterMine.layout import DataLayout
+from TwitterMine.data_writer import open_manifest
+from TwitterMine.storage import open_storage
 from TwitterMine.utils import RETWEET, QUOTE, REPLY
 
 usage = 'Usage: extract_data <graph-properties-file>'
@@ -25,7 +29,8 @@ assert len(adjacency_types) == len(set(adjacency_types))  # unique value for eac
 def network_users(data_dir, necessary_files, network_file):
     """
     find all users in the data_dir that have all the necessary files in their directory. Each such
-    user is given a unique identifier (serial)
+    user is given a unique identifier (serial). The users are found in the manifest of the data dir
+    (see TwitterMine.manifest), without reading their directories
 
     if network file exists, read users map from file and return it.
 
@@ -40,21 +45,17 @@ def network_users(data_dir, necessary_files, network_file):
         return map
     serial = 0
     map = dict()
-    for scr_name in os.listdir(data_dir):
-        user_dir = os.path.join(data_dir, scr_name)
-        if os.path.isdir(user_dir):
-            valid_user = True
-            for file in necessary_files:
-                filepath = os.path.join(user_dir, file)
-                if not os.path.isfile(filepath):
-                    valid_user = False
-                    break
-            if valid_user:
-                details_file = os.path.join(user_dir, 'user_details')
-                with open(details_file) as df:
-                    followers_count = json.load(df)['followers_count']
-                map[scr_name] = (serial, followers_count)
-                serial += 1
+    layout = DataLayout(data_dir)
+    storage = open_storage(layout)  # only read if the manifest is missing
+    manifest = open_manifest(layout, storage, read_only=True)
+    for scr_name in manifest.users():
+        resources = manifest.user_resources(scr_name)
+        if all(file in resources for file in necessary_files):
+            followers_count = manifest.user_info(scr_name)['followers_count']
+            map[scr_name] = (serial, followers_count)
+            serial += 1
+    manifest.close()
+    storage.close()
     with open(network_file, mode='w') as net:
         json.dump(map, net, indent=4)
     return map
@@ -93,31 +94,46 @@ def adjacencies_matrices(users_map, data_dir, matrices_file):
                 QUOTE: lil_matrix((N, N), dtype=dtype),
                 REPLY: lil_matrix((N, N), dtype=dtype),
                 LIKE: lil_matrix((N, N), dtype=dtype)}
+    layout = DataLayout(data_dir)
+    storage = open_storage(layout)
+    # the serial of every interned screen name (-1 for users out of the network), for binary
+    # neighbors (see neighbors_file)
+    names = neighbors_file.NamesDictionary(
+        os.path.join(data_dir, neighbors_file.NAMES_FILE_NAME), read_only=True).all_names()
+    serials = np.full(len(names), -1, dtype=np.int64)
+    for name_id, name in enumerate(names):
+        if name in users_map:
+            serials[name_id] = users_map[name][SERIAL_IDX]
     for user_name in users_map:
-        neighbors_file = os.path.join(data_dir, user_name, 'neighbors')
-        likes_file = os.path.join(data_dir, user_name, 'likes')
         i = users_map[user_name][SERIAL_IDX]
         # RETWEET, QUOTE and REPLY matrices
-        if os.path.isfile(neighbors_file):
-            with open(neighbors_file) as nf:
-                for line in nf:
-                    tokens = line[:-1].split(';')
-                    neighbor_name = tokens[0]
-                    neighborship_type = int(tokens[2])
-                    if neighbor_name in users_map:
-                        # the neighbor belongs to our network
-                        j = users_map[neighbor_name][SERIAL_IDX]
-                        matrices[neighborship_type][i, j] += 1
+        binary_file = os.path.join(layout.user_dir(user_name),
+                                   'neighbors' + neighbors_file.FILE_SUFFIX)
+        if os.path.isfile(binary_file):
+            records = neighbors_file.read_neighbors_array(binary_file)
+            js = serials[records['neighbor']]
+            for neighborship_type in [RETWEET, QUOTE, REPLY]:
+                # neighbors that belong to our network
+                type_js = js[(js >= 0) & (records['type'] == neighborship_type)]
+                for j, count in zip(*np.unique(type_js, return_counts=True)):
+                    matrices[neighborship_type][i, j] += count
+        for line in storage.read_lines(user_name, 'neighbors'):
+            tokens = line.split(';')
+            neighbor_name = tokens[0]
+            neighborship_type = int(tokens[2])
+            if neighbor_name in users_map:
+                # the neighbor belongs to our network
+                j = users_map[neighbor_name][SERIAL_IDX]
+                matrices[neighborship_type][i, j] += 1
         # LIKE matrix
-        if os.path.isfile(likes_file):
-            with open(likes_file) as lf:
-                for line in lf:
-                    tweet = json.loads(line)
-                    neighbor_name = tweet['user']['screen_name']
-                    if neighbor_name in users_map:
-                        # the neighbor belongs to our network
-                        j = users_map[neighbor_name][SERIAL_IDX]
-                        matrices[LIKE][i, j] += 1
+        for line in storage.read_lines(user_name, 'likes'):
+            tweet = json.loads(line)
+            neighbor_name = tweet['user']['screen_name']
+            if neighbor_name in users_map:
+                # the neighbor belongs to our network
+                j = users_map[neighbor_name][SERIAL_IDX]
+                matrices[LIKE][i, j] += 1
+    storage.close()
     # add all matrices
     all = reduce(lil_matrix.__add__, matrices.values())
     matrices[ALL] = all
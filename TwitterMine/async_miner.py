@@ -0,0 +1,219 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty
+from threading import Thread
+
+from TwitterAPI.TwitterError import TwitterRequestError
+from TwitterMine.job_queue import DEFAULT_CAMPAIGN, DEFAULT_PRIORITY, OVERFLOW_SPILL
+from TwitterMine.miner import Miner, PAGED_JOBS, STOP_SIGNAL, \
+    USERS_LOOKUP_BATCH, queue_type
+from TwitterMine.pager import iterate_pages_async
+from TwitterMine.rate_limit import Interrupted
+from TwitterMine.storage import FSYNC_NEVER
+
+TASKS_PER_API = 4  # number of concurrent jobs of each type for every api
+IDLE_POLL_SECONDS = 1  # how often an idle task checks its queue if it wasn't woken up
+
+
+class AsyncMiner(Miner):
+    """
+    A Miner that handles all REST jobs in a single asyncio event loop instead of a thread per job
+    type and api.
+
+    Every api runs several concurrent tasks for each job type. A task that waits for its rate limit
+    window (or for new jobs) doesn't hold a thread, so the number of credentials and tasks can grow
+    without adding threads. Requests themselves are blocking and are sent from a shared pool of
+    max_in_flight threads, which bounds the number of requests in flight.
+
+    All REST jobs (paged jobs, including timeline jobs, and user details jobs) run natively in the
+    loop and have the same semantics as their Miner counterparts (including checkpoints and
+    batching). Listen jobs keep their own thread, like in Miner.
+    """
+
+    def __init__(self, credentials, data_dir, job_freshness=0, tasks_per_api=TASKS_PER_API,
+                 max_in_flight=None, fsync=FSYNC_NEVER, queue_limits=None, overflow=OVERFLOW_SPILL):
+        """
+        :param credentials: see Miner
+        :param data_dir: see Miner
+        :param job_freshness: see Miner
+        :param tasks_per_api: number of concurrent jobs of each type for every api
+        :param max_in_flight: maximum number of requests in flight. defaults to tasks_per_api
+                              for every api
+        :param fsync: see Miner
+        :param queue_limits: see Miner
+        :param overflow: see Miner
+        """
+        self.tasks_per_api = tasks_per_api
+        super().__init__(credentials, data_dir, job_freshness, fsync, queue_limits, overflow)
+        if max_in_flight is None:
+            max_in_flight = tasks_per_api * len(self.apis)
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self.loop = None
+        self.wakeups = dict()  # job type -> asyncio.Event, set when new jobs are produced
+
+    def _create_threads(self):
+        return [Thread(target=AsyncMiner._run_loop, args=(self,)),
+                Thread(target=Miner._run_consumer, args=(self, 'listen', Miner._listen, self.api))]
+
+    def _consumers_count(self, job_type):
+        if job_type == 'listen':
+            return 1
+        return self.tasks_per_api * len(self.apis)
+
+    def _run_loop(self):
+        """
+        run the event loop until all tasks received a STOP_SIGNAL
+        """
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.loop.run_until_complete(self._main())
+        finally:
+            self.loop.close()
+            self.executor.shutdown()
+
+    async def _main(self):
+        jobs_funcs = {job_type: AsyncMiner._mine_paged_async for job_type in PAGED_JOBS}
+        jobs_funcs['user_details'] = AsyncMiner._mine_user_details_async
+        self.wakeups = {job_type: asyncio.Event() for job_type in jobs_funcs}
+        tasks = [self._run_consumer_async(job_type, job_func, api)
+                 for job_type, job_func in jobs_funcs.items()
+                 for api in self.apis
+                 for _ in range(self.tasks_per_api)]
+        await asyncio.gather(*tasks)
+
+    async def _next_jobs(self, job_type, count):
+        """
+        wait for the next jobs of the given type
+        :param count: maximum number of jobs to take
+        :return: list of tuples (job_id, args), possibly ending with STOP_SIGNAL
+        """
+        wakeup = self.wakeups[job_type]
+        while True:
+            try:
+                # the job store blocks, so the jobs are taken in the executor
+                return await self._in_executor(self._take_jobs, job_type, count)
+            except Empty:
+                wakeup.clear()
+                try:
+                    await asyncio.wait_for(wakeup.wait(), IDLE_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _take_jobs(self, job_type, count):
+        """
+        take up to count jobs of the given type from its queue, without waiting
+        :return: list of tuples (job_id, args), possibly ending with STOP_SIGNAL
+        :raise queue.Empty: if there are no jobs
+        """
+        queue = self.queues[job_type]
+        jobs = [queue.get(block=False)]
+        while len(jobs) < count and jobs[-1] is not STOP_SIGNAL:
+            try:
+                jobs.append(queue.get(block=False))
+            except Empty:
+                break
+        return jobs
+
+    async def _run_consumer_async(self, job_type, job_func, api):
+        """
+        consume jobs of a specific type until a STOP_SIGNAL is received.
+        user details jobs are consumed in batches of up to USERS_LOOKUP_BATCH jobs
+        :param job_type: the type of job (one of the constants in miner.JOBS_TYPES)
+        :param job_func: coroutine function that handles the job
+        :param api: the api this consumer uses
+        """
+        batch_size = USERS_LOOKUP_BATCH if job_type == 'user_details' else 1
+        stop = False
+        while not stop:
+            batch = await self._next_jobs(job_type, batch_size)
+            stop = batch[-1] is STOP_SIGNAL
+            if stop:
+                batch.pop()
+            retrieved = set()
+            error = None
+            try:
+                if batch_size > 1 and batch:
+                    retrieved = await job_func(self, api,
+                                               [job_args for job_id, job_args in batch])
+                elif batch:
+                    await job_func(self, api, job_type, batch[0][1], batch[0][0])
+            except Interrupted as e:
+                # the jobs stay in the store, and continue from their checkpoints when the miner
+                # restarts
+                self.logger.info('{0} job stopped: {1}'.format(job_type, str(e)))
+                continue
+            except Exception as e:
+                error = self._job_error(job_type, e)
+            # finishing a job writes to the job store
+            if batch_size > 1:
+                await self._in_executor(self._finish_batch, batch, retrieved, error)
+            else:
+                for job_id, job_args in batch:
+                    await self._in_executor(self._task_done, job_type, job_id, error)
+
+    async def _mine_paged_async(self, api, job_type, args, job_id):
+        """
+        same as Miner._mine_paged, with requests sent asynchronously
+        """
+        screen_name = args['screen_name']
+        self.logger.info('mining {0} of user {1}'.format(job_type, screen_name))
+        try:
+            await self._in_executor(self._produce_user_details_job, screen_name)
+            # preparing the job reads stored data
+            resource, params, progress = await self._in_executor(self._paged_job, job_type, args)
+            on_request = lambda: self.jobs_store.update_progress(job_id, api_calls=1)
+            paging = True
+            while paging:
+                paging = False
+                async for page, next_position in iterate_pages_async(api, resource, params,
+                                                                     progress.position,
+                                                                     self.executor, on_request):
+                    # add_page may flush to the disk
+                    total = progress.total
+                    done = await self._in_executor(progress.add_page, page, next_position)
+                    self.items_metric.inc(job_type, amount=progress.total - total)
+                    await self._in_executor(self.jobs_store.update_progress, job_id,
+                                            progress.total, 1)
+                    if job_type == 'timeline':
+                        restart = await self._in_executor(self._absorb_pending, job_id, args,
+                                                          params, progress, next_position, done)
+                        if restart is not None:
+                            params, progress = restart
+                            paging = True
+                            break
+                    if done:
+                        break
+                    if self.interrupted:
+                        await self._in_executor(progress.checkpoint, next_position)
+                        raise Interrupted('{0} of {1} was interrupted'.format(job_type,
+                                                                             screen_name))
+            await self._in_executor(progress.finish)
+            self.logger.info('{0} of user {1} mined successfully'.format(job_type, screen_name))
+        except TwitterRequestError as e:
+            self.logger.error('mining {0} failed. Status code {1}: {2}'.format(job_type,
+                                                                              e.status_code, e.msg))
+            raise
+
+    async def _mine_user_details_async(self, api, jobs_args):
+        """
+        same as Miner._mine_user_details, with the request sent asynchronously
+        """
+        screen_names = list({args['screen_name'] for args in jobs_args})
+        self.logger.info('mining user details of {0} users'.format(len(screen_names)))
+        r = await api.request_async('users/lookup', {'screen_name': ','.join(screen_names)},
+                                    self.executor)
+        return await self._in_executor(self._write_users_lookup, r)
+
+    def _in_executor(self, func, *args):
+        """
+        :return: awaitable of func(*args), called in the executor
+        """
+        return self.loop.run_in_executor(self.executor, func, *args)
+
+    def produce_job(self, job_type, args, priority=DEFAULT_PRIORITY, campaign=DEFAULT_CAMPAIGN,
+                    bounded=True):
+        job_id = super().produce_job(job_type, args, priority, campaign, bounded)
+        job_type = queue_type(job_type)
+        if self.loop is not None and not self.loop.is_closed() and job_type in self.wakeups:
+            self.loop.call_soon_threadsafe(self.wakeups[job_type].set)
+        return job_id
@@ -3,6 +3,7 @@ from requests.exceptions import ConnectionError
 import json
 import re
 import argparse
+import time
 from sys import stdin
 
 # description and help
@@ -12,24 +13,49 @@ Enter a command to execute. To quit enter 'exit'.
 """
 commands_help = """\
 A valid command should be in one of the following formats:
-    - mine <resource> of <screen_name> [limit]
+    - mine <resource> of <screen_name> [limit] [priority <priority>]
     - listen to user <comma,separated,ids> [stop]
     - listen to keywords <comma,separated,keywords> [stop]
+    - wait
     - server shutdown
 
 * <resource> is one of: 'details', 'friends', 'followers', 'tweets', 'likes', 'neighbors'
+* <priority> is an integer (default 0). jobs with higher priority are handled first
+* 'wait' blocks until all mining requests of the campaign (see --campaign) are finished
 * the 'stop' word at the end of a listen command indicates that the list of values are values to stop listening to
 """
 
 server_host_port = ''  # to be initialized according to config
+campaign = None  # campaign name of all mining requests. to be initialized according to arguments
 headers = {'content-type': 'application/json'}
+batch_headers = {'content-type': 'application/x-ndjson'}
+# all requests go through a single session, so the connection to the daemon is kept alive
+session = requests.Session()
+BATCH_SIZE = 1000  # mining commands that are sent in a single request in script mode
+BATCH_TIMEOUT = 60  # seconds
+# requests that are rejected because the queues of the daemon are full (status 429) are sent again,
+# after the Retry-After of the response or an exponential backoff (whichever is longer)
+TOO_MANY_REQUESTS_CODE = 429
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 1
+DEFAULT_CAMPAIGN = 'default'  # the campaign of mining requests without a campaign name
+WAIT_TIMEOUT = 60  # seconds. the daemon answers wait requests after at most 30 seconds
+# the job type of every resource in mining commands
+RESOURCE_JOB_TYPES = {'details': 'user_details',
+                      'friends': 'friends_ids',
+                      'followers': 'followers_ids',
+                      'tweets': 'tweets',
+                      'likes': 'likes',
+                      'neighbors': 'neighbors'}
 
 # valid commands regex
 mine_command_regex = re.compile(
-    '\s*mine\s+(details|friends|followers|tweets|likes|neighbors)\s+of\s+\w+(\s+\d*)?\s*')
+    '\s*mine\s+(details|friends|followers|tweets|likes|neighbors)\s+of\s+\w+(\s+\d*)?'
+    '(\s+priority\s+-?\d+)?\s*')
 listen_command_regex = re.compile(
     '\s*listen\s+to\s+((user\s+\d+(,\d+)*)|(keywords?\s+\w+(,\w+)*))(\s+stop)?\s*')
 server_shutdown_command = re.compile('\s*server\s+shutdown\s*')
+wait_command = re.compile('\s*wait\s*')
 
 
 def parse_args():
@@ -43,6 +69,10 @@ def parse_args():
                         help='configurations file for the client (default \'client.conf\')',
                         required=False, type=str, default='client.conf')
 
+    parser.add_argument('--campaign', metavar='name', required=False, type=str, default=None,
+                        help='campaign name for all mining requests. campaigns with the same '
+                             'priority share the daemon equally')
+
     # exactly one of -s and -i is allowed
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument('-s', help='script file with list of commands', metavar='script')
@@ -56,12 +86,25 @@ def check_connection():
     :return: True if a request and a response were successfully transmitted to and from the daemon
     """
     try:
-        r = requests.get(server_host_port)
+        r = session.get(server_host_port)
         return r.ok
     except ConnectionError as e:
         return False
 
 
+def retry_delay(response, attempt):
+    """
+    :param response: a response with status 429
+    :param attempt: the number of the attempt that was rejected (0 for the first one)
+    :return: seconds to wait before sending the request again
+    """
+    backoff = BACKOFF_SECONDS * 2 ** attempt
+    try:
+        return max(backoff, int(response.headers.get('Retry-After', 0)))
+    except ValueError:
+        return backoff
+
+
 def send_request(resource, data=None, quiet=False):
     """
     :param resource: string, server resource path
@@ -73,7 +116,11 @@ def send_request(resource, data=None, quiet=False):
     url = server_host_port + resource
     data = json.dumps(data)
     try:
-        r = requests.post(url, data=data, headers=headers, timeout=10)
+        for attempt in range(MAX_RETRIES + 1):
+            r = session.post(url, data=data, headers=headers, timeout=10)
+            if r.status_code != TOO_MANY_REQUESTS_CODE or attempt == MAX_RETRIES:
+                break
+            time.sleep(retry_delay(r, attempt))
         return r.ok
     except requests.exceptions.RequestException as e:
         if not quiet:
@@ -81,62 +128,81 @@ def send_request(resource, data=None, quiet=False):
             return False
 
 
-def request_user_details(screen_name):
+def job_data(data, priority):
+    """
+    add the scheduling arguments (priority and campaign) to the data of a mining request
+    :param data: dictionary
+    :param priority: integer
+    :return: the given dictionary
+    """
+    data['priority'] = priority
+    if campaign is not None:
+        data['campaign'] = campaign
+    return data
+
+
+def request_user_details(screen_name, priority=0):
     """
     :param screen_name:
+    :param priority:
     :return: True on a successful response
     """
-    data = {'screen_name': screen_name}
+    data = job_data({'screen_name': screen_name}, priority)
     return send_request('/mine/user_details', data)
 
 
-def request_friends_ids(screen_name, limit=0):
+def request_friends_ids(screen_name, limit=0, priority=0):
     """
     :param screen_name:
     :param limit:
+    :param priority:
     :return: True on a successful response
     """
-    data = {'screen_name': screen_name, 'limit': limit}
+    data = job_data({'screen_name': screen_name, 'limit': limit}, priority)
     return send_request('/mine/friends_ids', data)
 
 
-def request_followers_ids(screen_name, limit=0):
+def request_followers_ids(screen_name, limit=0, priority=0):
     """
     :param screen_name:
     :param limit:
+    :param priority:
     :return: True on a successful response
     """
-    data = {'screen_name': screen_name, 'limit': limit}
+    data = job_data({'screen_name': screen_name, 'limit': limit}, priority)
     return send_request('/mine/followers_ids', data)
 
 
-def request_tweets(screen_name, limit=0):
+def request_tweets(screen_name, limit=0, priority=0):
     """
     :param screen_name:
     :param limit:
+    :param priority:
     :return: True on a successful response
     """
-    data = {'screen_name': screen_name, 'limit': limit}
+    data = job_data({'screen_name': screen_name, 'limit': limit}, priority)
     return send_request('/mine/tweets', data)
 
 
-def request_likes(screen_name, limit=0):
+def request_likes(screen_name, limit=0, priority=0):
     """
     :param screen_name:
     :param limit:
+    :param priority:
     :return: True on a successful response
     """
-    data = {'screen_name': screen_name, 'limit': limit}
+    data = job_data({'screen_name': screen_name, 'limit': limit}, priority)
     return send_request('/mine/likes', data)
 
 
-def request_neighbors(screen_name, limit=0):
+def request_neighbors(screen_name, limit=0, priority=0):
     """
     :param screen_name:
     :param limit:
+    :param priority:
     :return: True on a successful response
     """
-    data = {'screen_name': screen_name, 'limit': limit}
+    data = job_data({'screen_name': screen_name, 'limit': limit}, priority)
     return send_request('/mine/neighbors', data)
 
 
@@ -158,12 +224,112 @@ def request_server_shutdown():
     return send_request('/shutdown', quiet=True)
 
 
+def request_wait():
+    """
+    wait until all mining requests of the campaign are finished. the daemon answers every wait
+    request after a while, so the request is repeated until the campaign is finished
+    :return: the status of the campaign (a dictionary with the number of jobs in every state), or
+             None if a request failed
+    """
+    assert server_host_port != ''
+    data = json.dumps({'campaign': campaign if campaign is not None else DEFAULT_CAMPAIGN})
+    try:
+        while True:
+            r = session.post(server_host_port + '/wait', data=data, headers=headers,
+                             timeout=WAIT_TIMEOUT)
+            if not r.ok:
+                print('server responded with status', r.status_code)
+                return None
+            status = r.json()
+            if status['finished']:
+                return status['campaign']
+    except requests.exceptions.RequestException as e:
+        print(e)
+        return None
+
+
+def request_batch(jobs):
+    """
+    send many mining jobs in a single request. jobs that the daemon rejects because their queue is
+    full are sent again (up to MAX_RETRIES times)
+    :param jobs: list of dictionaries, each with the key 'type' (a job type, e.g. 'tweets') and
+                 the arguments of the job
+    :return: list of the results of the jobs (dictionaries with the key 'success', and 'error' for
+             rejected jobs), or None if the request failed
+    """
+    assert server_host_port != ''
+    results = [None] * len(jobs)
+    pending = list(range(len(jobs)))  # indices of the jobs to send
+    try:
+        for attempt in range(MAX_RETRIES + 1):
+            data = ''.join(json.dumps(jobs[i]) + '\n' for i in pending)
+            r = session.post(server_host_port + '/mine/batch', data=data.encode('utf-8'),
+                             headers=batch_headers, timeout=BATCH_TIMEOUT)
+            if not r.ok and r.status_code != TOO_MANY_REQUESTS_CODE:
+                print('server responded with status', r.status_code)
+                return None
+            for result in r.json()['results']:
+                # line numbers of a resent request are relative to it
+                index = pending[result['line'] - 1]
+                result['line'] = index + 1
+                results[index] = result
+            pending = [i for i in pending if results[i].get('retry')]
+            if not pending or attempt == MAX_RETRIES:
+                break
+            time.sleep(retry_delay(r, attempt))
+        return results
+    except requests.exceptions.RequestException as e:
+        print(e)
+        return None
+
+
 RESOURCE_IDX = 1
 SCR_NAME_IDX = 3
 LIMIT_IDX = 4
 LISTEN_TYPE_IDX = 2
 LISTEN_PARAM_IDX = 3
 STOP_KEYWORD_IDX = 4
+PRIORITY_KEYWORD = 'priority'
+MINE_COMMAND_USAGE = 'mine <resource> of <screen_name> [limit] [priority <priority>]'
+
+
+def parse_mine_command(command):
+    """
+    parse the tokens of a mine command by their positions, so a screen name may be any word
+    (including 'priority')
+    :param command: string. a mine command
+    :return: tuple (resource, screen_name, limit, priority)
+    :raise ValueError: if the command is not a valid mine command
+    """
+    tokens = command.split()
+    if len(tokens) <= SCR_NAME_IDX or tokens[0] != 'mine' or tokens[2] != 'of' or \
+            tokens[RESOURCE_IDX] not in RESOURCE_JOB_TYPES:
+        raise ValueError('usage: {0}'.format(MINE_COMMAND_USAGE))
+    resource = tokens[RESOURCE_IDX]
+    screen_name = tokens[SCR_NAME_IDX]
+    options = tokens[LIMIT_IDX:]
+    limit = 0
+    if options and options[0].isdecimal():
+        limit = int(options.pop(0))
+    priority = 0
+    if options:
+        if len(options) != 2 or options[0] != PRIORITY_KEYWORD or \
+                not re.fullmatch(r'-?\d+', options[1]):
+            raise ValueError('usage: {0}'.format(MINE_COMMAND_USAGE))
+        priority = int(options[1])
+    return resource, screen_name, limit, priority
+
+
+def mine_command_job(command):
+    """
+    :param command: string. a valid mine command (see parse_mine_command)
+    :return: the job of the command for a batch request (see request_batch)
+    """
+    resource, screen_name, limit, priority = parse_mine_command(command)
+    job = {'type': RESOURCE_JOB_TYPES[resource], 'screen_name': screen_name}
+    if resource != 'details':
+        job['limit'] = limit
+    return job_data(job, priority)
 
 
 def execute_single_command(command):
@@ -172,26 +338,24 @@ def execute_single_command(command):
     """
     ok = False
     if mine_command_regex.fullmatch(command):
+        try:
+            resource, screen_name, limit, priority = parse_mine_command(command)
+        except ValueError as e:
+            print('Invalid command: {0} ({1})'.format(command, e))
+            return
         print('sending request "{0}"... '.format(command), end='')
-        tokens = command.split()
-        resource = tokens[RESOURCE_IDX]
-        screen_name = tokens[SCR_NAME_IDX]
-        if len(tokens) > LIMIT_IDX:
-            limit = int(tokens[LIMIT_IDX])
-        else:
-            limit = 0
         if resource == 'details':
-            ok = request_user_details(screen_name)
+            ok = request_user_details(screen_name, priority)
         elif resource == 'friends':
-            ok = request_friends_ids(screen_name, limit)
+            ok = request_friends_ids(screen_name, limit, priority)
         elif resource == 'followers':
-            ok = request_followers_ids(screen_name, limit)
+            ok = request_followers_ids(screen_name, limit, priority)
         elif resource == 'tweets':
-            ok = request_tweets(screen_name, limit)
+            ok = request_tweets(screen_name, limit, priority)
         elif resource == 'likes':
-            ok = request_likes(screen_name, limit)
+            ok = request_likes(screen_name, limit, priority)
         elif resource == 'neighbors':
-            ok = request_neighbors(screen_name, limit)
+            ok = request_neighbors(screen_name, limit, priority)
 
     elif listen_command_regex.fullmatch(command):
         print('sending request "{0}"... '.format(command), end='')
@@ -209,6 +373,12 @@ def execute_single_command(command):
             ok = request_listen(mode, track=params)
         else:
             raise ValueError('unsupported listen type')
+    elif wait_command.fullmatch(command):
+        print('waiting for all mining requests to finish... ', end='', flush=True)
+        status = request_wait()
+        ok = status is not None
+        if ok:
+            print('{0} jobs done, {1} failed. '.format(status['done'], status['failed']), end='')
     elif server_shutdown_command.fullmatch(command):
         print('sending request "{0}"... '.format(command), end='')
         request_server_shutdown()
@@ -237,6 +407,58 @@ def execute_commands(stream):
             execute_single_command(line)
 
 
+def execute_batch(commands):
+    """
+    send mine commands to the daemon in a single request
+    :param commands: list of valid mine commands
+    """
+    if not commands:
+        return
+    print('sending {0} mining requests... '.format(len(commands)), end='')
+    results = request_batch([mine_command_job(command) for command in commands])
+    if results is None:
+        print('Failed. Check server log for more details')
+        return
+    failed = [(command, result) for command, result in zip(commands, results)
+              if not result['success']]
+    if not failed:
+        print('Done')
+        return
+    print('{0} failed'.format(len(failed)))
+    for command, result in failed:
+        print('request "{0}" failed: {1}'.format(command, result['error']['message']))
+
+
+def execute_commands_in_batches(stream):
+    """
+    like execute_commands(), but mine commands are sent in batches of up to BATCH_SIZE commands.
+    other commands are sent on their own, after all commands that precede them
+    :param stream: file-like stream of commands, separated with newlines
+    """
+    batch = []
+    for line in stream:
+        line = line.rstrip('\n')
+        if line == '':
+            continue
+        elif line == 'exit':
+            break
+        elif mine_command_regex.fullmatch(line):
+            try:
+                parse_mine_command(line)
+            except ValueError as e:
+                print('Invalid command: {0} ({1})'.format(line, e))
+                continue
+            batch.append(line)
+            if len(batch) >= BATCH_SIZE:
+                execute_batch(batch)
+                batch = []
+        else:
+            execute_batch(batch)
+            batch = []
+            execute_single_command(line)
+    execute_batch(batch)
+
+
 def interactive_mode():
     """
     run the client in interactive mode
@@ -253,7 +475,7 @@ def script_mode(script):
     :param script: path to commands file
     """
     stream = open(script)
-    execute_commands(stream)
+    execute_commands_in_batches(stream)
     stream.close()
 
 
@@ -266,6 +488,7 @@ def init_host_port(client_conf_file):
 
 if __name__ == '__main__':
     args = parse_args()
+    campaign = args.campaign
     client_conf_file = args.conf
     init_host_port(client_conf_file)
     if not check_connection():
@@ -3,7 +3,8 @@ import json
 import logging
 import sys
 
-from TwitterMine.server import Server
+from TwitterMine.miner import get_credentials
+from TwitterMine.server import CONNECTION_LIMIT, HTTP_THREADS, SERVING_MODES, Server
 
 
 def init_logger(log_file):
@@ -23,6 +24,7 @@ def init_logger(log_file):
     logging.getLogger('requests_oauthlib').setLevel(logging.WARNING)
     logging.getLogger('urllib3').setLevel(logging.WARNING)
     logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    logging.getLogger('waitress').setLevel(logging.WARNING)
 
 
 def parse_args():
@@ -38,38 +40,49 @@ def parse_args():
     parser.add_argument('-a', '--auth-type', metavar='auth_type', required=False, type=str,
                         choices=['app', 'user'], default='app',
                         help='authentication type for twitter api ("app" or "user")')
+    parser.add_argument('-e', '--engine', metavar='engine', required=False, type=str,
+                        choices=['threads', 'asyncio'], default='threads',
+                        help='mining engine: a thread per job type and credential ("threads") '
+                             'or a single asyncio event loop ("asyncio")')
+    parser.add_argument('-m', '--mode', metavar='mode', required=False, type=str,
+                        choices=SERVING_MODES, default='production',
+                        help='serving mode: a multi-threaded production server ("production", '
+                             'requires waitress) or Flask\'s development server ("dev")')
     return parser.parse_args()
 
 
-def start(server_conf_file, auth_type):
+def start(server_conf_file, auth_type, engine, mode):
     """
-    read the configurations for the server and start it.
+    read the configurations for the server and start it. the server runs until it receives SIGTERM
     :param server_conf_file: path to config file
-    :param auth_type: Twitter auth type: 'app' or 'user'
+    :param auth_type: Twitter auth type: 'app' or 'user'. applies to all credentials in the config
+    :param engine: the mining engine: 'threads' or 'asyncio'
+    :param mode: the serving mode: 'production' or 'dev'
     :return:
     """
     with open(server_conf_file) as f:
         config = json.load(f)
     init_logger(config['log_file'])
-    consumer_key = config['consumer_key']
-    consumer_secret = config['consumer_secret']
-    access_token_key = None
-    access_token_secret = None
+    credentials = get_credentials(config, app_auth=(auth_type == 'app'))
     data_dir = config['data_dir']
     port = config['port']
+    job_freshness = config.get('job_freshness', 0)
+    fsync = config.get('fsync', 'never')
+    queue_limits = config.get('queue_limits') or None
+    overflow = config.get('queue_overflow', 'spill')
 
-    if auth_type == 'user':
-        access_token_key = config['access_token_key']
-        access_token_secret = config['access_token_secret']
-    server = Server(consumer_key, consumer_secret, access_token_key, access_token_secret, data_dir,
-                    port)
+    server = Server(credentials, data_dir, port, job_freshness, engine, fsync, queue_limits,
+                    overflow)
     logging.getLogger().info('Running REST server')
     try:
-        server.run()
+        server.run(mode=mode, threads=config.get('http_threads', HTTP_THREADS),
+                   connection_limit=config.get('connection_limit', CONNECTION_LIMIT),
+                   drain=config.get('drain_jobs', False),
+                   interrupt=config.get('interrupt_jobs', False))
     except Exception as e:
         logging.critical(str(e))
 
 
 if __name__ == '__main__':
     args = parse_args()
-    start(args.conf, args.auth_type)
+    start(args.conf, args.auth_type, args.engine, args.mode)
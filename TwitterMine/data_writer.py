@@ -1,18 +1,89 @@
 import os
 import json
 import logging
+import time
 from threading import Lock
 
+from TwitterMine import ids_file, neighbors_file
+from TwitterMine.layout import BINARY_FORMAT, DataLayout
+from TwitterMine.manifest import MANIFEST_FILE_NAME, Manifest
+from TwitterMine.snapshots import SnapshotStore
+from TwitterMine.storage import BINARY_RECORDS, FSYNC_NEVER, GZIP, GZIP_SUFFIX, compress, \
+    open_storage
+from TwitterMine.stream_writer import StreamWriter, read_stream
+
 NEWLINE = '\n'
 # directory for writing stream tweets. prefix '#' is necessary so this dir will not be in conflict
 # with a legal twitter screen name
 STREAMS_TOP_DIR_NAME = '#streams'
+CHECKPOINTS_FILE_NAME = 'checkpoints'
+SNAPSHOTS_DIR_SUFFIX = '.snapshots'
+LATEST_IDS_FILE_NAME = 'latest_ids'
+
+
+def _mtime(path):
+    """
+    :return: the modification time of a record file (compressed or not), or the current time if the
+             record is not kept in a file
+    """
+    for p in [path, path + GZIP_SUFFIX]:
+        if os.path.isfile(p):
+            return os.path.getmtime(p)
+    return time.time()
+
+
+def scan_resources(layout, storage):
+    """
+    :param layout: DataLayout of the data dir
+    :param storage: the storage of the data dir (see storage.open_storage)
+    :return: generator of the manifest entries (see Manifest) of all resources in the data dir, in
+             the storage or as binary files. sizes are taken from the storage (compressed records
+             count their compressed bytes), and only user details are read
+    """
+    for screen_name in storage.users():
+        user_dir = layout.user_dir(screen_name)
+        for name in storage.names(screen_name):
+            entry = {'user': screen_name, 'resource': name, 'size': storage.size(screen_name, name),
+                     'mtime': _mtime(os.path.join(user_dir, name))}
+            if name == 'user_details':
+                details = json.loads(storage.read(screen_name, name))
+                entry['followers_count'] = details.get('followers_count')
+                entry['id'] = details.get('id')
+            yield entry
+    for screen_name, user_dir in layout.users():
+        for name, suffix in BINARY_RECORDS.items():
+            path = os.path.join(user_dir, name + suffix)
+            if os.path.isfile(path):
+                yield {'user': screen_name, 'resource': name, 'size': os.path.getsize(path),
+                       'mtime': os.path.getmtime(path)}
+
+
+def open_manifest(layout, storage, read_only=False):
+    """
+    :param read_only: whether the manifest is only read, e.g. while a miner may write to the data
+                      dir (see Manifest)
+    :return: the loaded Manifest of the data dir. built from the data dir if it doesn't exist (see
+             scan_resources)
+    """
+    manifest = Manifest(os.path.join(layout.data_dir, MANIFEST_FILE_NAME),
+                        lambda: scan_resources(layout, storage), read_only)
+    manifest.load()
+    return manifest
 
 
 class DataWriter:
-    def __init__(self, data_dir):
+    """
+    Writes the mined data to the data dir. The records of every user (details, tweets, followers,
+    etc.) are kept in the storage of the data dir (see storage.open_storage): a file for every
+    record by default, or a single database file
+    """
+
+    def __init__(self, data_dir, group_commit=False, fsync=FSYNC_NEVER):
         """
         :param data_dir: the main data directory
+        :param group_commit: whether user records are written in batches by a single writer thread
+                             (see storage.GroupCommitStorage). close() writes the queued records
+        :param fsync: the fsync policy of group commit (see storage.FSYNC_POLICIES)
         """
         self.data_dir = data_dir
         if not os.path.isdir(data_dir):
@@ -20,29 +91,30 @@ class DataWriter:
         self.streams_top_dir = os.path.join(self.data_dir, STREAMS_TOP_DIR_NAME)
         if not os.path.isdir(self.streams_top_dir):
             os.makedirs(self.streams_top_dir)
+        self.layout = DataLayout(data_dir)
+        self.storage = open_storage(self.layout, group_commit, fsync)
+        self.names = neighbors_file.NamesDictionary(
+            os.path.join(data_dir, neighbors_file.NAMES_FILE_NAME))
+        # which resources every user has, without touching the storage (see Manifest)
+        # a missing manifest is built now, before anything is written
+        self.manifest = open_manifest(self.layout, self.storage)
         self.logger = logging.getLogger()
-        self.init_dir_lock = Lock()
-
-    def _get_user_dir(self, scr_name):
-        return os.path.join(self.data_dir, scr_name)
+        self.records_lock = Lock()
+        self.stats_lock = Lock()
+        self.records_written = 0  # number of writes of user records (see metrics of Miner)
+        self.bytes_written = 0  # bytes of (uncompressed) data in these writes
 
-    def _init_user_dir(self, scr_name):
+    def _count_write(self, size):
         """
-        creates a directory for a user, if not already exist.
-        the created directory will not contain any user information.
-        this functions is used for when new data should be stored under this user (i.e. a tweet
-        by this user was added, but user details weren't)
-
-        :param scr_name: string, the screen name of the user
-        :return: the user's directory full path
+        count a write of a user record
+        :param size: bytes of data that were written
         """
-        user_dir = self._get_user_dir(scr_name)
-        self.init_dir_lock.acquire()  # two threads may try to write different data to the same
-        # user at the same time
-        if not os.path.isdir(user_dir):
-            os.mkdir(user_dir)
-        self.init_dir_lock.release()
-        return user_dir
+        with self.stats_lock:
+            self.records_written += 1
+            self.bytes_written += size
+
+    def _get_user_dir(self, scr_name):
+        return self.layout.user_dir(scr_name)
 
     def _init_stream_dir(self, stream_str):
         """
@@ -58,7 +130,101 @@ class DataWriter:
         """
         :return: True if the database contains the details of the given user
         """
-        return os.path.isfile(os.path.join(self._get_user_dir(screen_name), 'user_details'))
+        return self.manifest.exists(screen_name, 'user_details')
+
+    def user_resources(self, screen_name):
+        """
+        :return: set of the names of the resources stored for the user (e.g. 'user_details',
+                 'tweets', 'followers'), in any format
+        """
+        return self.manifest.user_resources(screen_name)
+
+    def _read_record(self, screen_name, file_name, key):
+        """
+        :param screen_name: the user to which the record relates
+        :param file_name: the name of the records file of the user (a json dictionary)
+        :param key: the key of the record
+        :return: the record stored under key in the records file of the user, or None
+        """
+        with self.records_lock:
+            data = self.storage.read(screen_name, file_name)
+            if data is None:
+                return None
+            return json.loads(data).get(key)
+
+    def _write_record(self, screen_name, file_name, key, record):
+        """
+        store a record under key in the records file of the user
+        :param record: json serializable object, or None to remove the record
+        """
+        with self.records_lock:
+            data = self.storage.read(screen_name, file_name)
+            records = json.loads(data) if data is not None else dict()
+            if record is None:
+                records.pop(key, None)
+            else:
+                records[key] = record
+            # the storage replaces the records atomically, so a crash can't leave corrupted records
+            data = json.dumps(records)
+            self.storage.write(screen_name, file_name, data)
+        size = len(data.encode('utf-8'))
+        self._count_write(size)
+        self.manifest.add(screen_name, file_name, size)
+
+    def get_checkpoint(self, screen_name, resource):
+        """
+        :param screen_name: the user to which the checkpoint relates
+        :param resource: the name of the data file the checkpoint relates to (e.g. 'followers')
+        :return: the checkpoint dictionary stored for this user and resource, or None
+        """
+        return self._read_record(screen_name, CHECKPOINTS_FILE_NAME, resource)
+
+    def write_checkpoint(self, screen_name, resource, checkpoint):
+        """
+        store the progress of a mining job, so it can be resumed after an interruption. should be
+        called right after the data up to this checkpoint was written.
+
+        :param screen_name: the user to which the checkpoint relates
+        :param resource: the name of the data file the checkpoint relates to (e.g. 'followers')
+        :param checkpoint: json serializable dictionary, or None to remove the checkpoint
+        """
+        self._write_record(screen_name, CHECKPOINTS_FILE_NAME, resource, checkpoint)
+
+    def get_latest_id(self, screen_name, resource):
+        """
+        :param screen_name: the user to which the data relates
+        :param resource: the name of a data file of tweets ('tweets', 'likes' or 'neighbors')
+        :return: the id of the newest tweet stored in the given data file of the user, or None if
+                 no tweets are stored
+        """
+        latest_id = self._read_record(screen_name, LATEST_IDS_FILE_NAME, resource)
+        if latest_id is None:
+            # data that was written before latest ids were recorded
+            latest_id = self._newest_stored_id(screen_name, resource)
+        return latest_id
+
+    def write_latest_id(self, screen_name, resource, latest_id):
+        """
+        record the id of the newest tweet stored in the given data file of the user
+        """
+        self._write_record(screen_name, LATEST_IDS_FILE_NAME, resource, latest_id)
+
+    def _newest_stored_id(self, screen_name, resource):
+        """
+        find the newest tweet in a data file of the user, by reading the whole file
+        :return: the id of the newest tweet, or None
+        """
+        if resource == 'neighbors':
+            return max((tweet_id for name, tweet_id, type in self.read_neighbors(screen_name)),
+                       default=None)
+        newest = None
+        for line in self.storage.read_lines(screen_name, resource):
+            if not line.strip():
+                continue
+            tweet_id = json.loads(line)['id']
+            if newest is None or tweet_id > newest:
+                newest = tweet_id
+        return newest
 
     def write_user(self, details):
         """
@@ -66,23 +232,91 @@ class DataWriter:
         database, they will be override.
         :param details: dictionary with the details to write. must include at least one key 'id'
         """
-        user_dir = self._init_user_dir(details['screen_name'])
-        user_info_file = os.path.join(user_dir, 'user_details')
-        # even if this file exist we override it with the new data
+        # even if the details exist we override them with the new data
         data = json.dumps(details, indent=4, sort_keys=True)
         # self.logger.info('writing user details for {0}'.format(details['screen_name']))
-        with open(user_info_file, mode='w+') as f:
-            f.write(data)
+        self.storage.write(details['screen_name'], 'user_details', data)
+        size = len(data.encode('utf-8'))
+        self._count_write(size)
+        self.manifest.add(details['screen_name'], 'user_details', size,
+                          followers_count=details.get('followers_count'), id=details.get('id'))
+
+    def _write_lines(self, screen_name, name, lines, append=True):
+        """
+        write lines to a record of the user
+        :param lines: iterable of strings without newline characters
+        :param append: whether to append the lines to the record or replace it
+        """
+        data = ''.join(line + NEWLINE for line in lines)
+        if append:
+            if not data:
+                return
+            self.storage.append(screen_name, name, data)
+        else:
+            self.storage.write(screen_name, name, data)
+        size = len(data.encode('utf-8'))
+        self._count_write(size)
+        self.manifest.add(screen_name, name, size, append)
+
+    def _ids_file(self, screen_name, resource):
+        """
+        :return: the path of the binary ids file of the given resource ('friends' or 'followers').
+                 binary ids files are always kept in the user directory, so they can be memory
+                 mapped
+        """
+        return os.path.join(self._get_user_dir(screen_name), resource + ids_file.FILE_SUFFIX)
+
+    def _write_friends_followers(self, screen_name, name, ids, append):
+        """
+        write the ids in the ids list to the given record, according to the append parameter, in
+        the ids format of the data dir (text lines or a binary ids file)
+        """
+        binary = self.layout.ids_format == BINARY_FORMAT
+        ids_file_path = self._ids_file(screen_name, name)
+        has_binary = os.path.isfile(ids_file_path)
+        has_text = self.storage.exists(screen_name, name)
+        if append and (has_text if binary else has_binary):
+            # the list was started in the other format. convert it
+            ids = list(self.read_ids(screen_name, name)) + list(ids)
+            append = False
+        if binary:
+            ids = list(ids)
+            os.makedirs(self._get_user_dir(screen_name), exist_ok=True)
+            ids_file.write_ids(ids_file_path, ids, append)
+            self._count_write(len(ids) * ids_file.ID_SIZE)
+            self.manifest.add(screen_name, name, os.path.getsize(ids_file_path))
+            if not append and has_text:
+                self.storage.delete(screen_name, name)
+        else:
+            self._write_lines(screen_name, name, map(str, ids), append)
+            if not append and has_binary:
+                os.remove(ids_file_path)
+
+    def read_ids(self, screen_name, resource):
+        """
+        :param screen_name: the screen name of the user
+        :param resource: 'friends' or 'followers'
+        :return: iterable of the stored ids of the list, in either format
+        """
+        ids_file_path = self._ids_file(screen_name, resource)
+        if os.path.isfile(ids_file_path):
+            return ids_file.read_ids(ids_file_path)
+        return (int(line) for line in self.storage.read_lines(screen_name, resource)
+                if line.strip())
 
-    def _write_friends_followers(self, file, ids, append):
+    def read_ids_array(self, screen_name, resource):
         """
-        write the ids in the ids list to the given file, opened according to the append parameter
+        the stored ids of the list as a numpy array, for vectorized processing. a binary ids file is
+        memory mapped without copying it (see ids_file.memmap_ids). requires numpy
+        :param screen_name: the screen name of the user
+        :param resource: 'friends' or 'followers'
+        :return: numpy array of uint64
         """
-        mode = 'a+' if append else 'w+'
-        with open(file, mode=mode) as f:
-            for id in ids:
-                f.write(str(id))
-                f.write(NEWLINE)
+        ids_file_path = self._ids_file(screen_name, resource)
+        if os.path.isfile(ids_file_path):
+            return ids_file.memmap_ids(ids_file_path)
+        import numpy as np
+        return np.fromiter(self.read_ids(screen_name, resource), dtype=ids_file.NUMPY_DTYPE)
 
     def write_friends(self, friends_ids, screen_name, append=True):
         """
@@ -92,10 +326,8 @@ class DataWriter:
                        replace it.
         :return:
         """
-        user_dir = self._init_user_dir(screen_name)
-        user_friends_file = os.path.join(user_dir, 'friends')
         # self.logger.info('writing friends of {0}'.format(screen_name))
-        self._write_friends_followers(user_friends_file, friends_ids, append)
+        self._write_friends_followers(screen_name, 'friends', friends_ids, append)
 
     def write_followers(self, followers_ids, screen_name, append=True):
         """
@@ -105,10 +337,42 @@ class DataWriter:
                        or replace it.
         :return:
         """
-        user_dir = self._init_user_dir(screen_name)
-        user_friends_file = os.path.join(user_dir, 'followers')
         # self.logger.info('writing followers of {0}'.format(screen_name))
-        self._write_friends_followers(user_friends_file, followers_ids, append)
+        self._write_friends_followers(screen_name, 'followers', followers_ids, append)
+
+    def _snapshots(self, screen_name, resource):
+        return SnapshotStore(os.path.join(self._get_user_dir(screen_name),
+                                          resource + SNAPSHOTS_DIR_SUFFIX))
+
+    def add_ids_snapshot(self, screen_name, resource):
+        """
+        store the current list of friends or followers of the user as a new snapshot, so its
+        changes can be tracked over time (see snapshots.SnapshotStore)
+        :param screen_name: the screen name of the user
+        :param resource: 'friends' or 'followers'
+        :return: the number of the new snapshot
+        """
+        return self._snapshots(screen_name, resource).add_snapshot(self.read_ids(screen_name,
+                                                                                 resource))
+
+    def get_ids_snapshots(self, screen_name, resource):
+        """
+        :param screen_name: the screen name of the user
+        :param resource: 'friends' or 'followers'
+        :return: list of the headers of the snapshots of the list. each is a dictionary with the
+                 keys 'snapshot', 'time', 'count', 'added' and 'removed' (and some more)
+        """
+        return self._snapshots(screen_name, resource).snapshots()
+
+    def get_ids_changes(self, screen_name, resource, since):
+        """
+        :param screen_name: the screen name of the user
+        :param resource: 'friends' or 'followers'
+        :param since: snapshot number. -1 for all ids of the latest snapshot
+        :return: tuple (added, removed) of sets of the ids that were added to the list and removed
+                 from it since the given snapshot
+        """
+        return self._snapshots(screen_name, resource).changes_since(since)
 
     def write_tweets_of_user(self, tweets, screen_name):
         """
@@ -119,13 +383,18 @@ class DataWriter:
         :return:
         """
         # self.logger.info('writing tweets')
-        user_dir = self._init_user_dir(screen_name)
-        tweets_file_path = os.path.join(user_dir, 'tweets')
-        with open(tweets_file_path, 'a+') as f:
-            for t in tweets:
-                data = json.dumps(t).replace(NEWLINE, ' ')
-                f.write(data)
-                f.write(NEWLINE)
+        self._write_lines(screen_name, 'tweets',
+                          (json.dumps(t).replace(NEWLINE, ' ') for t in tweets))
+
+    def read_tweets_of_user(self, screen_name):
+        """
+        :param screen_name: the screen name of the user
+        :return: generator of the stored tweets by the user (dictionaries). nothing if the user has
+                 no stored tweets
+        """
+        for line in self.storage.read_lines(screen_name, 'tweets'):
+            if line.strip():
+                yield json.loads(line)
 
     def write_tweets_of_stream(self, tweets, stream_str):
         """
@@ -140,11 +409,35 @@ class DataWriter:
         """
         stream_dir = self._init_stream_dir(stream_str)  # e.g. data_dir/#streams/<stream_str>
         stream_file = os.path.join(stream_dir, 'tweets')
-        with open(stream_file, 'a+') as f:
-            for t in tweets:
-                data = json.dumps(t).replace(NEWLINE, ' ')
+        data = ''.join(json.dumps(t).replace(NEWLINE, ' ') + NEWLINE for t in tweets)
+        if self.layout.compression == GZIP:
+            with open(stream_file + GZIP_SUFFIX, 'ab') as f:
+                f.write(compress(data))
+        else:
+            with open(stream_file, 'a+') as f:
                 f.write(data)
-                f.write(NEWLINE)
+
+    def open_stream(self, stream_str):
+        """
+        open a buffered writer for the tweets of a stream. unlike write_tweets_of_stream(), the
+        returned writer keeps its file open and writes tweets in batches, to segments in the stream
+        directory (see StreamWriter). it must be closed when the stream ends.
+
+        :param stream_str: a string representation of the stream (the stream directory name)
+        :return: StreamWriter object
+        """
+        return StreamWriter(self._init_stream_dir(stream_str), compression=self.layout.compression)
+
+    def read_tweets_of_stream(self, stream_str):
+        """
+        :param stream_str: a string representation of the stream (the stream directory name)
+        :return: generator of all tweets of the stream (dictionaries), in the order they were
+                 written. compressed tweets are decompressed while reading
+        """
+        stream_dir = os.path.join(self.streams_top_dir, stream_str)
+        if not os.path.isdir(stream_dir):
+            return iter([])
+        return read_stream(stream_dir)
 
     def write_likes(self, tweets, screen_name):
         """
@@ -156,24 +449,72 @@ class DataWriter:
         :return:
         """
         # self.logger.info('writing likes')
-        user_dir = self._init_user_dir(screen_name)
-        tweets_file_path = os.path.join(user_dir, 'likes')
-        with open(tweets_file_path, 'a+') as f:
-            for t in tweets:
-                data = json.dumps(t).replace(NEWLINE, ' ')
-                f.write(data)
-                f.write(NEWLINE)
+        self._write_lines(screen_name, 'likes',
+                          (json.dumps(t).replace(NEWLINE, ' ') for t in tweets))
+
+    def _neighbors_file(self, screen_name):
+        """
+        :return: the path of the binary neighbors file of the user
+        """
+        return os.path.join(self._get_user_dir(screen_name),
+                            'neighbors' + neighbors_file.FILE_SUFFIX)
 
-    def write_neighbors(self, neighbors, screen_name):
+    def write_neighbors(self, neighbors, screen_name, append=False):
         """
-        :param neighbors: list of strings
+        write neighbors in the neighbors format of the data dir: text lines, or binary records with
+        interned screen names (see neighbors_file)
+        :param neighbors: list of strings in the format neighbor_screen_name;tweet_id;type
         :param screen_name: the user to write neighbors to
+        :param append: whether to append to the existing neighbors of the user (e.g. when
+                       neighbors of newer tweets are added to the stored ones)
+        """
+        binary = self.layout.neighbors_format == BINARY_FORMAT
+        binary_file = self._neighbors_file(screen_name)
+        has_binary = os.path.isfile(binary_file)
+        has_text = self.storage.exists(screen_name, 'neighbors')
+        if append and (has_text if binary else has_binary):
+            # the neighbors were started in the other format. convert them
+            neighbors = ['{0};{1};{2}'.format(*n) for n in self.read_neighbors(screen_name)] + \
+                        list(neighbors)
+            append = False
+        # since a neighbor may be counted multiple times, it is important to overwrite any previous
+        # data already in users, unless the given neighbors are of other tweets
+        if binary:
+            tokens = [n.split(';') for n in neighbors]
+            name_ids = self.names.intern([t[0] for t in tokens])
+            records = [(int(t[1]), name_id, int(t[2])) for t, name_id in zip(tokens, name_ids)]
+            os.makedirs(self._get_user_dir(screen_name), exist_ok=True)
+            neighbors_file.write_neighbors(binary_file, records, append)
+            self._count_write(len(records) * neighbors_file.RECORD.size)
+            self.manifest.add(screen_name, 'neighbors', os.path.getsize(binary_file))
+            if not append and has_text:
+                self.storage.delete(screen_name, 'neighbors')
+        else:
+            self._write_lines(screen_name, 'neighbors', neighbors, append)
+            if not append and has_binary:
+                os.remove(binary_file)
+
+    def read_neighbors(self, screen_name):
+        """
+        :param screen_name: the screen name of the user
+        :return: list of the stored neighbors of the user, in either format, as tuples
+                 (neighbor_screen_name, tweet_id, type)
+        """
+        binary_file = self._neighbors_file(screen_name)
+        if os.path.isfile(binary_file):
+            names = self.names.all_names()
+            return [(names[neighbor], tweet_id, type)
+                    for tweet_id, neighbor, type in neighbors_file.read_neighbors(binary_file)]
+        neighbors = []
+        for line in self.storage.read_lines(screen_name, 'neighbors'):
+            if line.strip():
+                name, tweet_id, type = line.split(';')
+                neighbors.append((name, int(tweet_id), int(type)))
+        return neighbors
+
+    def close(self):
+        """
+        close the storage. the writer should not be used afterwards
         """
-        user_dir = self._init_user_dir(screen_name)
-        user_neighbors_file = os.path.join(user_dir, 'neighbors')
-        mode = 'w'  # since a neighbor may be counted multiple times, it is important to overwrite
-        # any previous data already in users
-        with open(user_neighbors_file, mode=mode, encoding='utf-8') as f:
-            for n in neighbors:
-                f.write(n)
-                f.write('\n')
+        self.storage.close()
+        self.manifest.close()
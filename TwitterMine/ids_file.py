@@ -0,0 +1,80 @@
+import os
+import sys
+from array import array
+
+# binary ids file: a 16 bytes header (8 bytes magic, 4 bytes version, 4 bytes reserved), followed by
+# the ids as little endian uint64. the number of ids is derived from the file size, so ids can be
+# appended without touching the header. the header size keeps the ids 8 bytes aligned for memmap
+MAGIC = b'TMIDS\x00\x00\x00'
+VERSION = 1
+HEADER = MAGIC + VERSION.to_bytes(4, 'little') + bytes(4)
+HEADER_SIZE = len(HEADER)
+ID_SIZE = 8
+TYPECODE = 'Q'
+NUMPY_DTYPE = '<u8'
+TMP_SUFFIX = '.tmp'
+FILE_SUFFIX = '.ids'  # the suffix of ids files in a user directory (e.g. 'followers.ids')
+
+
+def _to_bytes(ids):
+    data = array(TYPECODE, ids)
+    if sys.byteorder != 'little':
+        data.byteswap()
+    return data.tobytes()
+
+
+def _check_header(header, path):
+    if header[:len(MAGIC)] != MAGIC:
+        raise ValueError('{0} is not an ids file'.format(path))
+
+
+def write_ids(path, ids, append=True):
+    """
+    write ids to a binary ids file
+    :param path: the path of the file
+    :param ids: iterable of ids (non negative ints)
+    :param append: whether to append the ids to the file (created if not exist) or replace it. the
+                   replacement is atomic
+    """
+    data = _to_bytes(ids)
+    if append and os.path.isfile(path):
+        with open(path, mode='ab') as f:
+            f.write(data)
+        return
+    with open(path + TMP_SUFFIX, mode='wb') as f:
+        f.write(HEADER)
+        f.write(data)
+    os.replace(path + TMP_SUFFIX, path)
+
+
+def read_ids(path):
+    """
+    :param path: the path of a binary ids file
+    :return: array of the ids in the file (array.array of unsigned 64 bit)
+    """
+    ids = array(TYPECODE)
+    with open(path, mode='rb') as f:
+        _check_header(f.read(HEADER_SIZE), path)
+        data = f.read()
+    # ignore a partially written id at the end of the file
+    ids.frombytes(data[:len(data) - len(data) % ID_SIZE])
+    if sys.byteorder != 'little':
+        ids.byteswap()
+    return ids
+
+
+def memmap_ids(path):
+    """
+    map a binary ids file to memory without reading or copying it. requires numpy
+    :param path: the path of a binary ids file
+    :return: read only numpy.memmap of the ids (dtype uint64)
+    """
+    import numpy as np
+
+    with open(path, mode='rb') as f:
+        _check_header(f.read(HEADER_SIZE), path)
+    count = (os.path.getsize(path) - HEADER_SIZE) // ID_SIZE
+    if count == 0:
+        # numpy can't map an empty range
+        return np.zeros(0, dtype=NUMPY_DTYPE)
+    return np.memmap(path, dtype=NUMPY_DTYPE, mode='r', offset=HEADER_SIZE, shape=(count,))
@@ -0,0 +1,576 @@
+import json
+import sqlite3
+import time
+from queue import Empty, Full
+from threading import Condition
+
+STOP_SIGNAL = None
+
+# the states of a job. finished jobs (done or failed) are kept in the store for
+# FINISHED_RETENTION seconds, so their status can still be queried
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+JOB_STATES = [PENDING, RUNNING, DONE, FAILED]
+FINISHED_RETENTION = 7 * 24 * 3600
+PRUNE_INTERVAL = 3600  # seconds between removals of old finished jobs
+# columns of the jobs table that were added after it was created, with their definitions
+PROGRESS_COLUMNS = [('started', 'REAL'),
+                    ('ended', 'REAL'),
+                    ('items', 'INTEGER NOT NULL DEFAULT 0'),
+                    ('pages', 'INTEGER NOT NULL DEFAULT 0'),
+                    ('api_calls', 'INTEGER NOT NULL DEFAULT 0'),
+                    ('error', 'TEXT')]
+
+DEFAULT_PRIORITY = 0
+DEFAULT_CAMPAIGN = 'default'
+
+# what a full queue (see JobStore) does with a new job: raise queue.Full at once, wait for room (and
+# raise queue.Full after a timeout), or keep the job anyway. pending jobs are kept on the disk, so
+# spilling doesn't grow the memory of the daemon, only its backlog
+OVERFLOW_REJECT = 'reject'
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_SPILL = 'spill'
+OVERFLOW_POLICIES = [OVERFLOW_REJECT, OVERFLOW_BLOCK, OVERFLOW_SPILL]
+STATUS_QUERY_SIZE = 500  # maximum number of job ids in a single status query
+
+
+class JobStore:
+    """
+    A persistent store of mining jobs, kept in a single SQLite file.
+
+    Jobs stay in the store until they are acknowledged (see JobQueue.task_done), so jobs that were
+    pending or running when the daemon stopped are handed out again the next time the store is
+    opened. Jobs are read one at a time, so the store can hold millions of jobs without loading
+    them to memory.
+
+    Every job has an id (returned by JobQueue.put) and a status: its state (one of JOB_STATES), the
+    progress that the miner reported for it (items, pages and API calls, see update_progress) and
+    its error if it failed. Finished jobs are kept for FINISHED_RETENTION seconds for status
+    queries (see job_status, campaign_status and wait).
+
+    The store is thread safe. It is shared by all JobQueue objects (one for each job type)
+    """
+
+    def __init__(self, db_file, freshness=0, max_pending=None):
+        """
+        :param db_file: path to the SQLite file. created if not exist
+        :param freshness: seconds in which a finished job is considered fresh. a new job that is
+                          covered by a fresh finished job is skipped. 0 to never skip jobs
+        :param max_pending: dictionary of job type to the maximum number of pending jobs of that
+                            type (see JobQueue.put). types that are not in it are not bounded
+        """
+        self.db_file = db_file
+        self.freshness = freshness
+        self.max_pending = max_pending or dict()
+        self.queues = dict()
+        self.cond = Condition()  # guards the connection and signals new jobs
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                          'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                          'job_type TEXT NOT NULL, '
+                          'key TEXT, '
+                          'args TEXT NOT NULL, '
+                          'state TEXT NOT NULL, '
+                          'priority INTEGER NOT NULL, '
+                          'campaign TEXT NOT NULL, '
+                          'created REAL NOT NULL)')
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(jobs)')}
+        for name, definition in PROGRESS_COLUMNS:
+            if name not in columns:
+                self.conn.execute('ALTER TABLE jobs ADD COLUMN {0} {1}'.format(name, definition))
+        self.conn.execute('CREATE INDEX IF NOT EXISTS jobs_by_type '
+                          'ON jobs (job_type, state, priority, campaign, id)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS jobs_by_key ON jobs (job_type, key, state)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS jobs_by_campaign ON jobs (campaign, state)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS jobs_by_end ON jobs (ended)')
+        # the last time a job was finished for every (job_type, key)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS finished ('
+                          'job_type TEXT NOT NULL, '
+                          'key TEXT NOT NULL, '
+                          'args TEXT NOT NULL, '
+                          'time REAL NOT NULL, '
+                          'PRIMARY KEY (job_type, key))')
+        # jobs that also handle jobs of other campaigns (merged into them, or covered by them while
+        # running), so the status of a campaign counts them too
+        self.conn.execute('CREATE TABLE IF NOT EXISTS job_campaigns ('
+                          'campaign TEXT NOT NULL, '
+                          'job_id INTEGER NOT NULL, '
+                          'PRIMARY KEY (campaign, job_id))')
+        # jobs that were running when the store was last closed were not finished
+        self.conn.execute('UPDATE jobs SET state=? WHERE state=?', (PENDING, RUNNING))
+        self.last_prune = 0
+        self._prune()
+        self.conn.commit()
+
+    def queue(self, job_type):
+        """
+        :return: the JobQueue for the jobs of the given type
+        """
+        if job_type not in self.queues:
+            self.queues[job_type] = JobQueue(self, job_type)
+        return self.queues[job_type]
+
+    def _prune(self):
+        """
+        remove finished jobs that are older than FINISHED_RETENTION. must be called while holding
+        the lock
+        """
+        now = time.time()
+        if now - self.last_prune < PRUNE_INTERVAL:
+            return
+        self.conn.execute('DELETE FROM jobs WHERE ended<?', (now - FINISHED_RETENTION,))
+        self.conn.execute('DELETE FROM job_campaigns WHERE job_id NOT IN (SELECT id FROM jobs)')
+        self.last_prune = now
+
+    def _link_campaign(self, job_id, campaign):
+        """
+        count a job in the status of a campaign other than its own. must be called while holding
+        the lock
+        """
+        self.conn.execute('INSERT OR IGNORE INTO job_campaigns (campaign, job_id) '
+                          'SELECT ?, id FROM jobs WHERE id=? AND campaign!=?',
+                          (campaign, job_id, campaign))
+
+    def update_progress(self, job_id, items=None, pages=0, api_calls=0):
+        """
+        report the progress of a running job
+        :param items: the total number of items the job retrieved so far (None to keep it)
+        :param pages: number of pages retrieved since the last report
+        :param api_calls: number of API calls since the last report
+        """
+        with self.cond:
+            self.conn.execute('UPDATE jobs SET items=COALESCE(?, items), pages=pages+?, '
+                              'api_calls=api_calls+? WHERE id=?',
+                              (items, pages, api_calls, job_id))
+            self.conn.commit()
+
+    def job_status(self, job_ids):
+        """
+        :param job_ids: list of job ids
+        :return: list of the status dictionaries of the given jobs that are in the store, with the
+                 keys 'id', 'type', 'args', 'state', 'priority', 'campaign', 'created', 'started',
+                 'ended', 'items', 'pages', 'api_calls' and 'error'
+        """
+        statuses = []
+        with self.cond:
+            # sqlite limits the number of parameters of a query
+            for i in range(0, len(job_ids), STATUS_QUERY_SIZE):
+                chunk = job_ids[i:i + STATUS_QUERY_SIZE]
+                rows = self.conn.execute(
+                    'SELECT id, job_type, args, state, priority, campaign, created, started, '
+                    'ended, items, pages, api_calls, error FROM jobs WHERE id IN ({0})'.format(
+                        ','.join('?' * len(chunk))), chunk).fetchall()
+                statuses.extend(rows)
+        keys = ['id', 'type', 'args', 'state', 'priority', 'campaign', 'created', 'started',
+                'ended', 'items', 'pages', 'api_calls', 'error']
+        statuses = [dict(zip(keys, row)) for row in sorted(statuses)]
+        for status in statuses:
+            status['args'] = json.loads(status['args'])
+        return statuses
+
+    def campaign_status(self, campaign):
+        """
+        :return: dictionary with the number of jobs of the campaign in every state (the keys of
+                 JOB_STATES), and the total 'items', 'pages' and 'api_calls' of these jobs. jobs of
+                 other campaigns that handle jobs of this campaign are counted too
+        """
+        with self.cond:
+            rows = self.conn.execute(
+                'SELECT state, COUNT(*), SUM(items), SUM(pages), SUM(api_calls) FROM jobs '
+                'WHERE campaign=? OR id IN (SELECT job_id FROM job_campaigns WHERE campaign=?) '
+                'GROUP BY state', (campaign, campaign)).fetchall()
+        status = {state: 0 for state in JOB_STATES}
+        status.update(items=0, pages=0, api_calls=0)
+        for state, count, items, pages, api_calls in rows:
+            status[state] = count
+            status['items'] += items
+            status['pages'] += pages
+            status['api_calls'] += api_calls
+        return status
+
+    def _unfinished(self, job_ids, campaign):
+        """
+        must be called while holding the lock
+        :return: True if any of the given jobs, or any job of the given campaign, is pending or
+                 running
+        """
+        for i in range(0, len(job_ids or ()), STATUS_QUERY_SIZE):
+            chunk = job_ids[i:i + STATUS_QUERY_SIZE]
+            if self.conn.execute(
+                    'SELECT 1 FROM jobs WHERE id IN ({0}) AND state IN (?, ?) LIMIT 1'.format(
+                        ','.join('?' * len(chunk))), chunk + [PENDING, RUNNING]).fetchone():
+                return True
+        return campaign is not None and self.conn.execute(
+            'SELECT 1 FROM jobs WHERE (campaign=? OR id IN '
+            '(SELECT job_id FROM job_campaigns WHERE campaign=?)) AND state IN (?, ?) LIMIT 1',
+            (campaign, campaign, PENDING, RUNNING)).fetchone() is not None
+
+    def wait(self, job_ids=None, campaign=None, timeout=None):
+        """
+        wait until all the given jobs, and all jobs of the given campaign, are finished (done or
+        failed). ids of jobs that are not in the store count as finished
+        :param job_ids: list of job ids. optional
+        :param campaign: the name of a campaign. optional
+        :param timeout: maximum seconds to wait (None for no limit)
+        :return: True if the jobs are finished, False if timeout has passed
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.cond:
+            while self._unfinished(job_ids, campaign):
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+            return True
+
+    def close(self):
+        with self.cond:
+            self.conn.close()
+
+
+def job_key(args):
+    """
+    :return: the key that identifies duplicate jobs (jobs of the same type with the same key
+             collapse into one job), or None if jobs with these args should never be collapsed
+    """
+    return args.get('screen_name')
+
+
+def limit_covers(limit, other_limit):
+    """
+    :return: True if a job with the given limit retrieves everything a job with other_limit
+             retrieves. limit 0 means no limit
+    """
+    return limit == 0 or (other_limit != 0 and limit >= other_limit)
+
+
+def covers(args, other_args):
+    """
+    :return: True if a job with args does everything a job (of the same type and key) with
+             other_args does. jobs with 'products' (a dictionary of product to limit) must also
+             cover every product of the other job
+    """
+    if not limit_covers(args.get('limit', 0), other_args.get('limit', 0)):
+        return False
+    products = args.get('products', dict())
+    return all(product in products and limit_covers(products[product], limit)
+               for product, limit in other_args.get('products', dict()).items())
+
+
+def merge_args(args, other_args):
+    """
+    :return: args of a single job that does everything both jobs do
+    """
+    merged = dict(args)
+    if not limit_covers(args.get('limit', 0), other_args.get('limit', 0)):
+        merged['limit'] = other_args['limit']
+    if 'products' in args or 'products' in other_args:
+        products = dict(args.get('products', dict()))
+        for product, limit in other_args.get('products', dict()).items():
+            if product not in products or not limit_covers(products[product], limit):
+                products[product] = limit
+        merged['products'] = products
+    return merged
+
+
+class JobQueue:
+    """
+    A persistent queue of jobs of a single type. Its interface is similar to queue.Queue, with
+    the difference that get() returns a tuple (job_id, args) and task_done() takes the id of the
+    finished job.
+
+    Every job has a priority and a campaign (a name for a group of jobs, e.g. a single client
+    script). get() returns a job with the highest pending priority. Campaigns with jobs in that
+    priority are served in turns (round robin), and jobs of a single campaign are served in the
+    order they were produced. This way a small campaign is not starved by a large one.
+
+    Jobs are deduplicated by their key (the screen name): a new job is merged into a pending job
+    with the same key (e.g. a larger limit upgrades the pending job), and is skipped if a running or
+    recently finished job already covers it. put() returns the id of the job that handles the new
+    job in all cases (the pending or running job it was merged into or skipped for), except when it
+    is covered by a finished job. A pending job whose key has a running job that doesn't cover it is
+    deferred: get() skips it until the running job is finished, so two jobs with the same key never
+    run at the same time. The running job may also take it over (see absorb()).
+
+    A queue may be bounded by a maximum number of pending jobs. When it is full, put() raises
+    queue.Full for new jobs (or waits for room), but jobs that are merged into pending jobs or
+    skipped are still accepted, since they don't add to the queue.
+
+    STOP_SIGNAL can be put in the queue like in queue.Queue. it is kept in memory and is returned
+    by get() only after all pending jobs were handed out, unless the queue was interrupted (see
+    interrupt()).
+    """
+
+    def __init__(self, store, job_type):
+        """
+        :param store: JobStore object
+        :param job_type: the type of jobs in this queue
+        """
+        self.store = store
+        self.job_type = job_type
+        self.max_pending = store.max_pending.get(job_type)
+        self.stop_signals = 0
+        self.interrupted = False  # whether STOP_SIGNAL is returned before pending jobs
+        # number of pending jobs for each (priority, campaign), and the last time (a sequence
+        # number) in which each campaign was served. these are small, so they are kept in memory
+        self.pending = dict()
+        self.last_served = dict()
+        self.served_counter = 0
+        self.absorbed = dict()  # running job id -> ids of the pending jobs it took (see absorb())
+        with store.cond:
+            rows = store.conn.execute(
+                'SELECT priority, campaign, COUNT(*) FROM jobs WHERE job_type=? AND state=? '
+                'GROUP BY priority, campaign', (job_type, PENDING)).fetchall()
+        for priority, campaign, count in rows:
+            self.pending[(priority, campaign)] = count
+
+    def _update_pending(self, priority, campaign, delta):
+        group = (priority, campaign)
+        self.pending[group] = self.pending.get(group, 0) + delta
+        if self.pending[group] <= 0:
+            del self.pending[group]
+
+    def put(self, args, priority=DEFAULT_PRIORITY, campaign=DEFAULT_CAMPAIGN, block=False,
+            timeout=None, bounded=True):
+        """
+        insert a new job to the queue, unless it duplicates an existing job. a duplicate of a
+        pending job raises the priority of the pending job if needed
+        :param args: dictionary (json serializable) with the job arguments, or STOP_SIGNAL
+        :param priority: integer. jobs with higher priority are served first
+        :param campaign: the name of the campaign this job belongs to
+        :param block: whether to wait for room if the queue is full
+        :param timeout: maximum seconds to wait for room (None for no limit)
+        :param bounded: whether the job is subject to the maximum number of pending jobs
+        :return: the id of the job that will handle these args (may be an existing pending or
+                 running job), or None if the job is covered by a recently finished job or args
+                 is STOP_SIGNAL
+        :raise queue.Full: if the queue is full (and block is False or timeout has passed)
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.store.cond:
+            if args is STOP_SIGNAL:
+                self.stop_signals += 1
+                self.store.cond.notify_all()
+                return None
+            key = job_key(args)
+            while True:
+                if key is not None:
+                    covered, job_id = self._covering_job(key, args)
+                    if covered:
+                        if job_id is not None:
+                            self.store._link_campaign(job_id, campaign)
+                            self.store.conn.commit()
+                        return job_id
+                    job_id = self._merge_pending(key, args, priority, campaign)
+                    if job_id is not None:
+                        return job_id
+                if not bounded or self.max_pending is None or \
+                        sum(self.pending.values()) < self.max_pending:
+                    break
+                remaining = None if deadline is None else deadline - time.time()
+                if not block or (remaining is not None and remaining <= 0):
+                    raise Full
+                # a duplicate may become pending while waiting, so everything is checked again
+                self.store.cond.wait(remaining)
+            cursor = self.store.conn.execute(
+                'INSERT INTO jobs (job_type, key, args, state, priority, campaign, created) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (self.job_type, key, json.dumps(args), PENDING, priority, campaign, time.time()))
+            self.store.conn.commit()
+            self._update_pending(priority, campaign, 1)
+            self.store.cond.notify_all()
+            return cursor.lastrowid
+
+    def _merge_pending(self, key, args, priority, campaign):
+        """
+        merge a job into the pending job with the same key, if exists. the pending job keeps its
+        campaign, and is counted in the given campaign too. must be called while holding the lock
+        :return: the id of the pending job, or None if there is no such job
+        """
+        row = self.store.conn.execute(
+            'SELECT id, args, priority, campaign FROM jobs WHERE job_type=? AND key=? AND state=?',
+            (self.job_type, key, PENDING)).fetchone()
+        if row is None:
+            return None
+        job_id, old_args, old_priority, old_campaign = row
+        merged = merge_args(json.loads(old_args), args)
+        new_priority = max(priority, old_priority)
+        self.store.conn.execute('UPDATE jobs SET args=?, priority=? WHERE id=?',
+                                (json.dumps(merged), new_priority, job_id))
+        self.store._link_campaign(job_id, campaign)
+        self.store.conn.commit()
+        self._update_pending(old_priority, old_campaign, -1)
+        self._update_pending(new_priority, old_campaign, 1)
+        return job_id
+
+    def _covering_job(self, key, args):
+        """
+        must be called while holding the lock
+        :return: tuple (covered, job_id). covered is True if a running job, or a job that was
+                 finished within the freshness window, already does everything a job with the
+                 given args would do. job_id is the id of the covering running job, or None
+        """
+        for job_id, job_args in self.store.conn.execute(
+                'SELECT id, args FROM jobs WHERE job_type=? AND key=? AND state=?',
+                (self.job_type, key, RUNNING)).fetchall():
+            if covers(json.loads(job_args), args):
+                return True, job_id
+        if self.store.freshness > 0:
+            rows = self.store.conn.execute(
+                'SELECT args FROM finished WHERE job_type=? AND key=? AND time>=?',
+                (self.job_type, key, time.time() - self.store.freshness)).fetchall()
+            if any(covers(json.loads(row[0]), args) for row in rows):
+                return True, None
+        return False, None
+
+    def _take(self):
+        """
+        take the next pending job and mark it as running. must be called while holding the lock
+        :return: tuple (job_id, args) or STOP_SIGNAL
+        :raise queue.Empty: if there are no jobs, or all pending jobs are deferred
+        """
+        if self.stop_signals > 0 and self.interrupted:
+            self.stop_signals -= 1
+            return STOP_SIGNAL
+        if self.pending:
+            # highest priority first, and in a priority the campaign that wasn't served for the
+            # longest time. a group may have only deferred jobs, then the next one is tried
+            groups = sorted(self.pending,
+                            key=lambda group: (-group[0], self.last_served.get(group[1], -1)))
+            for priority, campaign in groups:
+                row = self.store.conn.execute(
+                    'SELECT id, args FROM jobs WHERE job_type=? AND state=? AND priority=? AND '
+                    'campaign=? AND (key IS NULL OR key NOT IN (SELECT key FROM jobs WHERE '
+                    'job_type=? AND state=? AND key IS NOT NULL)) ORDER BY id LIMIT 1',
+                    (self.job_type, PENDING, priority, campaign, self.job_type,
+                     RUNNING)).fetchone()
+                if row is not None:
+                    break
+            else:
+                # all pending jobs are deferred. task_done() of a running job wakes up the waiters
+                raise Empty
+            self.store.conn.execute('UPDATE jobs SET state=?, started=? WHERE id=?',
+                                    (RUNNING, time.time(), row[0]))
+            self.store.conn.commit()
+            self._update_pending(priority, campaign, -1)
+            self.served_counter += 1
+            self.last_served[campaign] = self.served_counter
+            if self.max_pending is not None:
+                # producers may wait for room in the queue
+                self.store.cond.notify_all()
+            return row[0], json.loads(row[1])
+        if self.stop_signals > 0:
+            self.stop_signals -= 1
+            return STOP_SIGNAL
+        raise Empty
+
+    def get(self, block=True, timeout=None):
+        """
+        remove and return the next job from the queue. the job is kept in the store until
+        task_done() is called with its id.
+
+        :param block: whether to wait for a job if the queue is empty
+        :param timeout: maximum seconds to wait (None for no limit)
+        :return: tuple (job_id, args), or STOP_SIGNAL
+        :raise queue.Empty: if no job is available (and block is False or timeout has passed)
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.store.cond:
+            while True:
+                try:
+                    return self._take()
+                except Empty:
+                    if not block:
+                        raise
+                    remaining = None if deadline is None else deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        raise
+                    self.store.cond.wait(remaining)
+
+    def absorb(self, job_id, accept=None):
+        """
+        hand the pending jobs with the key of a running job to it: their args are merged into the
+        args of the running job, and they are finished together with it (see task_done()). this
+        way a running job can take a new job that it doesn't cover instead of deferring it
+        :param job_id: the id of a running job
+        :param accept: function that takes the merged args and returns whether the running job can
+                       handle them. called while holding the lock. optional
+        :return: the merged args, or None if no job was absorbed
+        """
+        with self.store.cond:
+            row = self.store.conn.execute('SELECT key, args FROM jobs WHERE id=? AND state=?',
+                                          (job_id, RUNNING)).fetchone()
+            if row is None or row[0] is None:
+                return None
+            rows = self.store.conn.execute(
+                'SELECT id, args, priority, campaign FROM jobs WHERE job_type=? AND key=? AND '
+                'state=?', (self.job_type, row[0], PENDING)).fetchall()
+            if not rows:
+                return None
+            merged = json.loads(row[1])
+            for _, args, _, _ in rows:
+                merged = merge_args(merged, json.loads(args))
+            if accept is not None and not accept(merged):
+                return None
+            now = time.time()
+            self.store.conn.execute('UPDATE jobs SET args=? WHERE id=?', (json.dumps(merged),
+                                                                          job_id))
+            for pending_id, _, priority, campaign in rows:
+                self.store.conn.execute('UPDATE jobs SET state=?, started=? WHERE id=?',
+                                        (RUNNING, now, pending_id))
+                self._update_pending(priority, campaign, -1)
+                self.absorbed.setdefault(job_id, []).append(pending_id)
+            self.store.conn.commit()
+            # producers may wait for room in the queue
+            self.store.cond.notify_all()
+            return merged
+
+    def interrupt(self):
+        """
+        return STOP_SIGNAL from get() before the pending jobs, so consumers stop after their current
+        job. the pending jobs stay in the store for the next time it is opened
+        """
+        with self.store.cond:
+            self.interrupted = True
+            self.store.cond.notify_all()
+
+    def task_done(self, job_id, error=None):
+        """
+        acknowledge that the given job was handled. the job (and the jobs it absorbed) is kept in
+        the store as done (or failed) for status queries, and is not handed out again
+        :param error: the error message if the job failed. a failed job doesn't cover new jobs
+        """
+        with self.store.cond:
+            now = time.time()
+            row = self.store.conn.execute('SELECT key, args FROM jobs WHERE id=?',
+                                          (job_id,)).fetchone()
+            if row is not None and row[0] is not None and error is None:
+                self.store.conn.execute(
+                    'INSERT OR REPLACE INTO finished (job_type, key, args, time) '
+                    'VALUES (?, ?, ?, ?)', (self.job_type, row[0], row[1], now))
+            for finished_id in [job_id] + self.absorbed.pop(job_id, []):
+                self.store.conn.execute('UPDATE jobs SET state=?, ended=?, error=? WHERE id=?',
+                                        (DONE if error is None else FAILED, now, error,
+                                         finished_id))
+            self.store._prune()
+            self.store.conn.commit()
+            # wake up waiters (see JobStore.wait)
+            self.store.cond.notify_all()
+
+    def qsize(self):
+        """
+        :return: number of pending jobs in the queue
+        """
+        with self.store.cond:
+            return sum(self.pending.values())
+
+    def empty(self):
+        """
+        :return: True if there are no pending jobs in the queue
+        """
+        with self.store.cond:
+            return not self.pending
@@ -0,0 +1,199 @@
+import argparse
+import hashlib
+import json
+import os
+
+# the file that describes the layout of a data dir. prefix '#' is necessary so this file will not be
+# in conflict with a legal twitter screen name
+LAYOUT_FILE_NAME = '#layout'
+FLAT = 'flat'
+SHARDED = 'sharded'
+LAYOUTS = [FLAT, SHARDED]
+# top level shard directories start with '#' too, so they can't be mistaken for users
+SHARD_PREFIX = '#'
+DEFAULT_STORAGE = 'files'  # see storage.STORAGES
+# formats of ids lists and of neighbors
+TEXT_FORMAT = 'text'
+BINARY_FORMAT = 'binary'
+FORMATS = [TEXT_FORMAT, BINARY_FORMAT]
+
+
+def _shard(screen_name):
+    """
+    :return: tuple (top, sub) of the shard directories of the given user
+    """
+    digest = hashlib.md5(screen_name.encode('utf-8')).hexdigest()
+    return SHARD_PREFIX + digest[:2], digest[2:4]
+
+
+class DataLayout:
+    """
+    The layout of user directories inside a data dir:
+    * flat - every user has a directory directly under the data dir (data_dir/<screen_name>)
+    * sharded - user directories are spread by a hash of the screen name over two levels of
+                directories (data_dir/#ab/cd/<screen_name>), so no single directory grows too large
+
+    The layout of a data dir is kept in its '#layout' file, together with the storage of the user
+    records (see storage.open_storage), the compression of tweets and the formats of ids lists and
+    neighbors. A data dir without this file is flat and stores uncompressed text records in files.
+    Existing data dirs are converted with migrate() (or by running this module).
+    """
+
+    def __init__(self, data_dir):
+        """
+        :param data_dir: the main data directory
+        """
+        self.data_dir = data_dir
+        self.layout = FLAT
+        self.storage = DEFAULT_STORAGE
+        self.compression = None  # see storage.COMPRESSIONS
+        self.ids_format = TEXT_FORMAT
+        self.neighbors_format = TEXT_FORMAT
+        layout_file = os.path.join(data_dir, LAYOUT_FILE_NAME)
+        if os.path.isfile(layout_file):
+            with open(layout_file) as f:
+                config = json.load(f)
+            self.layout = config['layout']
+            self.storage = config.get('storage', DEFAULT_STORAGE)
+            self.compression = config.get('compression')
+            self.ids_format = config.get('ids_format', TEXT_FORMAT)
+            self.neighbors_format = config.get('neighbors_format', TEXT_FORMAT)
+
+    def _save(self):
+        """
+        write the layout file of the data dir
+        """
+        if not os.path.isdir(self.data_dir):
+            os.makedirs(self.data_dir)
+        tmp_file = os.path.join(self.data_dir, LAYOUT_FILE_NAME + '.tmp')
+        with open(tmp_file, mode='w') as f:
+            json.dump({'layout': self.layout, 'storage': self.storage,
+                       'compression': self.compression, 'ids_format': self.ids_format,
+                       'neighbors_format': self.neighbors_format}, f)
+        os.replace(tmp_file, os.path.join(self.data_dir, LAYOUT_FILE_NAME))
+
+    def set_storage(self, storage):
+        """
+        record the storage of the user records. used by storage.migrate_storage
+        """
+        self.storage = storage
+        self._save()
+
+    def set_compression(self, compression):
+        """
+        record the compression of new tweets data (None for no compression)
+        """
+        self.compression = compression
+        self._save()
+
+    def set_ids_format(self, ids_format):
+        """
+        record the format of new followers and friends ids lists (one of FORMATS)
+        """
+        if ids_format not in FORMATS:
+            raise ValueError('Unsupported ids format: "{0}"'.format(ids_format))
+        self.ids_format = ids_format
+        self._save()
+
+    def set_neighbors_format(self, neighbors_format):
+        """
+        record the format of new neighbors (one of FORMATS)
+        """
+        if neighbors_format not in FORMATS:
+            raise ValueError('Unsupported neighbors format: "{0}"'.format(neighbors_format))
+        self.neighbors_format = neighbors_format
+        self._save()
+
+    def user_dir(self, screen_name):
+        """
+        :return: the path of the directory of the given user (may not exist)
+        """
+        return self._user_dir(screen_name, self.layout)
+
+    def _user_dir(self, screen_name, layout):
+        if layout == SHARDED:
+            return os.path.join(self.data_dir, *_shard(screen_name), screen_name)
+        return os.path.join(self.data_dir, screen_name)
+
+    def users(self):
+        """
+        :return: generator of tuples (screen_name, user_dir) of all users in the data dir
+        """
+        return self._users(self.layout)
+
+    def _users(self, layout):
+        if not os.path.isdir(self.data_dir):
+            return
+        if layout == FLAT:
+            for entry in os.scandir(self.data_dir):
+                if not entry.name.startswith('#') and entry.is_dir():
+                    yield entry.name, entry.path
+            return
+        for top in os.scandir(self.data_dir):
+            if not top.name.startswith(SHARD_PREFIX) or not top.is_dir() or \
+                    len(top.name) != len(SHARD_PREFIX) + 2:
+                continue
+            for sub in os.scandir(top.path):
+                if not sub.is_dir():
+                    continue
+                for entry in os.scandir(sub.path):
+                    if entry.is_dir():
+                        yield entry.name, entry.path
+
+    def migrate(self, layout):
+        """
+        move all user directories to the given layout. the miner must not run during the migration.
+        an interrupted migration can be completed by calling this function again
+        :param layout: one of the constants in LAYOUTS
+        :return: number of moved users
+        """
+        if layout not in LAYOUTS:
+            raise ValueError('Unsupported layout: "{0}"'.format(layout))
+        moved = 0
+        # an interrupted migration may leave users in both layouts
+        for other in LAYOUTS:
+            if other == layout:
+                continue
+            for screen_name, user_dir in list(self._users(other)):
+                target = self._user_dir(screen_name, layout)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.rename(user_dir, target)
+                moved += 1
+        if layout == FLAT:
+            self._remove_empty_shards()
+        self.layout = layout
+        self._save()
+        return moved
+
+    def _remove_empty_shards(self):
+        for top in os.scandir(self.data_dir):
+            if top.name.startswith(SHARD_PREFIX) and len(top.name) == len(SHARD_PREFIX) + 2 and \
+                    top.is_dir():
+                for sub in os.scandir(top.path):
+                    if sub.is_dir() and not os.listdir(sub.path):
+                        os.rmdir(sub.path)
+                if not os.listdir(top.path):
+                    os.rmdir(top.path)
+
+
+def parse_args():
+    """
+    parse and return the program arguments
+    """
+    parser = argparse.ArgumentParser(prog='TwitterMine layout',
+                                     usage='layout -d <data-dir> -l <layout>',
+                                     description='Move the user directories of a data dir to '
+                                                 'another layout. Stop the daemon first')
+    parser.add_argument('-d', '--data-dir', metavar='data-dir', required=True, type=str,
+                        help='the data dir to migrate (created if not exist)')
+    parser.add_argument('-l', '--layout', metavar='layout', required=True, type=str,
+                        choices=LAYOUTS,
+                        help='the new layout: "flat" (data_dir/<screen_name>) or "sharded" '
+                             '(data_dir/#ab/cd/<screen_name>)')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    moved = DataLayout(args.data_dir).migrate(args.layout)
+    print('moved {0} users to the {1} layout'.format(moved, args.layout))
@@ -0,0 +1,193 @@
+import json
+import os
+import time
+from threading import Lock
+
+NEWLINE = '\n'
+# the manifest of the data dir. prefix '#' is necessary so this file will not be in conflict with a
+# legal twitter screen name
+MANIFEST_FILE_NAME = '#manifest'
+TMP_SUFFIX = '.tmp'
+# the manifest file is compacted when it is loaded, if it has this many lines for every resource
+COMPACT_RATIO = 4
+
+
+class Manifest:
+    """
+    An index of the resources (records and binary files, e.g. 'user_details', 'tweets',
+    'followers') that are stored for every user in the data dir, so questions about the stored users
+    are answered without touching the file system.
+
+    For every resource the manifest keeps its size (bytes of uncompressed data, or as stored for
+    compressed records in a rebuilt manifest) and the time it was last written. For 'user_details'
+    it keeps the user's followers_count and id too.
+
+    The index is kept in memory and persisted in a file that is only appended to: a json line for
+    every write of a resource, with the keys 'user', 'resource', 'size', 'mtime' (and
+    'followers_count' and 'id' for user details). The last line of a resource is its current state.
+    The file is loaded by load() (or on first use), and compacted if it has many old lines. If it
+    doesn't exist (e.g. a data dir that was mined before the manifest existed, or after the file was
+    deleted to rebuild it), it is built by scanning the data dir once, with an entry for every
+    resource.
+
+    Only resources that are written through the manifest are known to it. After files are deleted by
+    hand the manifest should be deleted too, so it is rebuilt. It is thread safe.
+
+    A read only manifest (for readers of a data dir that may be mined at the same time) never
+    changes the file: a partially written last line is ignored, the file isn't compacted, and a
+    missing file is built by scanning the data dir in memory only.
+    """
+
+    def __init__(self, path, scan, read_only=False):
+        """
+        :param path: the path of the manifest file. created if not exist (unless read_only)
+        :param scan: function that returns an iterable of entries (dictionaries with the keys of a
+                     line in the manifest file) of all resources in the data dir. used to build a
+                     missing manifest
+        :param read_only: whether the manifest is only read. add() is not allowed
+        """
+        self.path = path
+        self.scan = scan
+        self.read_only = read_only
+        self.lock = Lock()
+        self.resources = None  # screen_name -> {resource: (size, mtime)}
+        self.details = None  # screen_name -> (followers_count, id)
+        self.file = None  # the manifest file, open for appending
+
+    def load(self):
+        """
+        load the manifest file, or build it if it doesn't exist. called when the data dir is opened,
+        so a rebuild doesn't stall the first write (and doesn't see that write on disk and record it
+        twice). otherwise the manifest is loaded on first use
+        """
+        with self.lock:
+            self._load()
+
+    def _load(self):
+        """
+        must be called while holding the lock
+        """
+        if self.resources is not None:
+            return
+        self.resources = dict()
+        self.details = dict()
+        if not os.path.isfile(self.path):
+            for entry in self.scan():
+                self._apply(entry)
+            if self.read_only:
+                return
+            self._rewrite()
+        else:
+            with open(self.path, mode='rb') as f:
+                data = f.read()
+            complete = data.rfind(NEWLINE.encode('utf-8')) + 1
+            if complete < len(data) and not self.read_only:
+                # a partially written line (e.g. after a crash)
+                with open(self.path, mode='r+b') as f:
+                    f.truncate(complete)
+            lines = data[:complete].decode('utf-8').split(NEWLINE)[:-1]
+            for line in lines:
+                self._apply(json.loads(line))
+            if self.read_only:
+                return
+            if len(lines) > COMPACT_RATIO * sum(map(len, self.resources.values())):
+                self._rewrite()
+        self.file = open(self.path, mode='a', encoding='utf-8')
+
+    def _apply(self, entry):
+        screen_name = entry['user']
+        self.resources.setdefault(screen_name, dict())[entry['resource']] = \
+            (entry.get('size'), entry.get('mtime'))
+        if 'followers_count' in entry:
+            self.details[screen_name] = (entry['followers_count'], entry.get('id'))
+
+    def _entries(self):
+        for screen_name, resources in self.resources.items():
+            for resource, (size, mtime) in resources.items():
+                entry = {'user': screen_name, 'resource': resource, 'size': size, 'mtime': mtime}
+                if resource == 'user_details' and screen_name in self.details:
+                    entry['followers_count'], entry['id'] = self.details[screen_name]
+                yield entry
+
+    def _rewrite(self):
+        """
+        replace the manifest file with a line for every resource
+        """
+        with open(self.path + TMP_SUFFIX, mode='w', encoding='utf-8') as f:
+            f.writelines(json.dumps(entry) + NEWLINE for entry in self._entries())
+        os.replace(self.path + TMP_SUFFIX, self.path)
+
+    def add(self, screen_name, resource, size, append=False, followers_count=None, id=None):
+        """
+        record a write of a resource of the user
+        :param size: bytes of data that were written
+        :param append: whether the data was appended to the resource or replaced it
+        :param followers_count: for 'user_details', the followers count of the user
+        :param id: for 'user_details', the id of the user
+        :raise ValueError: if the manifest is read only
+        """
+        if self.read_only:
+            raise ValueError('Cannot add to a read only manifest: {0}'.format(self.path))
+        with self.lock:
+            self._load()
+            if append:
+                previous_size = self.resources.get(screen_name, {}).get(resource, (None,))[0]
+                size += previous_size or 0
+            entry = {'user': screen_name, 'resource': resource, 'size': size, 'mtime': time.time()}
+            if followers_count is not None:
+                entry['followers_count'] = followers_count
+                entry['id'] = id
+            self._apply(entry)
+            self.file.write(json.dumps(entry) + NEWLINE)
+            self.file.flush()
+
+    def exists(self, screen_name, resource):
+        """
+        :return: True if the given resource is stored for the user
+        """
+        with self.lock:
+            self._load()
+            return resource in self.resources.get(screen_name, ())
+
+    def user_resources(self, screen_name):
+        """
+        :return: set of the resources that are stored for the user (empty for an unknown user)
+        """
+        with self.lock:
+            self._load()
+            return set(self.resources.get(screen_name, ()))
+
+    def resource_info(self, screen_name, resource):
+        """
+        :return: dictionary with the keys 'size' and 'mtime' of a resource of the user, or None if
+                 it is not stored
+        """
+        with self.lock:
+            self._load()
+            info = self.resources.get(screen_name, {}).get(resource)
+            return None if info is None else {'size': info[0], 'mtime': info[1]}
+
+    def user_info(self, screen_name):
+        """
+        :return: dictionary with the keys 'followers_count' and 'id' from the stored details of the
+                 user, or None if the user has no details
+        """
+        with self.lock:
+            self._load()
+            info = self.details.get(screen_name)
+            return None if info is None else {'followers_count': info[0], 'id': info[1]}
+
+    def users(self):
+        """
+        :return: list of the screen names of all users with stored resources
+        """
+        with self.lock:
+            self._load()
+            return list(self.resources)
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            self.resources = None  # loaded again on next use
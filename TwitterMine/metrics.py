@@ -0,0 +1,166 @@
+import math
+from threading import Lock
+
+# the content type of the prometheus text format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# upper bounds (seconds) of the buckets of latency histograms
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(name, _escape(value))
+                          for name, value in zip(names, values)) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class Metric:
+    """
+    A metric family in the prometheus text format: a value for every combination of label values.
+
+    Values are either kept by the metric (see Counter.inc, Gauge.set and Histogram.observe), or
+    read from the miner when the metrics are exposed, by a collect function. It is thread safe.
+    """
+
+    def __init__(self, name, help, type, label_names=(), collect=None):
+        """
+        :param name: the metric name
+        :param help: one line description of the metric
+        :param type: the prometheus type ('counter', 'gauge' or 'histogram')
+        :param label_names: list of the names of the labels
+        :param collect: function that returns a dictionary of tuples of label values to values.
+                        optional
+        """
+        self.name = name
+        self.help = help
+        self.type = type
+        self.label_names = tuple(label_names)
+        self.collect = collect
+        self.values = dict()  # tuple of label values -> value
+        if not self.label_names and type != 'histogram':
+            # a metric without labels is exposed from the start
+            self.values[()] = 0
+        self.lock = Lock()
+
+    def _samples(self):
+        """
+        :return: list of tuples (suffix, label names, label values, value) of the exposed samples
+        """
+        if self.collect is not None:
+            values = self.collect()
+        else:
+            with self.lock:
+                values = dict(self.values)
+        return [('', self.label_names, labels, value) for labels, value in sorted(values.items())]
+
+    def exposition(self):
+        """
+        :return: the metric in the prometheus text format
+        """
+        lines = ['# HELP {0} {1}'.format(self.name, self.help),
+                 '# TYPE {0} {1}'.format(self.name, self.type)]
+        for suffix, names, labels, value in self._samples():
+            lines.append('{0}{1}{2} {3}'.format(self.name, suffix, _format_labels(names, labels),
+                                                _format_value(value)))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """
+    A value that only grows (e.g. the number of finished jobs). rates are computed from it by the
+    monitoring system
+    """
+
+    def __init__(self, name, help, label_names=(), collect=None):
+        super().__init__(name, help, 'counter', label_names, collect)
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down (e.g. the depth of a queue)
+    """
+
+    def __init__(self, name, help, label_names=(), collect=None):
+        super().__init__(name, help, 'gauge', label_names, collect)
+
+    def set(self, value, *label_values):
+        with self.lock:
+            self.values[label_values] = value
+
+
+class Histogram(Metric):
+    """
+    The distribution of observed values (e.g. request latencies) in cumulative buckets
+    """
+
+    def __init__(self, name, help, label_names=(), buckets=LATENCY_BUCKETS):
+        """
+        :param buckets: sorted upper bounds of the buckets
+        """
+        super().__init__(name, help, 'histogram', label_names)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            if label_values not in self.values:
+                # a count for every bucket, the sum and the count
+                self.values[label_values] = [0] * len(self.buckets) + [0, 0]
+            counts = self.values[label_values]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-2] += value
+            counts[-1] += 1
+
+    def _samples(self):
+        with self.lock:
+            values = {labels: list(counts) for labels, counts in self.values.items()}
+        samples = []
+        names = self.label_names + ('le',)
+        for labels, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append(('_bucket', names, labels + (_format_value(bound),), cumulative))
+            samples.append(('_sum', self.label_names, labels, counts[-2]))
+            samples.append(('_count', self.label_names, labels, counts[-1]))
+        return samples
+
+
+class Registry:
+    """
+    The metrics of a miner, exposed together (see exposition)
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        """
+        :return: the given metric
+        """
+        self.metrics.append(metric)
+        return metric
+
+    def exposition(self):
+        """
+        :return: all metrics in the prometheus text format
+        """
+        return ''.join(metric.exposition() + '\n' for metric in self.metrics)
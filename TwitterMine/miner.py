@@ -1,24 +1,216 @@
 import logging
-import time
-from queue import Queue
+import os
+from queue import Empty, Queue
 from threading import Thread
 
 import TwitterMine.utils as utils
 from TwitterAPI.TwitterAPI import TwitterAPI
 from TwitterAPI.TwitterError import TwitterRequestError, TwitterConnectionError
-from TwitterAPI.TwitterPager import TwitterPager
 from TwitterMine.data_writer import DataWriter as DW
+from TwitterMine.job_queue import DEFAULT_CAMPAIGN, DEFAULT_PRIORITY, DONE, FAILED, \
+    OVERFLOW_BLOCK, OVERFLOW_POLICIES, OVERFLOW_SPILL, JobStore
+from TwitterMine.metrics import Counter, Gauge, Histogram, Registry
+from TwitterMine.pager import iterate_pages
+from TwitterMine.rate_limit import Interrupted, RateLimitedAPI, RateLimiter
+from TwitterMine.storage import FSYNC_NEVER
 
 MAX_IDS_LIST = 100000
 MAX_TWEETS_LIST = 500
+USERS_LOOKUP_BATCH = 100  # maximum number of users in a single users/lookup request
 STOP_SIGNAL = None  # this is a sign to all miner threads to stop
+# file for the persistent jobs queues inside the data dir. prefix '#' is necessary so this file will
+# not be in conflict with a legal twitter screen name
+JOBS_DB_NAME = '#jobs.db'
+PUT_TIMEOUT = 30  # seconds to wait for room in a full queue, with the 'block' overflow policy
 
 JOBS_TYPES = ['user_details', 'friends_ids', 'followers_ids', 'tweets',
               'likes', 'neighbors', 'listen']
+# tweets and neighbors jobs are both derived from the user's timeline, so they are handled by a
+# single 'timeline' job, which fetches the timeline once for all of them
+QUEUES_TYPES = ['user_details', 'friends_ids', 'followers_ids', 'timeline', 'likes', 'listen']
 
 FILTER_LEVEL = 'none'  # 'none' || 'low' || 'medium', to control the rate of incoming tweets
 
 
+def write_tweets_product(writer, tweets, screen_name, append):
+    writer.write_tweets_of_user(tweets, screen_name)
+
+
+def write_neighbors_product(writer, tweets, screen_name, append):
+    writer.write_neighbors(utils.get_neighbors(tweets, screen_name), screen_name, append)
+
+
+# products that are derived from a user's timeline. each is a function that takes
+# (writer, tweets, screen_name, append) and writes the product of the given tweets. append is False
+# only when the user has no stored data of this product
+TIMELINE_PRODUCTS = {'tweets': write_tweets_product,
+                     'neighbors': write_neighbors_product}
+
+# paged job types: (resource, data name, request params, flush size, writer function).
+# the items of the timeline job are written to its products (see Miner._write_timeline)
+PAGED_JOBS = {
+    'followers_ids': ('followers/ids', 'followers', {'count': 5000}, MAX_IDS_LIST,
+                      DW.write_followers),
+    'friends_ids': ('friends/ids', 'friends', {'count': 5000}, MAX_IDS_LIST, DW.write_friends),
+    'timeline': ('statuses/user_timeline', 'timeline', {'count': 200, 'tweet_mode': 'extended'},
+                 MAX_TWEETS_LIST, None),
+    'likes': ('favorites/list', 'likes', {'count': 200, 'tweet_mode': 'extended'},
+              MAX_TWEETS_LIST, DW.write_likes),
+}
+# paged jobs of ids lists. every complete list that is retrieved is stored as a new snapshot, so
+# the changes of the list can be queried (see DataWriter.get_ids_changes)
+SNAPSHOT_JOBS = {'followers_ids', 'friends_ids'}
+# paged jobs of tweets, which are mined incrementally: only tweets that are newer than the stored
+# ones are requested (since_id), and they are added to the stored data
+INCREMENTAL_JOBS = {'timeline', 'likes'}
+
+
+class PagingProgress:
+    """
+    The progress of a paged job: collects the items of the pages, flushes them whenever at least
+    flush_size items were collected and keeps a checkpoint of the job in the writer.
+
+    A checkpoint is written after each flush and removed when the job completes. If a checkpoint
+    exists when the job starts, paging should continue from self.position
+    """
+
+    def __init__(self, writer, args, data_name, flush_size, flush_func, finish_func=None,
+                 job_state=None):
+        """
+        :param writer: DataWriter object
+        :param args: the job args. dictionary with keys 'screen_name' and 'limit'
+        :param data_name: the name of the written data (used as the checkpoint name)
+        :param flush_size: minimal number of collected items that triggers a flush
+        :param flush_func: function that takes a list of items and the index of the first item in
+                           the job (so it is 0 for the first flush of a job), and writes them
+        :param finish_func: function that is called with this object when the job completes,
+                            after the remaining items were flushed. optional
+        :param job_state: json serializable dictionary that is saved with every checkpoint, for
+                          the job to use when it is resumed. optional
+        """
+        self.writer = writer
+        self.screen_name = args['screen_name']
+        self.limit = args['limit'] if args['limit'] != 0 else float('inf')
+        self.data_name = data_name
+        self.flush_size = flush_size
+        self.flush_func = flush_func
+        self.finish_func = finish_func
+        self.job_state = job_state
+        self.items = []
+        self.position = None  # position of the first page to request
+        self.total = 0  # total number of items we retrieved so far
+        self.newest_id = None  # the largest id of the items we retrieved so far
+        self.complete = False  # whether all items of the resource were retrieved
+        checkpoint = writer.get_checkpoint(self.screen_name, data_name)
+        if checkpoint is not None:
+            self.position = checkpoint['position']
+            self.total = checkpoint['total']
+            self.newest_id = checkpoint.get('newest_id')
+            logging.getLogger().info('resuming {0} of {1} after {2} items'.format(
+                data_name, self.screen_name, self.total))
+
+    def add_page(self, page, next_position):
+        """
+        :param page: list of items
+        :param next_position: the position of the next page (None if this is the last page)
+        :return: True if the job is done and no more pages should be requested
+        """
+        if self.total + len(page) > self.limit:
+            page = page[:self.limit - self.total]
+        self.items.extend(page)
+        self.total += len(page)
+        ids = [item['id'] for item in page if isinstance(item, dict) and 'id' in item]
+        if ids and (self.newest_id is None or max(ids) > self.newest_id):
+            self.newest_id = max(ids)
+        if next_position is None:
+            self.complete = True
+            return True
+        if self.total >= self.limit:
+            return True
+        if len(self.items) >= self.flush_size:
+            self.checkpoint(next_position)
+        return False
+
+    def checkpoint(self, next_position):
+        """
+        flush the collected items and save a checkpoint, so the job continues from the given
+        position the next time it runs. checkpoints are saved only at page boundaries, so resuming
+        from a checkpoint never skips or repeats items
+        :param next_position: the position of the page after the last added page
+        """
+        self.flush_func(self.items, self.total - len(self.items))
+        self.items = []
+        checkpoint = {'position': next_position, 'total': self.total, 'newest_id': self.newest_id}
+        if self.job_state is not None:
+            checkpoint['job_state'] = self.job_state
+        self.writer.write_checkpoint(self.screen_name, self.data_name, checkpoint)
+
+    def finish(self):
+        """
+        flush the remaining items and remove the checkpoint
+        """
+        self.flush_func(self.items, self.total - len(self.items))
+        self.items = []
+        if self.finish_func is not None:
+            self.finish_func(self)
+        self.writer.write_checkpoint(self.screen_name, self.data_name, None)
+
+
+def _newer_than(tweets, latest_id):
+    """
+    :return: the tweets with an id larger than latest_id (all tweets if latest_id is None)
+    """
+    if latest_id is None:
+        return tweets
+    return [t for t in tweets if t['id'] > latest_id]
+
+
+def queue_type(job_type):
+    """
+    :return: the type of the queue that holds jobs of the given type (timeline products are handled
+             by timeline jobs)
+    """
+    return 'timeline' if job_type in TIMELINE_PRODUCTS else job_type
+
+
+def create_api(credential, latency=None):
+    """
+    create a rate limited twitter api object for the given credential
+    :param credential: dictionary with keys 'consumer_key', 'consumer_secret' and optionally
+                       'access_token_key' and 'access_token_secret' (without them, app
+                       authentication is used)
+    :param latency: histogram of the request latencies (see RateLimitedAPI). optional
+    :return: RateLimitedAPI object
+    """
+    access_token_key = credential.get('access_token_key')
+    access_token_secret = credential.get('access_token_secret')
+    if not access_token_key or not access_token_secret:
+        api = TwitterAPI(credential['consumer_key'], credential['consumer_secret'],
+                         auth_type='oAuth2')
+        return RateLimitedAPI(api, RateLimiter(app_auth=True), latency)
+    api = TwitterAPI(credential['consumer_key'], credential['consumer_secret'],
+                     access_token_key, access_token_secret)
+    return RateLimitedAPI(api, RateLimiter(app_auth=False), latency)
+
+
+def get_credentials(config, app_auth):
+    """
+    read the list of credentials from a server config dictionary. credentials are given either as
+    a list under the key 'credentials', or as a single set of keys in the top level of the config
+    :param config: the server config dictionary
+    :param app_auth: if True, ignore access tokens and use app authentication
+    :return: list of credentials dictionaries (as expected by Miner)
+    """
+    keys = ['consumer_key', 'consumer_secret', 'access_token_key', 'access_token_secret']
+    credentials = config.get('credentials') or [config]
+    credentials = [{key: credential.get(key) for key in keys} for credential in credentials]
+    if app_auth:
+        for credential in credentials:
+            credential['access_token_key'] = None
+            credential['access_token_secret'] = None
+    return credentials
+
+
 class Miner:
     """
     A Miner object can talk to twitter (via twitter's API), retrieve data and store it in a
@@ -40,77 +232,172 @@ class Miner:
 
     Each mining function related to some user will automatically mine the details of this user, so
     there is no need to call mine_user_details for users for which we perform other mining jobs.
+
+    The miner keeps metrics of its queues, jobs, requests, rate limits, writes and stream in
+    self.metrics (see _create_metrics), for monitoring it.
     """
 
-    def __init__(self, consumer_key, consumer_secret, data_dir,
-                 access_token_key=None, access_token_secret=None):
+    def __init__(self, credentials, data_dir, job_freshness=0, fsync=FSYNC_NEVER,
+                 queue_limits=None, overflow=OVERFLOW_SPILL):
         """
         Construct a new Miner for retrieving data from Twitter.
 
-        if access_token_key or access_token_secret are None, use app authentication with
-        twitter's API
+        Each credential in the list gets its own worker thread for every job type (and its own rate
+        limit budget), so jobs of the same type are load balanced between all credentials.
+        Credentials that don't have access_token_key or access_token_secret use app authentication
+        with twitter's API
 
-        :param consumer_key:
-        :param consumer_secret:
+        :param credentials: list of dictionaries with keys 'consumer_key', 'consumer_secret' and
+                            optionally 'access_token_key' and 'access_token_secret'
         :param data_dir: main directory to store the data
-        :param access_token_key:
-        :param access_token_secret:
-        """
-        if access_token_key is None or access_token_secret is None:
-            self.api = TwitterAPI(consumer_key, consumer_secret, auth_type='oAuth2')
-        else:
-            self.api = TwitterAPI(consumer_key, consumer_secret,
-                                  access_token_key, access_token_secret)
-        self.writer = DW(data_dir)
+        :param job_freshness: seconds after a job is finished in which identical jobs are skipped.
+                              0 to never skip jobs
+        :param fsync: when the mined data is synced to the disk (see storage.FSYNC_POLICIES). the
+                      data is written in batches by a single writer thread, and all of it is
+                      written when the miner stops
+        :param queue_limits: dictionary of queue type (one of QUEUES_TYPES, except 'listen') to the
+                             maximum number of pending jobs in that queue. other queues are not
+                             bounded
+        :param overflow: what produce_job() does when the queue of a job is full (one of
+                         job_queue.OVERFLOW_POLICIES): raise queue.Full ('reject'), wait up to
+                         PUT_TIMEOUT seconds for room and then raise queue.Full ('block'), or
+                         accept the job anyway ('spill', which ignores queue_limits)
+        """
+        if not credentials:
+            raise ValueError('At least one set of credentials is required')
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('Unsupported overflow policy: "{0}"'.format(overflow))
+        for type in queue_limits or ():
+            if type not in QUEUES_TYPES or type == 'listen':
+                raise ValueError('Unsupported queue type: "{0}"'.format(type))
+        self.metrics = self._create_metrics()
+        # all requests are paced according to the rate limit headers twitter returns, so consumer
+        # threads don't have to sleep between requests
+        self.apis = [create_api(credential, self.api_latency_metric) for credential in credentials]
+        self.api = self.apis[0]  # used for jobs that must run with a single connection (listen)
+        self.writer = DW(data_dir, group_commit=True, fsync=fsync)
         self.logger = logging.getLogger()
-        self.queues = {type: Queue() for type in JOBS_TYPES}
-        # python queues are thread safe and don't require locks for multi-producers/consumers
-
-        # create thread for each different job type
-        self.threads = [
-            Thread(target=Miner._run_consumer,
-                   args=(self, 'followers_ids', Miner._mine_followers_ids)),
-            Thread(target=Miner._run_consumer,
-                   args=(self, 'friends_ids', Miner._mine_friends_ids)),
-            Thread(target=Miner._run_consumer,
-                   args=(self, 'tweets', Miner._mine_tweets)),
-            Thread(target=Miner._run_consumer,
-                   args=(self, 'likes', Miner._mine_likes)),
-            Thread(target=Miner._run_consumer,
-                   args=(self, 'user_details', Miner._mine_user_details)),
-            Thread(target=Miner._run_consumer,
-                   args=(self, 'neighbors', Miner._mine_neighbors)),
-            Thread(target=Miner._run_consumer,
-                   args=(self, 'listen', Miner._listen))
-        ]
-
-    def _mine_user_details(self, args):
-        """
-        retrieve details of a specific user according to its screen name.
-        :param args: dictionary with a key 'screen_name' which indicates the user to retrieve
-        :return: the id (integer) of the user
-        """
-        screen_name = args['screen_name']
-        self.logger.info('mining user details of {0}'.format(screen_name))
-        time.sleep(1)  # one request per second will avoid rate limit
-        try:
-            r = self.api.request('users/show', params={'screen_name': screen_name})
-            if r.status_code >= 400:
-                try:
-                    msg = r.json()['errors'][0]['message']
-                    self.logger.error('mining user details failed. {0}'.format(msg))
-                except ValueError:
-                    # response body does not contain valid json
-                    self.logger.error(
-                        'mining user details failed. Error code {0}'.format(r.status_code))
-                return
-            details = r.json()
+        self.interrupted = False  # whether running jobs should stop (see stop())
+        # jobs are kept in a persistent store, so pending jobs survive a restart of the miner.
+        # listen jobs only update the parameters of the current stream, so they are kept in memory
+        self.overflow = overflow
+        self.jobs_store = JobStore(os.path.join(data_dir, JOBS_DB_NAME), job_freshness,
+                                   queue_limits if overflow != OVERFLOW_SPILL else None)
+        self.queues = {type: self.jobs_store.queue(type) for type in QUEUES_TYPES
+                       if type != 'listen'}
+        self.queues['listen'] = Queue()
+        # both kinds of queues are thread safe and don't require locks for multi-producers/consumers
+
+        self.threads = self._create_threads()
+
+    def _create_metrics(self):
+        """
+        create the metrics of the miner. metrics of the miner's state (e.g. queue depths) are read
+        when they are exposed, the others are updated by the miner
+        :return: metrics.Registry object
+        """
+        metrics = Registry()
+        metrics.register(Gauge('twittermine_queue_depth', 'Pending jobs in every queue', ['queue'],
+                               lambda: {(type,): self.queues[type].qsize()
+                                        for type in QUEUES_TYPES}))
+        self.jobs_metric = metrics.register(
+            Counter('twittermine_jobs_total', 'Finished jobs', ['queue', 'state']))
+        self.items_metric = metrics.register(
+            Counter('twittermine_items_total', 'Items (ids, tweets or users) retrieved by jobs',
+                    ['queue']))
+        self.api_latency_metric = metrics.register(
+            Histogram('twittermine_api_request_seconds', 'Latency of twitter API requests',
+                      ['resource']))
+        metrics.register(Gauge('twittermine_rate_limit_remaining',
+                               'Requests left in the current rate limit window',
+                               ['credential', 'resource'],
+                               lambda: self._rate_limit_budget(0)))
+        metrics.register(Gauge('twittermine_rate_limit_limit',
+                               'Requests allowed in a rate limit window',
+                               ['credential', 'resource'],
+                               lambda: self._rate_limit_budget(1)))
+        metrics.register(Counter('twittermine_writer_records_total', 'Writes of user records', (),
+                                 lambda: {(): self.writer.records_written}))
+        metrics.register(Counter('twittermine_writer_bytes_total',
+                                 'Bytes of data in writes of user records', (),
+                                 lambda: {(): self.writer.bytes_written}))
+        self.stream_tweets_metric = metrics.register(
+            Counter('twittermine_stream_tweets_total', 'Tweets received from the stream'))
+        self.stream_disconnects_metric = metrics.register(
+            Counter('twittermine_stream_disconnects_total',
+                    'Stream connections that were closed by twitter or failed'))
+        self.stream_limits_metric = metrics.register(
+            Counter('twittermine_stream_limit_notices_total',
+                    'Notices that the stream matched more tweets than it delivers'))
+        return metrics
+
+    def _rate_limit_budget(self, index):
+        """
+        :param index: 0 for the remaining requests, 1 for the limit
+        :return: dictionary of (credential, resource) to the given value of its rate limit.
+                 credentials are numbered by their order in the config, so keys aren't exposed
+        """
+        return {(str(number), resource): budget[index]
+                for number, api in enumerate(self.apis)
+                for resource, budget in api.limiter.budget().items()}
+
+    def _create_threads(self):
+        """
+        :return: list of the (not started) threads of the miner
+        """
+        jobs_funcs = {'followers_ids': Miner._mine_followers_ids,
+                      'friends_ids': Miner._mine_friends_ids,
+                      'timeline': Miner._mine_timeline,
+                      'likes': Miner._mine_likes,
+                      'user_details': Miner._mine_user_details}
+        # create thread for each different job type and each api
+        threads = [Thread(target=Miner._run_consumer, args=(self, job_type, job_func, api))
+                   for job_type, job_func in jobs_funcs.items() for api in self.apis]
+        # twitter allows a single streaming connection, so there is only one listen thread
+        threads.append(
+            Thread(target=Miner._run_consumer, args=(self, 'listen', Miner._listen, self.api)))
+        return threads
+
+    def _consumers_count(self, job_type):
+        """
+        :return: the number of consumers of the given job type (each needs its own STOP_SIGNAL)
+        """
+        return 1 if job_type == 'listen' else len(self.apis)
+
+    def _mine_user_details(self, api, jobs_args):
+        """
+        retrieve details of users according to their screen names. all users are retrieved with a
+        single users/lookup request, so at most USERS_LOOKUP_BATCH jobs should be given.
+        :param jobs_args: list of dictionaries, each with a key 'screen_name' which indicates a user
+                          to retrieve
+        :return: set of the screen names (lower case) of the users that were retrieved
+        :raise RuntimeError: if the request failed
+        """
+        screen_names = list({args['screen_name'] for args in jobs_args})
+        self.logger.info('mining user details of {0} users'.format(len(screen_names)))
+        r = api.request('users/lookup', params={'screen_name': ','.join(screen_names)})
+        return self._write_users_lookup(r)
+
+    def _write_users_lookup(self, r):
+        """
+        write the users of a users/lookup response
+        :param r: the response
+        :return: set of the screen names (lower case) of the users that were written
+        :raise RuntimeError: if the response is an error
+        """
+        if r.status_code >= 400:
+            try:
+                msg = r.json()['errors'][0]['message']
+            except ValueError:
+                # response body does not contain valid json
+                msg = 'Error code {0}'.format(r.status_code)
+            raise RuntimeError('mining user details failed. {0}'.format(msg))
+        users = r.json()
+        for details in users:
             self.writer.write_user(details)
-            self.logger.info('user details mined successfully')
-            return details['id']
-        except TwitterConnectionError as e:
-            # message is logged the TwitterConnectionError constructor
-            return None
+        # users that don't exist (or are suspended) are silently omitted by twitter
+        self.logger.info('details of {0} users mined successfully'.format(len(users)))
+        return {details['screen_name'].lower() for details in users}
 
     def _produce_user_details_job(self, screen_name):
         """
@@ -118,163 +405,284 @@ class Miner:
         this function is called by other mining functions.
         """
         if not self.writer.user_details_exist(screen_name):
-            self.produce_job('user_details', {'screen_name': screen_name})
+            # the miner doesn't wait for room in its own queues
+            self.produce_job('user_details', {'screen_name': screen_name}, bounded=False)
 
-    def _mine_friends_followers(self, args, resource, writer_func):
+    def _paged_job(self, job_type, args):
+        """
+        prepare a paged job. incremental jobs (see INCREMENTAL_JOBS) request only tweets that are
+        newer than the stored ones
+        :param job_type: one of the keys of PAGED_JOBS
+        :param args: the job args
+        :return: tuple (resource, params, progress) to page through the resource with. progress is
+                 the PagingProgress of the job
         """
-        retrieve ids of friends or followers
-        :param args: dictionary with the screen_name and limit
-        :param resource: the resource ('followers/ids' or 'friends/ids')
-        :param writer_func: the writer's function to use
+        resource, data_name, params, flush_size, writer_func = PAGED_JOBS[job_type]
+        screen_name = args['screen_name']
+        params = dict(params, screen_name=screen_name)
+        if job_type in SNAPSHOT_JOBS:
+            # the first flush of the job replaces the previous list
+            flush_func = lambda ids, offset: writer_func(self.writer, ids, screen_name, offset > 0)
+            finish_func = lambda progress: self._add_ids_snapshot(screen_name, data_name, progress)
+            return resource, params, PagingProgress(self.writer, args, data_name, flush_size,
+                                                    flush_func, finish_func)
+        if job_type not in INCREMENTAL_JOBS:
+            flush_func = lambda items, offset: writer_func(self.writer, items, screen_name)
+            return resource, params, PagingProgress(self.writer, args, data_name, flush_size,
+                                                    flush_func)
+
+        products = args['products'] if job_type == 'timeline' else {data_name: args['limit']}
+        # the newest stored tweet of every product when the job started. these are kept in the
+        # checkpoints of the job, so a resumed job requests the same tweets (the stored data already
+        # has some of the job's tweets)
+        checkpoint = self.writer.get_checkpoint(screen_name, data_name)
+        latest_ids = dict()
+        # for products that already have the tweets above some id from an earlier run of the job
+        # (see below), that id
+        written_ids = dict()
+        if checkpoint is not None and 'job_state' in checkpoint:
+            latest_ids = dict(checkpoint['job_state']['latest_ids'])
+            written_ids = dict(checkpoint['job_state'].get('written_ids', {}))
+            if checkpoint['position'] is not None and \
+                    any(product not in latest_ids for product in products):
+                # a product was merged into the job after it started paging. the job pages again
+                # from the newest tweet, so the new product gets the pages before the checkpoint,
+                # and the other products only take the tweets they don't have yet
+                max_id = checkpoint['position']['max_id']
+                for product in latest_ids:
+                    written_ids[product] = min(written_ids.get(product, max_id), max_id)
+                self.logger.info('restarting {0} of {1} for new products'.format(data_name,
+                                                                                 screen_name))
+                self.writer.write_checkpoint(screen_name, data_name, dict(
+                    checkpoint, position=None, total=0,
+                    job_state={'latest_ids': latest_ids, 'written_ids': written_ids}))
+        for product in products:
+            if product not in latest_ids:
+                latest_ids[product] = self.writer.get_latest_id(screen_name, product)
+        if None not in latest_ids.values():
+            params['since_id'] = min(latest_ids.values())
+        if job_type == 'timeline':
+            flush_func = lambda tweets, offset: self._write_timeline(args, tweets, offset,
+                                                                     latest_ids, written_ids)
+        else:
+            flush_func = lambda items, offset: writer_func(
+                self.writer, _newer_than(items, latest_ids[data_name]), screen_name)
+        finish_func = lambda progress: self._write_latest_ids(screen_name, latest_ids,
+                                                              progress.newest_id)
+        return resource, params, PagingProgress(self.writer, args, data_name, flush_size,
+                                                flush_func, finish_func,
+                                                {'latest_ids': latest_ids,
+                                                 'written_ids': written_ids})
+
+    def _write_timeline(self, args, tweets, offset, latest_ids, written_ids):
+        """
+        write tweets of a timeline job to all the products of the job. each product gets only the
+        tweets within its own limit that it doesn't already have
+        :param args: the timeline job args
+        :param tweets: list of tweets
+        :param offset: the index of the first given tweet in the timeline job
+        :param latest_ids: dictionary of product to the newest tweet it had when the job started
+        :param written_ids: dictionary of product to the id above which the product already has
+                            the tweets of the job (products that were paged before the job
+                            restarted for a new product)
+        """
+        for product, limit in args['products'].items():
+            if limit != 0:
+                product_tweets = tweets[:max(limit - offset, 0)]
+            else:
+                product_tweets = tweets
+            product_tweets = _newer_than(product_tweets, latest_ids[product])
+            if product in written_ids:
+                product_tweets = [t for t in product_tweets if t['id'] <= written_ids[product]]
+            if product_tweets:
+                append = offset > 0 or latest_ids[product] is not None or product in written_ids
+                TIMELINE_PRODUCTS[product](self.writer, product_tweets, args['screen_name'],
+                                           append)
+
+    def _add_ids_snapshot(self, screen_name, data_name, progress):
+        """
+        store the retrieved ids list as a new snapshot, if the whole list was retrieved. a list
+        that was cut by the job limit is not a snapshot, since every missing id would look removed
+        """
+        if progress.complete:
+            number = self.writer.add_ids_snapshot(screen_name, data_name)
+            self.logger.info('stored snapshot {0} of {1} of user {2}'.format(number, data_name,
+                                                                              screen_name))
+
+    def _write_latest_ids(self, screen_name, latest_ids, newest_id):
+        """
+        record the newest tweet of every product after an incremental job completed
+        :param latest_ids: dictionary of product to the newest tweet it had when the job started
+        :param newest_id: the newest tweet retrieved by the job, or None
+        """
+        for product, latest_id in latest_ids.items():
+            if newest_id is not None and (latest_id is None or newest_id > latest_id):
+                self.writer.write_latest_id(screen_name, product, newest_id)
+
+    def _mine_paged(self, api, job_type, args, job_id):
+        """
+        page through the resource of a paged job (see PAGED_JOBS) and write the items.
+        the position of the next page is saved after every flush, so an interrupted job
+        continues from where it stopped the next time it runs
+        :param api: the api to use for the requests
+        :param job_type: one of the keys of PAGED_JOBS
+        :param args: dictionary with keys 'screen_name' and 'limit'
+        :param job_id: the id of the job, for reporting its progress
         """
         screen_name = args['screen_name']
-        limit = args['limit']
         self._produce_user_details_job(screen_name)
-        if limit == 0:
-            limit = float('inf')
-        ids = []
-        total = 0  # total number of ids we retrieved so far
-        r = TwitterPager(self.api, resource, params={'screen_name': screen_name})
-        for id in r.get_iterator():
-            ids.append(id)
-            total += 1
-            if len(ids) > MAX_IDS_LIST:
-                writer_func(self.writer, ids, screen_name)
-                ids = []
-            if total >= limit:
-                break
-        writer_func(self.writer, ids, screen_name)
-
-    def _mine_followers_ids(self, args):
+        resource, params, progress = self._paged_job(job_type, args)
+        on_request = lambda: self.jobs_store.update_progress(job_id, api_calls=1)
+        paging = True
+        while paging:
+            paging = False
+            for page, next_position in iterate_pages(api, resource, params, progress.position,
+                                                     on_request):
+                total = progress.total
+                done = progress.add_page(page, next_position)
+                self.items_metric.inc(job_type, amount=progress.total - total)
+                self.jobs_store.update_progress(job_id, progress.total, pages=1)
+                if job_type == 'timeline':
+                    restart = self._absorb_pending(job_id, args, params, progress, next_position,
+                                                   done)
+                    if restart is not None:
+                        params, progress = restart
+                        paging = True
+                        break
+                if done:
+                    break
+                if self.interrupted:
+                    progress.checkpoint(next_position)
+                    raise Interrupted('{0} of {1} was interrupted'.format(job_type, screen_name))
+        progress.finish()
+
+    def _absorb_pending(self, job_id, args, params, progress, next_position, done):
+        """
+        hand the pending jobs of the user of a running timeline job to it (see JobQueue.absorb),
+        so a request that overlaps the job (e.g. neighbors while the tweets of the user are mined)
+        doesn't fetch the timeline again. called after every page.
+        if no tweets were flushed yet and the new products need only the tweets that the job
+        requests, they are added to the job as it is. otherwise the job saves a checkpoint and
+        continues from it, with the new products (see _paged_job)
+        :param args: the job args. updated with the args of the absorbed jobs
+        :param params: the request params of the job
+        :param progress: the PagingProgress of the job
+        :param next_position: the position of the page after the last added page
+        :param done: whether the job is done (see PagingProgress.add_page)
+        :return: tuple (params, progress) to page with from progress.position if the job
+                 continues from its checkpoint, or None to continue as before
+        """
+        screen_name = args['screen_name']
+        latest_ids = progress.job_state['latest_ids']
+        new_latest_ids = dict()
+        # whether every tweet the job retrieved so far is still collected in memory, and the page
+        # that completed the job wasn't cut by its limit
+        collected = progress.position is None and len(progress.items) == progress.total and \
+            (not done or (progress.complete and progress.total < progress.limit))
+        in_place = False
+
+        def accept(merged):
+            nonlocal in_place
+            for product in merged['products']:
+                if product not in latest_ids:
+                    new_latest_ids[product] = self.writer.get_latest_id(screen_name, product)
+            since_id = params.get('since_id')
+            in_place = collected and (since_id is None or all(
+                latest_id is not None and latest_id >= since_id
+                for latest_id in new_latest_ids.values()))
+            return in_place or next_position is not None
+
+        merged = self.queues['timeline'].absorb(job_id, accept)
+        if merged is None:
+            return None
+        self.logger.info('timeline of {0} took over the pending jobs of the user'.format(
+            screen_name))
+        if in_place:
+            args.update(merged)
+            latest_ids.update(new_latest_ids)
+            progress.limit = args['limit'] if args['limit'] != 0 else float('inf')
+            return None
+        # the collected tweets are written to the products the job had until now
+        progress.checkpoint(next_position)
+        args.update(merged)
+        resource, params, progress = self._paged_job('timeline', args)
+        return params, progress
+
+    def _mine_followers_ids(self, api, args, job_id):
         """
         retrieve ids of the user's followers
         :param args: dictionary with keys 'screen_name' and 'limit'. limit 0 means no limit
+        :param job_id: the id of the job
         :return:
         """
         self.logger.info('mining followers ids for user {0}'.format(args['screen_name']))
 
         try:
-            self._mine_friends_followers(args, 'followers/ids', DW.write_followers)
+            self._mine_paged(api, 'followers_ids', args, job_id)
             self.logger.info('followers mined successfully')
 
         except TwitterRequestError as e:
             self.logger.error(
                 'mining followers failed. Status code {0}: {1}'.format(e.status_code, e.msg))
+            raise
 
-    def _mine_friends_ids(self, args):
+    def _mine_friends_ids(self, api, args, job_id):
         """
         retrieve ids of the user's friends
         :param args: dictionary with keys 'screen_name' and 'limit'. limit 0 means no limit
+        :param job_id: the id of the job
         :return:
         """
         self.logger.info('mining friends ids for user {0}'.format(args['screen_name']))
 
         try:
-            self._mine_friends_followers(args, 'friends/ids', DW.write_followers)
+            self._mine_paged(api, 'friends_ids', args, job_id)
             self.logger.info('friends mined successfully')
 
         except TwitterRequestError as e:
             self.logger.error(
                 'mining friends failed. Status code {0}: {1}'.format(e.status_code, e.msg))
+            raise
 
-    def _mine_tweets_likes(self, args, resource, writer_func):
-        """
-        retrieve tweets or likes of a user
-        :param args: dictionary with keys 'screen_name' and 'limit'
-        :param resource: 'statuses/user_timeline' or 'favorites/list'
-        :param writer_func: the writer's function to use
+    def _mine_timeline(self, api, args, job_id):
         """
-        screen_name = args['screen_name']
-        limit = args['limit']
-        self._produce_user_details_job(screen_name)
-        if limit == 0:
-            limit = float('inf')
-        tweets = []
-        total = 0
-        r = TwitterPager(self.api, resource, params={'screen_name': screen_name,
-                                                     'count': 200,
-                                                     'tweet_mode': 'extended'})
-        for t in r.get_iterator():
-            tweets.append(t)
-            total += 1
-            if len(tweets) > MAX_TWEETS_LIST:
-                writer_func(self.writer, tweets, screen_name)
-                tweets = []
-            if total >= limit:
-                break
-        writer_func(self.writer, tweets, screen_name)
-
-    def _mine_tweets(self, args):
-        """
-        retrieve tweets of the given user
-        :param args: dictionary with keys 'screen_name' and 'limit'
+        retrieve the timeline (tweets) of the given user and write all of its requested products:
+        * tweets - the tweets themselves
+        * neighbors - for each tweet that indicates some neighbor of the user, the following
+                      information is stored: neighbor_screen_name;tweet_id;neighborship_type
+                      (see utils.get_neighbors)
+
+        the timeline is fetched once, up to the largest limit of the products.
+        :param args: dictionary with keys 'screen_name', 'limit' and 'products' (dictionary that
+                     maps each product to its limit)
+        :param job_id: the id of the job
         :return:
         """
         try:
-            self.logger.info('mining tweets of user {0}'.format(args['screen_name']))
-            self._mine_tweets_likes(args, 'statuses/user_timeline', DW.write_tweets_of_user)
-            self.logger.info('tweets mined successfully')
+            self.logger.info('mining {0} of user {1}'.format(', '.join(args['products']),
+                                                             args['screen_name']))
+            self._mine_paged(api, 'timeline', args, job_id)
+            self.logger.info('timeline mined successfully')
         except TwitterRequestError as e:
             self.logger.error(
-                'mining tweets failed. Status code {0}: {1}'.format(e.status_code, e.msg))
+                'mining timeline failed. Status code {0}: {1}'.format(e.status_code, e.msg))
+            raise
 
-    def _mine_likes(self, args):
+    def _mine_likes(self, api, args, job_id):
         """
         retrieve tweets that the user likes
         :param args: dictionary with keys 'screen_name' and 'limit'
+        :param job_id: the id of the job
         :return:
         """
         try:
             self.logger.info('mining likes of user {0}'.format(args['screen_name']))
-            self._mine_tweets_likes(args, 'favorites/list', DW.write_likes)
+            self._mine_paged(api, 'likes', args, job_id)
             self.logger.info('likes mined successfully')
         except TwitterRequestError as e:
             self.logger.error(
                 'mining likes failed. Status code {0}: {1}'.format(e.status_code, e.msg))
-
-    def _mine_neighbors(self, args):
-        """
-        this function mines neighbors of a given user.
-        B is considered a neighbor of A if one of the following holds:
-        * A retweeted a tweet by B
-        * A quoted a tweet by B
-        * A replied to B
-
-        data is stored for each tweet that indicates some neighbor of the given user.
-        for each such tweet, the following information is stored:
-        neighbor_screen_name;tweet_id;neighborship_type
-
-        neighborship_type is one of the constants RETWEET, QUOTE or REPLY from TwitterMine.utils
-
-        :param args: dictionary with keys 'screen_name' and 'limit'
-        """
-        screen_name = args['screen_name']
-        limit = args['limit']
-        self.logger.info('mining neighbors of user {0}'.format(screen_name))
-        self._produce_user_details_job(screen_name)
-        if limit == 0:
-            limit = float('inf')
-        neighbors = []
-        total = 0
-        r = TwitterPager(self.api, 'statuses/user_timeline', params={'screen_name': screen_name,
-                                                                     'count': 200})
-        try:
-            for t in r.get_iterator():
-                total += 1
-                neighbor_scr_name = utils.get_original_author(t)
-                if neighbor_scr_name is not None and neighbor_scr_name != screen_name:
-                    type = utils.get_tweet_type(t)
-                    neighbors.append('{0};{1};{2}'.format(neighbor_scr_name, t['id_str'], type))
-                if len(neighbors) >= MAX_TWEETS_LIST:
-                    self.writer.write_neighbors(neighbors, screen_name)
-                    neighbors = []
-                if total >= limit:
-                    break
-            self.writer.write_neighbors(neighbors, screen_name)
-            self.logger.info('neighbors mined successfully')
-        except TwitterRequestError as e:
-            self.logger.error(
-                'mining neighbors failed. Status code {0}: {1}'.format(e.status_code, e.msg))
+            raise
 
     def _update_listen_parameters(self, track, follow, args):
         """
@@ -308,7 +716,7 @@ class Miner:
         keywords.sort()
         return '.'.join(keywords)
 
-    def _listen(self):
+    def _listen(self, api):
         """
         this function handles all listen jobs.
         the args to a listen job is a dictionary with the following structure
@@ -316,113 +724,247 @@ class Miner:
               'track'  : ['term1', 'term2', ... ],
               'follow' : ['id1', 'id2', ... ] }
 
+        tweets of the stream are written with a buffered StreamWriter, which is kept open as long as
+        the stream parameters don't change
+
+        :param api: the api to use for the streaming connection
         :return: this function does not return
         """
         track = set()
         follow = set()
         args_queue = self.queues['listen']
-        while True:
-            try:
-                while (not args_queue.empty()) or (not track and not follow):
-                    # there are more arguments to process OR both track and follow are empty
-                    args = args_queue.get(block=True, timeout=None)  # will block if queue is empty
-                    if args is STOP_SIGNAL:
-                        return
-                    args_queue.task_done()
-                    track, follow = self._update_listen_parameters(track, follow, args)
-                self.logger.info(
-                    'listening: track={0}, follow={1}'.format(str(track), str(follow)))
-                r = self.api.request('statuses/filter', {'track': ','.join(track),
-                                                         'follow': ','.join(follow),
-                                                         'tweet_mode': 'extended',
-                                                         'stall_warnings': 'true',
-                                                         'filter_level': FILTER_LEVEL})
-                stream_str = self._get_listen_query_representation(track, follow)  # the string
-                # representation of the stream
-                iterator = r.get_iterator()
-                for item in iterator:
-                    if item:
-                        if 'warning' in item:
-                            self.logger.warning(item['warning']['message'])
-                        elif 'disconnect' in item:
-                            event = item['disconnect']
-                            self.logger.error('streaming API shutdown: {0}'.format(event['reason']))
+        stream_writer = None
+        stream_str = None
+        try:
+            while True:
+                try:
+                    while (not args_queue.empty()) or (not track and not follow):
+                        # there are more arguments to process OR both track and follow are empty
+                        if stream_writer is not None:
+                            # don't keep buffered tweets while waiting for new arguments
+                            stream_writer.flush()
+                        # will block if queue is empty
+                        args = args_queue.get(block=True, timeout=None)
+                        if args is STOP_SIGNAL:
+                            return
+                        args_queue.task_done()
+                        track, follow = self._update_listen_parameters(track, follow, args)
+                    self.logger.info(
+                        'listening: track={0}, follow={1}'.format(str(track), str(follow)))
+                    r = api.request('statuses/filter', {'track': ','.join(track),
+                                                        'follow': ','.join(follow),
+                                                        'tweet_mode': 'extended',
+                                                        'stall_warnings': 'true',
+                                                        'filter_level': FILTER_LEVEL})
+                    # the string representation of the stream
+                    new_stream_str = self._get_listen_query_representation(track, follow)
+                    if new_stream_str != stream_str:
+                        if stream_writer is not None:
+                            stream_writer.close()
+                        stream_str = new_stream_str
+                        stream_writer = self.writer.open_stream(stream_str)
+                    iterator = r.get_iterator()
+                    for item in iterator:
+                        if item:
+                            if 'warning' in item:
+                                self.logger.warning(item['warning']['message'])
+                            elif 'disconnect' in item:
+                                self.stream_disconnects_metric.inc()
+                                event = item['disconnect']
+                                self.logger.error(
+                                    'streaming API shutdown: {0}'.format(event['reason']))
+                                break
+                            elif 'text' in item or 'full_text' in item or 'extended_tweet' in item:
+                                # item is a tweet. ready to be written
+                                stream_writer.write(item)
+                                self.stream_tweets_metric.inc()
+
+                            # currently, no use in the following types of messages
+                            elif 'delete' in item:
+                                # user deleted a tweet
+                                pass
+                            elif 'limit' in item:
+                                # more Tweets were matched than the current rate limit allows
+                                self.stream_limits_metric.inc()
+                            elif 'event' in item and item['event'] == 'user_update':
+                                # user updated his profile
+                                pass
+                        # keep-alive messages also get here, so a quiet stream is flushed too
+                        stream_writer.flush_if_needed()
+
+                        if not args_queue.empty():
+                            # new job args received. close current connection, update args and
+                            # start again
+                            r.close()
                             break
-                        elif 'text' in item or 'full_text' in item or 'extended_tweet' in item:
-                            # item is a tweet. ready to be written
-                            self.writer.write_tweets_of_stream([item], stream_str)
-
-                        # currently, no use in the following types of messages
-                        elif 'delete' in item:
-                            # user deleted a tweet
-                            tweet = item['status']
-                            pass
-                        elif 'limit' in item:
-                            # more Tweets were matched than the current rate limit allows
-                            pass
-                        elif 'event' in item and item['event'] == 'user_update':
-                            # user updated his profile
-                            pass
-
-                    if not args_queue.empty():
-                        # new job args received. close current connection, update args and
-                        # start again
-                        r.close()
-                        break
 
-            except TwitterRequestError as e:
-                if e.status_code < 500:
-                    # something needs to be fixed before re-connecting
-                    # print information and start a new empty listen job
-                    self.logger.error(
-                        'Got exception during listen job: {0}. Starting an empty listen job'.
-                            format(e))
-                    track = set()
-                    follow = set()
-                else:
+                except TwitterRequestError as e:
+                    self.stream_disconnects_metric.inc()
+                    if e.status_code < 500:
+                        # something needs to be fixed before re-connecting
+                        # print information and start a new empty listen job
+                        self.logger.error(
+                            'Got exception during listen job: {0}. Starting an empty listen job'.
+                                format(e))
+                        track = set()
+                        follow = set()
+                    else:
+                        # temporary interruption, re-try request
+                        pass
+                except TwitterConnectionError:
                     # temporary interruption, re-try request
-                    pass
-            except TwitterConnectionError:
-                # temporary interruption, re-try request
-                pass
+                    self.stream_disconnects_metric.inc()
+        finally:
+            if stream_writer is not None:
+                stream_writer.close()
 
-    def _run_consumer(self, job_type, job_func):
+    def _run_consumer(self, job_type, job_func, api):
         """
         consume all jobs of a specific type. this function does not return and constantly handles or
         waiting for new jobs
         :param job_type: the type of job (one of the constants in miner.JOBS_TYPES)
         :param job_func: the miner function that should be called for handling this job
+        :param api: the api this consumer uses. each consumer thread has its own api
         :return:
         """
         if job_type == 'listen':
-            job_func(self)
+            job_func(self, api)
+        elif job_type == 'user_details':
+            self._run_batch_consumer(job_type, job_func, api, USERS_LOOKUP_BATCH)
         else:  # standard rest API job
             while True:
+                job = self.queues[job_type].get(block=True, timeout=None)
+                # if no job available, get() will block until new job arrives
+                if job is STOP_SIGNAL:
+                    return
+                job_id, job_args = job
+                error = None
                 try:
-                    job_args = self.queues[job_type].get(block=True, timeout=None)
-                    if job_args is STOP_SIGNAL:
-                        return
-                    # if no job available, get() will block until new job arrives
-                    job_func(self, job_args)
-                    self.queues[
-                        job_type].task_done()  # this is to indicate that the job was processed.
-                    # this is important if anyone wants to wait until all jobs in the queue are done
+                    job_func(self, api, job_args, job_id)
+                except Interrupted as e:
+                    # the job stays in the store, and continues from its checkpoint when the miner
+                    # restarts
+                    self.logger.info('{0} job stopped: {1}'.format(job_type, str(e)))
+                    continue
                 except Exception as e:
-                    self.logger.error('{0} job failed: {1}'.format(job_type, str(e)))
-                    pass
+                    error = self._job_error(job_type, e)
+                # mark the job as finished. jobs that were interrupted before reaching here are
+                # handled again when the miner restarts
+                self._task_done(job_type, job_id, error)
 
-    def produce_job(self, job_type, args):
+    def _run_batch_consumer(self, job_type, job_func, api, batch_size):
+        """
+        consume jobs of a specific type in batches. blocks until at least one job is available,
+        then takes up to batch_size pending jobs from the queue and handles them together.
+        this function does not return until a STOP_SIGNAL is received
+        :param job_type: the type of job (one of the constants in miner.JOBS_TYPES)
+        :param job_func: the miner function that handles a list of jobs arguments
+        :param api: the api this consumer uses
+        :param batch_size: maximum number of jobs to handle together
+        """
+        queue = self.queues[job_type]
+        stop = False
+        while not stop:
+            batch = []
+            job = queue.get(block=True, timeout=None)
+            # stop draining at a STOP_SIGNAL, other consumers of this queue need theirs
+            while job is not STOP_SIGNAL:
+                batch.append(job)
+                if len(batch) >= batch_size:
+                    break
+                try:
+                    job = queue.get(block=False)
+                except Empty:
+                    break
+            stop = job is STOP_SIGNAL
+            retrieved = set()
+            error = None
+            try:
+                if batch:
+                    retrieved = job_func(self, api, [job_args for job_id, job_args in batch])
+            except Interrupted as e:
+                # the jobs stay in the store for when the miner restarts
+                self.logger.info('{0} jobs stopped: {1}'.format(job_type, str(e)))
+                continue
+            except Exception as e:
+                error = self._job_error(job_type, e)
+            self._finish_batch(batch, retrieved, error)
+
+    def _job_error(self, job_type, e):
+        """
+        :param e: the exception that a job raised
+        :return: the error message of the failed job, for its status. failed twitter requests were
+                 already logged by the job
+        """
+        if isinstance(e, TwitterRequestError):
+            return 'Status code {0}: {1}'.format(e.status_code, e.msg)
+        self.logger.error('{0} job failed: {1}'.format(job_type, str(e)))
+        return str(e)
+
+    def _finish_batch(self, batch, retrieved, error):
+        """
+        mark a batch of user details jobs as finished, after a single users/lookup request
+        :param batch: list of tuples (job_id, args)
+        :param retrieved: set of the screen names (lower case) that were retrieved
+        :param error: the error message if the request failed, or None
+        """
+        self.items_metric.inc('user_details', amount=len(retrieved))
+        for i, (job_id, job_args) in enumerate(batch):
+            # a job with bad arguments must not stop the consumer, or leave the rest of the batch
+            # unfinished
+            job_error = error
+            try:
+                items = 1 if str(job_args['screen_name']).lower() in retrieved else 0
+                # the single request is counted once, on the first job of the batch, so the sum
+                # over jobs matches the calls that were made
+                self.jobs_store.update_progress(job_id, items, pages=1, api_calls=int(i == 0))
+            except Exception as e:
+                job_error = job_error or self._job_error('user_details', e)
+            self._task_done('user_details', job_id, job_error)
+
+    def _task_done(self, job_type, job_id, error):
+        """
+        mark a job as finished (see JobQueue.task_done) and count it
+        :param job_type: the queue type of the job
+        :param error: the error message if the job failed, or None
+        """
+        self.queues[job_type].task_done(job_id, error)
+        self.jobs_metric.inc(job_type, DONE if error is None else FAILED)
+
+    def produce_job(self, job_type, args, priority=DEFAULT_PRIORITY, campaign=DEFAULT_CAMPAIGN,
+                    bounded=True):
         """
         Create a new job to be handles by the miner.
+        A job that duplicates a pending job (same type and screen name) is merged into it, and a
+        job that is covered by a running or recently finished job is skipped.
         :param job_type: the job to perform. one of the constants in miner.JOBS_TYPES
         :param args: dictionary with the needed arguments for this job
-        :return:
+        :param priority: integer. jobs with higher priority are handled first (ignored for listen)
+        :param campaign: name of the campaign the job belongs to. campaigns with the same priority
+                         share the miner equally (ignored for listen)
+        :param bounded: whether the job is subject to the queue limits (ignored for listen)
+        :raise queue.Full: if the queue of the job is full (see the overflow policy in __init__)
+        :return: the id of the job that handles the new job (see JobQueue.put), for querying its
+                 status in the job store. None for listen jobs and jobs that were skipped because a
+                 recently finished job covers them
         """
         if args is STOP_SIGNAL:
             self.logger.error('invalid job arguments to "{0}"'.format(job_type))
+            return
         if job_type not in JOBS_TYPES:
             raise ValueError('Unsupported job type: "{0}"'.format(job_type))
-        self.queues[job_type].put(args)
+        if job_type == 'listen':
+            self.queues[job_type].put(args)
+            return None
+        if job_type in TIMELINE_PRODUCTS:
+            timeline_args = {'screen_name': args['screen_name'],
+                             'limit': args.get('limit', 0),
+                             'products': {job_type: args.get('limit', 0)}}
+            return self.queues['timeline'].put(timeline_args, priority, campaign,
+                                               self.overflow == OVERFLOW_BLOCK, PUT_TIMEOUT,
+                                               bounded)
+        return self.queues[job_type].put(args, priority, campaign, self.overflow == OVERFLOW_BLOCK,
+                                         PUT_TIMEOUT, bounded)
 
     def run(self):
         """
@@ -432,15 +974,32 @@ class Miner:
         for t in self.threads:
             t.start()
 
-    def stop(self):
-        """
-        Finishes all jobs that were produced for the miner, and stop the miner.
-        After calling this function new jobs should not be produced
-        """
+    def stop(self, drain=True, interrupt=False):
+        """
+        Stop the miner. After calling this function new jobs should not be produced
+        :param drain: if True, finish all jobs that were produced for the miner first. otherwise,
+                      only the running jobs are finished, and the pending jobs stay in the job
+                      store, to be handled the next time the miner runs
+        :param interrupt: if True (and drain is False), running jobs are interrupted too (paged
+                          jobs save a checkpoint at the current page) and stay in the job store
+                          together with the pending jobs
+        """
+        if interrupt and not drain:
+            self.logger.info('interrupt all running miner jobs')
+            self.interrupted = True
+            for api in self.apis:
+                api.limiter.interrupt()
+        if not drain:
+            for type in QUEUES_TYPES:
+                if type != 'listen':
+                    self.queues[type].interrupt()
         self.logger.info('notify all miner threads to stop')
-        for type in JOBS_TYPES:
-            self.queues[type].put(STOP_SIGNAL)
+        for type in QUEUES_TYPES:
+            for _ in range(self._consumers_count(type)):
+                self.queues[type].put(STOP_SIGNAL)
         self.logger.info('wait for all miner threads to stop')
         for t in self.threads:
             t.join()
+        self.jobs_store.close()
+        self.writer.close()
         self.logger.info('miner stopped')
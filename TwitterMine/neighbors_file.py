@@ -0,0 +1,137 @@
+import os
+import struct
+from threading import Lock
+
+NEWLINE = '\n'
+# binary neighbors file: a 16 bytes header (8 bytes magic, 4 bytes version, 4 bytes reserved),
+# followed by fixed size records (tweet_id uint64, neighbor uint32, type uint32), all little endian.
+# neighbor is the id of the neighbor's screen name in the names dictionary of the data dir
+MAGIC = b'TMNBR\x00\x00\x00'
+VERSION = 1
+HEADER = MAGIC + VERSION.to_bytes(4, 'little') + bytes(4)
+HEADER_SIZE = len(HEADER)
+RECORD = struct.Struct('<QII')
+NUMPY_DTYPE = [('tweet_id', '<u8'), ('neighbor', '<u4'), ('type', '<u4')]
+TMP_SUFFIX = '.tmp'
+FILE_SUFFIX = '.bin'  # the suffix of neighbors files in a user directory ('neighbors.bin')
+# the dictionary of screen names in the data dir. prefix '#' is necessary so this file will not be
+# in conflict with a legal twitter screen name
+NAMES_FILE_NAME = '#names'
+
+
+class NamesDictionary:
+    """
+    Interns screen names: every screen name gets a serial id, in the order it was first seen. The
+    names are kept in a file with a name in every line (the line number is the id), which is only
+    appended to, so ids never change.
+
+    The dictionary is loaded on first use. It is thread safe. A read only dictionary (for readers
+    of a data dir that may be mined at the same time) never changes the file, and ignores a
+    partially written last name.
+    """
+
+    def __init__(self, path, read_only=False):
+        """
+        :param path: the path of the names file. created if not exist (unless read_only)
+        :param read_only: whether the dictionary is only read. intern() is not allowed
+        """
+        self.path = path
+        self.read_only = read_only
+        self.lock = Lock()
+        self.names = None  # list of names by id
+        self.ids = None  # name -> id
+
+    def _load(self):
+        """
+        must be called while holding the lock
+        """
+        if self.names is not None:
+            return
+        self.names = []
+        if os.path.isfile(self.path):
+            with open(self.path, mode='rb') as f:
+                data = f.read()
+            complete = data.rfind(NEWLINE.encode('utf-8')) + 1
+            if complete < len(data) and not self.read_only:
+                # a partially written name (e.g. after a crash). no record refers to it
+                with open(self.path, mode='r+b') as f:
+                    f.truncate(complete)
+            self.names = data[:complete].decode('utf-8').split(NEWLINE)[:-1]
+        self.ids = {name: id for id, name in enumerate(self.names)}
+
+    def intern(self, names):
+        """
+        :param names: list of screen names
+        :return: list of the ids of the given names. new names are added to the dictionary
+        :raise ValueError: if the dictionary is read only
+        """
+        if self.read_only:
+            raise ValueError('Cannot add to a read only names dictionary: {0}'.format(self.path))
+        with self.lock:
+            self._load()
+            new_names = []
+            for name in names:
+                if name not in self.ids:
+                    self.ids[name] = len(self.names)
+                    self.names.append(name)
+                    new_names.append(name)
+            if new_names:
+                with open(self.path, mode='a', encoding='utf-8') as f:
+                    f.write(''.join(name + NEWLINE for name in new_names))
+            return [self.ids[name] for name in names]
+
+    def all_names(self):
+        """
+        :return: list of all names, by id
+        """
+        with self.lock:
+            self._load()
+            return list(self.names)
+
+
+def write_neighbors(path, records, append=True):
+    """
+    write neighbor records to a binary neighbors file
+    :param path: the path of the file
+    :param records: list of tuples (tweet_id, neighbor, type)
+    :param append: whether to append the records to the file (created if not exist) or replace it.
+                   the replacement is atomic
+    """
+    data = b''.join(RECORD.pack(*record) for record in records)
+    if append and os.path.isfile(path):
+        with open(path, mode='ab') as f:
+            f.write(data)
+        return
+    with open(path + TMP_SUFFIX, mode='wb') as f:
+        f.write(HEADER)
+        f.write(data)
+    os.replace(path + TMP_SUFFIX, path)
+
+
+def _read_data(path):
+    with open(path, mode='rb') as f:
+        header = f.read(HEADER_SIZE)
+        if header[:len(MAGIC)] != MAGIC:
+            raise ValueError('{0} is not a neighbors file'.format(path))
+        data = f.read()
+    # ignore a partially written record at the end of the file
+    return data[:len(data) - len(data) % RECORD.size]
+
+
+def read_neighbors(path):
+    """
+    :param path: the path of a binary neighbors file
+    :return: list of tuples (tweet_id, neighbor, type)
+    """
+    return list(RECORD.iter_unpack(_read_data(path)))
+
+
+def read_neighbors_array(path):
+    """
+    load a binary neighbors file to a numpy structured array, without parsing. requires numpy
+    :param path: the path of a binary neighbors file
+    :return: numpy array with the fields 'tweet_id', 'neighbor' and 'type'
+    """
+    import numpy as np
+
+    return np.frombuffer(_read_data(path), dtype=np.dtype(NUMPY_DTYPE))
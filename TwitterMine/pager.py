@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import time
+
+from TwitterAPI.TwitterError import TwitterRequestError, TwitterConnectionError
+
+RETRY_WAIT = 5  # seconds to wait before re-trying a request after a temporary failure
+
+
+def _next_position(items, data):
+    """
+    :param items: the items of a page
+    :param data: the json body of the page response
+    :return: the position of the page after the given one, or None if this is the last page
+    """
+    if isinstance(data, dict) and 'next_cursor' in data:
+        cursor = data['next_cursor']
+        return {'cursor': cursor} if cursor != 0 else None
+    if items:
+        return {'max_id': min(item['id'] for item in items) - 1}
+    return None
+
+
+def iterate_pages(api, resource, params, position=None, on_request=None):
+    """
+    Generator of the pages of a paged twitter resource. Works with both cursored resources
+    (e.g. 'followers/ids') and timelines that are paged with max_id (e.g. 'statuses/user_timeline').
+
+    Unlike TwitterPager, every page is yielded together with the position of the next page, so
+    callers can save it and resume the iteration later.
+
+    Temporary failures (connection errors and 5xx responses) are re-tried. Other errors raise
+    TwitterRequestError.
+
+    :param api: TwitterAPI (or RateLimitedAPI) object
+    :param resource: the resource to page through
+    :param params: dictionary of request parameters
+    :param position: dictionary returned with a previous page ({'cursor': ...} or {'max_id': ...}),
+                     to start from the page after it. None to start from the first page
+    :param on_request: function without arguments that is called before every request (including
+                       re-tries). optional
+    :return: yields tuples (items, next_position). items is the list of items in the page.
+             next_position is the position of the next page, or None if this is the last page
+    """
+    logger = logging.getLogger()
+    params = dict(params)
+    if position is not None:
+        params.update(position)
+    while True:
+        if on_request is not None:
+            on_request()
+        try:
+            r = api.request(resource, params)
+            items = list(r.get_iterator())
+            data = r.json()
+        except TwitterRequestError as e:
+            if e.status_code < 500:
+                raise
+            logger.warning('{0} request failed with status {1}. re-trying'.format(resource,
+                                                                                  e.status_code))
+            time.sleep(RETRY_WAIT)
+            continue
+        except TwitterConnectionError:
+            time.sleep(RETRY_WAIT)
+            continue
+
+        next_position = _next_position(items, data)
+        yield items, next_position
+        if next_position is None:
+            return
+        params.update(next_position)
+
+
+async def iterate_pages_async(api, resource, params, position=None, executor=None,
+                              on_request=None):
+    """
+    same as iterate_pages(), as an asynchronous generator for use in an asyncio event loop
+    :param api: RateLimitedAPI object
+    :param executor: the executor in which requests are sent (see RateLimitedAPI.request_async)
+    :param on_request: see iterate_pages(). called in the executor too, so it may block
+    """
+    logger = logging.getLogger()
+    loop = asyncio.get_running_loop()
+    params = dict(params)
+    if position is not None:
+        params.update(position)
+    while True:
+        if on_request is not None:
+            await loop.run_in_executor(executor, on_request)
+        try:
+            r = await api.request_async(resource, params, executor)
+            items = list(r.get_iterator())
+            data = r.json()
+        except TwitterRequestError as e:
+            if e.status_code < 500:
+                raise
+            logger.warning('{0} request failed with status {1}. re-trying'.format(resource,
+                                                                                  e.status_code))
+            await asyncio.sleep(RETRY_WAIT)
+            continue
+        except TwitterConnectionError:
+            await asyncio.sleep(RETRY_WAIT)
+            continue
+
+        next_position = _next_position(items, data)
+        yield items, next_position
+        if next_position is None:
+            return
+        params.update(next_position)
@@ -0,0 +1,269 @@
+import asyncio
+import logging
+import time
+from threading import Condition
+
+WINDOW_SECONDS = 15 * 60  # twitter's rate limit window
+RESET_MARGIN = 1  # seconds to wait after a window reset, to absorb clock differences
+
+# number of requests allowed in a single window for each resource: (user auth, app auth).
+# these are only used until the first response of a resource reports the real limits
+DEFAULT_LIMITS = {
+    'users/show': (900, 900),
+    'users/lookup': (900, 300),
+    'followers/ids': (15, 15),
+    'friends/ids': (15, 15),
+    'statuses/user_timeline': (900, 1500),
+    'statuses/lookup': (900, 300),
+    'favorites/list': (75, 75),
+    'search/tweets': (180, 450),
+}
+
+HTTP_TOO_MANY_REQUESTS = 429
+INTERRUPT_POLL_SECONDS = 1  # how often an asynchronous wait for the rate limit checks interrupt()
+
+
+class Interrupted(Exception):
+    """
+    Raised when a job is interrupted because the miner is stopping (see RateLimiter.interrupt)
+    """
+
+
+class RateLimitBucket:
+    """
+    The request budget of a single resource (e.g. 'followers/ids') in the current rate limit
+    window. Every request should take a token from the bucket using acquire(), which blocks until
+    the window resets if the budget is exhausted.
+
+    The bucket is updated from the x-rate-limit-* headers of every response, so it always follows
+    the real window that twitter keeps for this resource.
+    """
+
+    def __init__(self, resource, limit=None):
+        """
+        :param resource: the resource name
+        :param limit: number of requests per window. None if unknown, in which case requests are
+                      not held back until a response tells us otherwise
+        """
+        self.resource = resource
+        self.limit = limit
+        self.remaining = limit
+        self.reset = None  # epoch time in which the current window ends
+        self.reset_confirmed = False  # whether reset was reported by twitter, or only assumed
+        self.interrupted = False
+        self.cond = Condition()
+        self.logger = logging.getLogger()
+
+    def _refill_if_reset(self, now):
+        if self.reset is not None and now >= self.reset:
+            self.remaining = self.limit
+            self.reset = None
+            self.reset_confirmed = False
+
+    def try_acquire(self):
+        """
+        take a single request token if one is available, without blocking
+        :return: 0 if a token was taken, otherwise the number of seconds until the window resets
+        """
+        with self.cond:
+            now = time.time()
+            self._refill_if_reset(now)
+            if self.remaining is None or self.remaining > 0:
+                if self.remaining is not None:
+                    self.remaining -= 1
+                if self.reset is None and self.limit is not None:
+                    # window start is unknown until the first response. assume it starts now
+                    self.reset = now + WINDOW_SECONDS
+                return 0
+            wait = self.reset - now + RESET_MARGIN
+            self.logger.info(
+                '{0} rate limit reached. waiting {1:.0f} seconds'.format(self.resource, wait))
+            return wait
+
+    def acquire(self):
+        """
+        take a single request token. blocks until a token is available
+        :raise Interrupted: if the bucket was interrupted while waiting
+        """
+        with self.cond:
+            wait = self.try_acquire()
+            while wait > 0:
+                if self.interrupted:
+                    raise Interrupted('waiting for {0} rate limit was interrupted'.format(
+                        self.resource))
+                self.cond.wait(timeout=wait)
+                wait = self.try_acquire()
+
+    def interrupt(self):
+        """
+        wake up all waiting requests with Interrupted. requests that don't have to wait are not
+        affected
+        """
+        with self.cond:
+            self.interrupted = True
+            self.cond.notify_all()
+
+    def update(self, headers):
+        """
+        update the bucket according to the rate limit headers of a response
+        :param headers: the response headers (case insensitive dictionary)
+        """
+        try:
+            limit = int(headers['x-rate-limit-limit'])
+            remaining = int(headers['x-rate-limit-remaining'])
+            reset = int(headers['x-rate-limit-reset'])
+        except (KeyError, TypeError, ValueError):
+            return  # this resource doesn't report its limits
+        with self.cond:
+            if self.reset_confirmed and reset == int(self.reset) and self.remaining is not None:
+                # same window. other requests may already be in flight, so keep the lower value.
+                # an assumed reset is not a window, so it is never compared
+                remaining = min(remaining, self.remaining)
+            self.limit = limit
+            self.remaining = remaining
+            self.reset = reset
+            self.reset_confirmed = True
+            self.cond.notify_all()
+
+    def budget(self):
+        """
+        :return: tuple (remaining, limit) of the current window. both are None if the limit of the
+                 resource is unknown
+        """
+        with self.cond:
+            self._refill_if_reset(time.time())
+            return self.remaining, self.limit
+
+    def exhaust(self, reset=None):
+        """
+        mark the budget of the current window as exhausted (e.g. after a 429 response)
+        :param reset: epoch time in which the window ends. if None, wait a full window
+        """
+        with self.cond:
+            self.remaining = 0
+            if reset is not None:
+                self.reset = reset
+                self.reset_confirmed = True
+            elif self.reset is None or self.reset <= time.time():
+                self.reset = time.time() + WINDOW_SECONDS
+                self.reset_confirmed = False
+
+
+class RateLimiter:
+    """
+    Holds a RateLimitBucket for every resource used with a single set of credentials
+    """
+
+    def __init__(self, app_auth=True):
+        """
+        :param app_auth: whether the credentials use app authentication (affects the default limits)
+        """
+        self.app_auth = app_auth
+        self.buckets = dict()
+        self.interrupted = False
+        self.cond = Condition()
+
+    def bucket(self, resource):
+        """
+        :return: the bucket of the given resource. created on first use
+        """
+        with self.cond:
+            if resource not in self.buckets:
+                limit = None
+                if resource in DEFAULT_LIMITS:
+                    limit = DEFAULT_LIMITS[resource][1 if self.app_auth else 0]
+                self.buckets[resource] = RateLimitBucket(resource, limit)
+                self.buckets[resource].interrupted = self.interrupted
+            return self.buckets[resource]
+
+    def budget(self):
+        """
+        :return: dictionary of resource to tuple (remaining, limit) of the current window, for the
+                 resources with a known limit
+        """
+        with self.cond:
+            buckets = list(self.buckets.values())
+        budget = {bucket.resource: bucket.budget() for bucket in buckets}
+        return {resource: value for resource, value in budget.items() if value[1] is not None}
+
+    def interrupt(self):
+        """
+        interrupt all requests that wait for a rate limit, now or later (see
+        RateLimitBucket.interrupt). used for stopping the miner without waiting for rate limits
+        """
+        with self.cond:
+            self.interrupted = True
+            buckets = list(self.buckets.values())
+        for bucket in buckets:
+            bucket.interrupt()
+
+
+class RateLimitedAPI:
+    """
+    A wrapper around TwitterAPI that paces all requests according to the rate limit of their
+    resource. Requests that were rejected with 429 (too many requests) are held until the window
+    resets and then sent again, so callers (including TwitterPager) never see a 429 response.
+
+    Any other attribute is delegated to the wrapped TwitterAPI object.
+    """
+
+    def __init__(self, api, limiter, latency=None):
+        """
+        :param api: TwitterAPI object
+        :param limiter: RateLimiter for the credentials of the given api
+        :param latency: metrics.Histogram with the label 'resource', which observes the time of
+                        every request (without waiting for the rate limit). optional
+        """
+        self.api = api
+        self.limiter = limiter
+        self.latency = latency
+        self.logger = logging.getLogger()
+
+    def _observe(self, resource, start):
+        if self.latency is not None:
+            self.latency.observe(time.time() - start, resource)
+
+    def request(self, resource, params=None, *args, **kwargs):
+        bucket = self.limiter.bucket(resource)
+        while True:
+            bucket.acquire()
+            start = time.time()
+            r = self.api.request(resource, params, *args, **kwargs)
+            self._observe(resource, start)
+            bucket.update(r.headers)
+            if r.status_code != HTTP_TOO_MANY_REQUESTS:
+                return r
+            self.logger.warning('{0} request rejected (too many requests)'.format(resource))
+            reset = r.headers.get('x-rate-limit-reset')
+            bucket.exhaust(int(reset) if reset is not None else None)
+
+    async def request_async(self, resource, params=None, executor=None):
+        """
+        same as request(), for use in an asyncio event loop. waiting for the rate limit doesn't
+        block the loop, and the (blocking) request itself is sent in the given executor
+        :param executor: concurrent.futures.Executor. None for the loop's default executor
+        """
+        bucket = self.limiter.bucket(resource)
+        loop = asyncio.get_running_loop()
+        while True:
+            wait = bucket.try_acquire()
+            while wait > 0:
+                deadline = time.time() + wait
+                while time.time() < deadline:
+                    if bucket.interrupted:
+                        raise Interrupted('waiting for {0} rate limit was interrupted'.format(
+                            resource))
+                    await asyncio.sleep(min(deadline - time.time(), INTERRUPT_POLL_SECONDS))
+                wait = bucket.try_acquire()
+            start = time.time()
+            r = await loop.run_in_executor(executor, self.api.request, resource, params)
+            self._observe(resource, start)
+            bucket.update(r.headers)
+            if r.status_code != HTTP_TOO_MANY_REQUESTS:
+                return r
+            self.logger.warning('{0} request rejected (too many requests)'.format(resource))
+            reset = r.headers.get('x-rate-limit-reset')
+            bucket.exhaust(int(reset) if reset is not None else None)
+
+    def __getattr__(self, name):
+        return getattr(self.api, name)
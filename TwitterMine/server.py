@@ -1,11 +1,39 @@
+import json
 import logging
+import os
+import signal
+import time
+from queue import Full
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 
-from TwitterMine.miner import Miner
+from TwitterMine.async_miner import AsyncMiner
+from TwitterMine.job_queue import DEFAULT_CAMPAIGN, DEFAULT_PRIORITY, OVERFLOW_SPILL
+from TwitterMine.metrics import CONTENT_TYPE
+from TwitterMine.miner import Miner, queue_type
+from TwitterMine.storage import FSYNC_NEVER
 
 HTTP_SUCCESS_CODE = 200
 HTTP_ERROR_CODE = 400
+HTTP_NOT_FOUND_CODE = 404
+HTTP_TOO_MANY_REQUESTS_CODE = 429
+RETRY_AFTER_SECONDS = 30  # the Retry-After of responses to jobs that were rejected by a full queue
+# serving modes: waitress (a multi-threaded production WSGI server) or Flask's development server
+PRODUCTION = 'production'
+DEV = 'dev'
+SERVING_MODES = [PRODUCTION, DEV]
+HTTP_THREADS = 8  # requests that are handled concurrently in production mode
+CONNECTION_LIMIT = 100  # open connections (including idle keep-alive ones) in production mode
+# requests to /wait return after this many seconds at most, so they don't hold an HTTP thread (or
+# the shutdown of the server) for long. clients repeat them until the jobs are finished
+MAX_WAIT_SECONDS = 30
+# on shutdown, the requests in progress (including a /wait) are given this many seconds to complete
+SHUTDOWN_TIMEOUT = MAX_WAIT_SECONDS + 10
+SERVE_POLL_SECONDS = 1  # how often the production server checks whether it was asked to stop
+# job types that can be submitted to /mine/batch
+BATCH_JOB_TYPES = ['user_details', 'friends_ids', 'followers_ids', 'tweets', 'likes', 'neighbors']
+# job types with a 'limit' argument
+LIMITED_JOB_TYPES = ['friends_ids', 'followers_ids', 'tweets', 'likes', 'neighbors']
 
 
 class Server:
@@ -15,24 +43,60 @@ class Server:
     A success message returned from the server means that a valid request was received and
     successfully inserted to the queue of requests (and does NOT mean that the request processing
     is finished)
+
+    All mining requests accept the optional arguments 'priority' (integer, default 0. higher
+    priority jobs are handled first) and 'campaign' (string. campaigns with the same priority
+    share the miner equally)
+
+    Many mining jobs can be submitted at once to /mine/batch, as NDJSON: a json dictionary in every
+    line, with the key 'type' (one of BATCH_JOB_TYPES) and the arguments of that job type's
+    endpoint. Every line is validated and produced on its own, and the response has a result for
+    every line.
+
+    When the queues of the miner are bounded (see queue_limits in Miner), a job that doesn't fit in
+    its queue is answered with 429 (Too Many Requests) and a Retry-After header. In a batch, the
+    lines that didn't fit are marked with 'retry' and the whole response is 429, so the client
+    resends only those lines.
+
+    Every accepted mining job has an id, returned as 'job_id' (null if the job was skipped because
+    a recently finished job covers it). Jobs that were merged into a pending or running job get the
+    id of that job, and tweets and neighbors jobs of a user share the id of the user's timeline job.
+    The status of jobs (their state, items, pages, API calls and error) is returned by /jobs, for a
+    list of ids or for a whole campaign, and /wait blocks until a list of jobs or a whole campaign
+    is finished (see Miner.produce_job and job_queue.JobStore)
+
+    /metrics exposes the metrics of the miner (queue depths, finished jobs and items, API latencies,
+    rate limit budgets, writes and stream messages) in the prometheus text format
+
+    SIGTERM (or a request to /shutdown) stops the server gracefully: no new requests are accepted,
+    the requests in progress are completed and then the miner is stopped (see run())
     """
 
-    def __init__(self, consumer_key, consumer_secret, access_token_key, access_token_secret,
-                 data_dir, port):
+    def __init__(self, credentials, data_dir, port, job_freshness=0, engine='threads',
+                 fsync=FSYNC_NEVER, queue_limits=None, overflow=OVERFLOW_SPILL):
         """
-        :param consumer_key:
-        :param consumer_secret:
-        :param access_token_key: may be None (for app authentication)
-        :param access_token_secret: may be None (for app authentication)
+        :param credentials: list of credentials dictionaries for twitter's API (see Miner)
         :param data_dir: directory for storing the extracted information
         :param port: the port to listen for incoming requests
+        :param job_freshness: seconds in which a finished job is not repeated (see Miner)
+        :param engine: the mining engine. 'threads' (Miner) or 'asyncio' (AsyncMiner)
+        :param fsync: when the mined data is synced to the disk (see Miner)
+        :param queue_limits: maximum number of pending jobs of every queue type (see Miner)
+        :param overflow: what to do with a job that doesn't fit in its queue (see Miner)
         """
-        self.miner = Miner(consumer_key, consumer_secret, data_dir, access_token_key,
-                           access_token_secret)
+        if engine == 'asyncio':
+            self.miner = AsyncMiner(credentials, data_dir, job_freshness, fsync=fsync,
+                                    queue_limits=queue_limits, overflow=overflow)
+        elif engine == 'threads':
+            self.miner = Miner(credentials, data_dir, job_freshness, fsync, queue_limits, overflow)
+        else:
+            raise ValueError('Unsupported engine: "{0}"'.format(engine))
         self.port = port
         self.app = Flask(__name__)
         self.dummy_counter = 0
         self.logger = logging.getLogger()
+        self.stopping = False  # set on SIGTERM
+        self.mode = PRODUCTION  # the serving mode (see run)
 
         # define all endpoints in the REST server
         @self.app.route('/', methods=['GET', 'POST'])
@@ -43,20 +107,12 @@ class Server:
                    "increased each time this index page is accessed.\n" \
                    "Current counter value: {}\n".format(self.dummy_counter)
 
-        # todo test this endpoint
         @self.app.route('/shutdown', methods=['GET', 'POST'])
         def shutdown():
             self.logger.info('shutdown request received')
-            self.logger.info('stopping miner...')
-            self.miner.stop()
-            func = request.environ.get('werkzeug.server.shutdown')
-            if func is None:
-                self.logger.error('Server couldn\'t terminate properly' +
-                                  '(not running with the Werkzeug Server). ' +
-                                  'Terminating entire program')
-                exit(1)
-            func()
-            self.logger.info('Server shutting down...')
+            # handled like a termination by the OS. the signal handler runs in the main thread, so
+            # this request is completed before the server stops
+            os.kill(os.getpid(), signal.SIGTERM)
             return self.success_response()
 
         @self.app.route('/mine/user_details', methods=['POST'])
@@ -65,8 +121,7 @@ class Server:
             args = request.get_json()
             if not self.check_screen_name(args):
                 return self.miss_arg_response()
-            self.miner.produce_job('user_details', args)
-            return self.success_response()
+            return self.produce_job('user_details', args)
 
         @self.app.route('/mine/friends_ids', methods=['POST'])
         def mine_friends_ids():
@@ -74,11 +129,7 @@ class Server:
             args = request.get_json()
             if not self.check_screen_name(args):
                 return self.miss_arg_response()
-            if 'limit' not in args:
-                # limit was not specified. use default
-                args['limit'] = 0
-            self.miner.produce_job('friends_ids', args)
-            return self.success_response()
+            return self.produce_job('friends_ids', args)
 
         @self.app.route('/mine/followers_ids', methods=['POST'])
         def mine_followers_ids():
@@ -86,11 +137,7 @@ class Server:
             args = request.get_json()
             if not self.check_screen_name(args):
                 return self.miss_arg_response()
-            if 'limit' not in args:
-                # limit was not specified. use default
-                args['limit'] = 0
-            self.miner.produce_job('followers_ids', args)
-            return self.success_response()
+            return self.produce_job('followers_ids', args)
 
         @self.app.route('/mine/tweets', methods=['POST'])
         def mine_tweets():
@@ -98,11 +145,7 @@ class Server:
             args = request.get_json()
             if not self.check_screen_name(args):
                 return self.miss_arg_response()
-            if 'limit' not in args:
-                # limit was not specified. use default
-                args['limit'] = 0
-            self.miner.produce_job('tweets', args)
-            return self.success_response()
+            return self.produce_job('tweets', args)
 
         @self.app.route('/mine/likes', methods=['POST'])
         def mine_likes():
@@ -110,11 +153,7 @@ class Server:
             args = request.get_json()
             if not self.check_screen_name(args):
                 return self.miss_arg_response()
-            if 'limit' not in args:
-                # limit was not specified. use default
-                args['limit'] = 0
-            self.miner.produce_job('likes', args)
-            return self.success_response()
+            return self.produce_job('likes', args)
 
         @self.app.route('/mine/neighbors', methods=['POST'])
         def mine_neighbors():
@@ -122,11 +161,76 @@ class Server:
             args = request.get_json()
             if not self.check_screen_name(args):
                 return self.miss_arg_response()
-            if 'limit' not in args:
-                # limit was not specified. use default
-                args['limit'] = 0
-            self.miner.produce_job('neighbors', args)
-            return self.success_response()
+            return self.produce_job('neighbors', args)
+
+        @self.app.route('/mine/batch', methods=['POST'])
+        def mine_batch():
+            self.logger.info('batch request received')
+            results = [self.produce_batch_job(number, line) for number, line in
+                       enumerate(request.get_data(as_text=True).splitlines(), start=1)
+                       if line.strip()]
+            accepted = sum(1 for result in results if result['success'])
+            retry = any(result.get('retry') for result in results)
+            self.logger.info('batch request: {0} jobs accepted, {1} rejected'.format(
+                accepted, len(results) - accepted))
+            r = jsonify({'accepted': accepted, 'rejected': len(results) - accepted,
+                         'results': results})
+            if retry:
+                r.status_code = HTTP_TOO_MANY_REQUESTS_CODE
+                r.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+            else:
+                r.status_code = HTTP_SUCCESS_CODE
+            return r
+
+        @self.app.route('/jobs/<int:job_id>', methods=['GET'])
+        def job(job_id):
+            statuses = self.miner.jobs_store.job_status([job_id])
+            if not statuses:
+                r = jsonify({'error': {'message': 'unknown job: {0}'.format(job_id)}})
+                r.status_code = HTTP_NOT_FOUND_CODE
+                return r
+            r = jsonify(statuses[0])
+            r.status_code = HTTP_SUCCESS_CODE
+            return r
+
+        @self.app.route('/jobs', methods=['GET'])
+        def jobs():
+            try:
+                job_ids, campaign = self.jobs_query_args(request.args.to_dict())
+            except ValueError as e:
+                return self.invalid_arg_response(str(e))
+            r = jsonify(self.jobs_status(job_ids, campaign))
+            r.status_code = HTTP_SUCCESS_CODE
+            return r
+
+        @self.app.route('/wait', methods=['GET', 'POST'])
+        def wait():
+            if request.method == 'POST':
+                args = request.get_json(silent=True)
+            else:
+                args = request.args.to_dict()
+            if not isinstance(args, dict):
+                return self.invalid_arg_response('arguments must be a json dictionary')
+            try:
+                job_ids, campaign = self.jobs_query_args(args)
+            except ValueError as e:
+                return self.invalid_arg_response(str(e))
+            try:
+                timeout = float(args.get('timeout', MAX_WAIT_SECONDS))
+            except (TypeError, ValueError):
+                return self.invalid_arg_response('timeout must be a number')
+            finished = self.miner.jobs_store.wait(job_ids, campaign,
+                                                  min(max(timeout, 0), MAX_WAIT_SECONDS))
+            status = self.jobs_status(job_ids, campaign)
+            status['finished'] = finished
+            r = jsonify(status)
+            r.status_code = HTTP_SUCCESS_CODE
+            return r
+
+        @self.app.route('/metrics', methods=['GET'])
+        def metrics():
+            return Response(self.miner.metrics.exposition(), status=HTTP_SUCCESS_CODE,
+                            content_type=CONTENT_TYPE)
 
         @self.app.route('/listen', methods=['POST'])
         def listen():
@@ -137,11 +241,120 @@ class Server:
             self.miner.produce_job('listen', args)
             return self.success_response()
 
+    def produce_job(self, job_type, args):
+        """
+        produce a mining job from the request args. the optional keys 'priority' (integer) and
+        'campaign' (string) are removed from args and used for scheduling the job, and the limit
+        of job types in LIMITED_JOB_TYPES is checked (see check_limit)
+        :return: the response to the request
+        """
+        try:
+            if job_type in LIMITED_JOB_TYPES:
+                self.check_limit(args)
+            priority, campaign = self.scheduling_args(args)
+        except ValueError as e:
+            return self.invalid_arg_response(str(e))
+        try:
+            job_id = self.miner.produce_job(job_type, args, priority, campaign)
+        except Full:
+            return self.queue_full_response(job_type)
+        return self.job_response(job_id)
+
+    def produce_batch_job(self, number, line):
+        """
+        produce a mining job from a line of a batch request
+        :param number: the number of the line in the request
+        :param line: json dictionary with the key 'type' and the arguments of the job
+        :return: the result of the line: a dictionary with the keys 'line' and 'success', and
+                 'job_id' if the job was accepted or 'error' if it was rejected ('retry' too if its
+                 queue was full)
+        """
+        try:
+            args = json.loads(line)
+            if not isinstance(args, dict):
+                raise ValueError('a job must be a json dictionary')
+            job_type = args.pop('type', None)
+            if job_type not in BATCH_JOB_TYPES:
+                raise ValueError('unsupported job type: "{0}"'.format(job_type))
+            if not self.check_screen_name(args):
+                raise ValueError('required argument is missing')
+            if job_type in LIMITED_JOB_TYPES:
+                self.check_limit(args)
+            priority, campaign = self.scheduling_args(args)
+        except ValueError as e:
+            return {'line': number, 'success': False, 'error': {'message': str(e)}}
+        try:
+            job_id = self.miner.produce_job(job_type, args, priority, campaign)
+        except Full:
+            return {'line': number, 'success': False, 'retry': True,
+                    'error': {'message': 'the {0} queue is full'.format(queue_type(job_type))}}
+        return {'line': number, 'success': True, 'job_id': job_id}
+
+    def scheduling_args(self, args):
+        """
+        remove the optional scheduling arguments 'priority' and 'campaign' from the request args
+        :return: tuple (priority, campaign)
+        :raise ValueError: if the scheduling arguments are invalid
+        """
+        priority = args.pop('priority', DEFAULT_PRIORITY)
+        campaign = args.pop('campaign', DEFAULT_CAMPAIGN)
+        if not isinstance(priority, int) or isinstance(priority, bool):
+            raise ValueError('priority must be an integer')
+        if not isinstance(campaign, str) or not campaign:
+            raise ValueError('campaign must be a non empty string')
+        return priority, campaign
+
+    def check_limit(self, args):
+        """
+        set the default limit of a job (0, no limit) if args has none
+        :raise ValueError: if the limit is not a non negative integer
+        """
+        limit = args.setdefault('limit', 0)
+        if not isinstance(limit, int) or isinstance(limit, bool) or limit < 0:
+            raise ValueError('limit must be a non negative integer')
+
+    def jobs_query_args(self, args):
+        """
+        read the jobs of a status query or a wait request: 'jobs' (a list of job ids, or a string
+        of comma separated ids) and/or 'campaign'
+        :return: tuple (job_ids, campaign). job_ids is a list (empty if not given), campaign is
+                 None if not given
+        :raise ValueError: if the arguments are invalid or neither was given
+        """
+        job_ids = args.get('jobs', [])
+        campaign = args.get('campaign')
+        if isinstance(job_ids, str):
+            job_ids = [int(job_id) if job_id.isdigit() else job_id
+                       for job_id in job_ids.split(',') if job_id]
+        if not isinstance(job_ids, list) or \
+                not all(isinstance(job_id, int) and not isinstance(job_id, bool)
+                        for job_id in job_ids):
+            raise ValueError('jobs must be a list of job ids')
+        if campaign is not None and (not isinstance(campaign, str) or not campaign):
+            raise ValueError('campaign must be a non empty string')
+        if not job_ids and campaign is None:
+            raise ValueError('jobs or campaign must be given')
+        return job_ids, campaign
+
+    def jobs_status(self, job_ids, campaign):
+        """
+        :return: dictionary with the status of the given jobs under 'jobs' (if given), and the
+                 status of the given campaign under 'campaign' (if given)
+        """
+        status = dict()
+        if job_ids:
+            status['jobs'] = self.miner.jobs_store.job_status(job_ids)
+        if campaign is not None:
+            status['campaign'] = dict(self.miner.jobs_store.campaign_status(campaign),
+                                      name=campaign)
+        return status
+
     def check_screen_name(self, args):
         """
-        :return: True iff args is a dictionary with key 'screen_name'
+        :return: True iff args is a dictionary with a non empty string under 'screen_name'
         """
-        return args is not None and 'screen_name' in args
+        return isinstance(args, dict) and isinstance(args.get('screen_name'), str) and \
+            args['screen_name'] != ''
 
     def success_response(self):
         """
@@ -151,6 +364,14 @@ class Server:
         r.status_code = HTTP_SUCCESS_CODE
         return r
 
+    def job_response(self, job_id):
+        """
+        returns a success response to a mining request, with the id of the job that handles it
+        """
+        r = jsonify({'success': True, 'job_id': job_id})
+        r.status_code = HTTP_SUCCESS_CODE
+        return r
+
     def miss_arg_response(self):
         """
         returns a missing argument response
@@ -159,6 +380,103 @@ class Server:
         r.status_code = HTTP_ERROR_CODE
         return r
 
-    def run(self, debug=False):
+    def invalid_arg_response(self, message):
+        """
+        returns an invalid argument response
+        """
+        r = jsonify({'error': {'message': message}})
+        r.status_code = HTTP_ERROR_CODE
+        return r
+
+    def queue_full_response(self, job_type):
+        """
+        returns a response to a job that was rejected because its queue is full
+        """
+        r = jsonify({'error': {'message': 'the {0} queue is full'.format(queue_type(job_type))}})
+        r.status_code = HTTP_TOO_MANY_REQUESTS_CODE
+        r.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+        return r
+
+    def _terminate(self, signum, frame):
+        """
+        SIGTERM handler. the production server stops serving when stopping is set (see _serve),
+        Flask's development server stops on SystemExit
+        """
+        self.logger.info('received signal {0}. server shutting down...'.format(signum))
+        # a repeated signal must not interrupt stopping the miner
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        self.stopping = True
+        if self.mode != PRODUCTION:
+            raise SystemExit(0)
+
+    def _serve(self, http_server):
+        """
+        serve requests with a waitress server until stopping is set. then close the listening socket
+        and keep serving the open connections until the requests in progress are completed and their
+        responses are sent (at most SHUTDOWN_TIMEOUT seconds).
+        waitress's own run() cancels the pending requests and gives the running ones 5 seconds
+        """
+        from waitress import wasyncore
+
+        def loop():
+            wasyncore.loop(timeout=SERVE_POLL_SECONDS, map=http_server._map,
+                           use_poll=http_server.adj.asyncore_use_poll, count=1)
+
+        while not self.stopping:
+            loop()
+        # only the listening socket. the server's trigger wakes the loop when a response is ready
+        http_server.accepting = False
+        wasyncore.dispatcher.close(http_server)
+        deadline = time.time() + SHUTDOWN_TIMEOUT
+        while time.time() < deadline and self._busy(http_server):
+            loop()
+        http_server.task_dispatcher.shutdown(cancel_pending=False, timeout=SHUTDOWN_TIMEOUT)
+        wasyncore.close_all(http_server._map)
+
+    @staticmethod
+    def _busy(http_server):
+        """
+        :return: whether a connection of the waitress server has a request in progress or output
+                 that was not sent yet
+        """
+        return any(channel.requests or channel.total_outbufs_len
+                   for channel in list(http_server.active_channels.values()))
+
+    def run(self, debug=False, mode=PRODUCTION, threads=HTTP_THREADS,
+            connection_limit=CONNECTION_LIMIT, drain=False, interrupt=False):
+        """
+        run the miner and serve requests until SIGTERM (or a request to /shutdown) is received.
+        then stop accepting requests, complete the requests in progress and stop the miner.
+        must be called from the main thread (for the signal handler)
+        :param debug: Flask's debug mode (dev mode only)
+        :param mode: one of the constants in SERVING_MODES. production mode requires waitress
+        :param threads: number of requests that are handled concurrently (production mode only)
+        :param connection_limit: maximum number of open connections. clients that connect beyond
+                                 it wait until a connection is closed (production mode only)
+        :param drain: whether the miner finishes all its pending jobs before it stops. by
+                      default only the running jobs are finished, and pending jobs are kept in the
+                      job store for the next run (see Miner.stop)
+        :param interrupt: whether running jobs are checkpointed instead of finished (when drain
+                          is False)
+        """
+        if mode not in SERVING_MODES:
+            raise ValueError('Unsupported serving mode: "{0}"'.format(mode))
+        self.mode = mode
         self.miner.run()
-        self.app.run(host='0.0.0.0', debug=debug, port=self.port, threaded=True)
+        signal.signal(signal.SIGTERM, self._terminate)
+        try:
+            if mode == PRODUCTION:
+                from waitress import create_server
+
+                # connections are kept alive between requests (HTTP/1.1)
+                http_server = create_server(self.app, host='0.0.0.0', port=self.port,
+                                            threads=threads, connection_limit=connection_limit)
+                self._serve(http_server)
+            else:
+                self.app.run(host='0.0.0.0', debug=debug, port=self.port, threaded=True)
+        except (SystemExit, KeyboardInterrupt):
+            pass
+        finally:
+            self.logger.info('stopping miner...')
+            self.miner.stop(drain=drain, interrupt=interrupt)
+            self.logger.info('server stopped')
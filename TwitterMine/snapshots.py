@@ -0,0 +1,202 @@
+import json
+import os
+import re
+import time
+from array import array
+
+NEWLINE = '\n'
+DELTA_NAME_FORMAT = '{0:06d}.delta'
+DELTA_NAME_REGEX = re.compile(r'(\d+)\.delta')
+BASE_NAME_FORMAT = '{0:06d}.base'
+BASE_NAME_REGEX = re.compile(r'(\d+)\.base')
+IDS_TYPECODE = 'Q'  # unsigned 64 bit, the size of a twitter id
+
+
+def encode_ids(ids):
+    """
+    encode a sorted list of distinct non negative ids compactly: every id is stored as the gap from
+    the previous one, in a variable length encoding (7 bits in every byte, the high bit marks that
+    more bytes follow)
+    :param ids: sorted iterable of ints
+    :return: bytes
+    """
+    data = bytearray()
+    prev = 0
+    for id in ids:
+        gap = id - prev
+        prev = id
+        while gap >= 0x80:
+            data.append(gap & 0x7f | 0x80)
+            gap >>= 7
+        data.append(gap)
+    return bytes(data)
+
+
+def decode_ids(data):
+    """
+    :param data: bytes returned by encode_ids
+    :return: the sorted list of ids
+    """
+    ids = []
+    prev = 0
+    gap = 0
+    shift = 0
+    for b in data:
+        gap |= (b & 0x7f) << shift
+        if b & 0x80:
+            shift += 7
+        else:
+            prev += gap
+            ids.append(prev)
+            gap = 0
+            shift = 0
+    return ids
+
+
+def _diff_sorted(old, new):
+    """
+    :param old: sorted sequence of distinct ids
+    :param new: sorted sequence of distinct ids
+    :return: tuple (added, removed) of sorted lists: ids that are only in new, and ids that are
+             only in old
+    """
+    added = []
+    removed = []
+    i = j = 0
+    while i < len(old) and j < len(new):
+        if old[i] == new[j]:
+            i += 1
+            j += 1
+        elif old[i] < new[j]:
+            removed.append(old[i])
+            i += 1
+        else:
+            added.append(new[j])
+            j += 1
+    removed.extend(old[i:])
+    added.extend(new[j:])
+    return added, removed
+
+
+class SnapshotStore:
+    """
+    Versioned snapshots of a list of ids (e.g. the followers of a user), kept in a single directory.
+
+    Snapshots are numbered from 0. Every snapshot is stored as a delta file (NNNNNN.delta) with the
+    ids that were added and removed since the previous snapshot, so a list that changes slowly takes
+    little space no matter how many snapshots are taken. The first line of a delta file is a json
+    header with the keys 'snapshot', 'time', 'count' (the size of the list), 'added', 'removed' and
+    'added_bytes', followed by the encoded added ids and then the encoded removed ids (see
+    encode_ids).
+
+    The full list of the latest snapshot is kept too (NNNNNN.base, sorted ids in binary), to compute
+    the delta of the next snapshot. A delta without a matching base was not completely written
+    (e.g. the process crashed), and is discarded.
+
+    The store is not thread safe. A single job should write the snapshots of a list at a time.
+    """
+
+    def __init__(self, snapshots_dir):
+        """
+        :param snapshots_dir: the directory of the snapshots. created if not exist
+        """
+        self.snapshots_dir = snapshots_dir
+        if not os.path.isdir(snapshots_dir):
+            os.makedirs(snapshots_dir)
+
+    def _numbers(self, regex):
+        return sorted(int(m.group(1)) for m in map(regex.fullmatch, os.listdir(self.snapshots_dir))
+                      if m)
+
+    def _path(self, name_format, number):
+        return os.path.join(self.snapshots_dir, name_format.format(number))
+
+    def latest(self):
+        """
+        :return: the number of the latest snapshot, or -1 if there are no snapshots
+        """
+        return max(self._numbers(BASE_NAME_REGEX), default=-1)
+
+    def _read_delta(self, number, header_only=False):
+        """
+        :return: tuple (header, added, removed). added and removed are None if header_only
+        """
+        with open(self._path(DELTA_NAME_FORMAT, number), mode='rb') as f:
+            header = json.loads(f.readline().decode('utf-8'))
+            if header_only:
+                return header, None, None
+            data = f.read()
+        added_bytes = header['added_bytes']
+        return header, decode_ids(data[:added_bytes]), decode_ids(data[added_bytes:])
+
+    def read_latest(self):
+        """
+        :return: array of the sorted ids in the latest snapshot (empty if there are no snapshots)
+        """
+        ids = array(IDS_TYPECODE)
+        latest = self.latest()
+        if latest >= 0:
+            with open(self._path(BASE_NAME_FORMAT, latest), mode='rb') as f:
+                ids.frombytes(f.read())
+        return ids
+
+    def add_snapshot(self, ids):
+        """
+        store a new snapshot of the list
+        :param ids: iterable of ids (may be unsorted and contain duplicates)
+        :return: the number of the new snapshot
+        """
+        latest = self.latest()
+        number = latest + 1
+        new = array(IDS_TYPECODE, sorted(set(ids)))
+        added, removed = _diff_sorted(self.read_latest(), new)
+        encoded_added = encode_ids(added)
+        header = {'snapshot': number, 'time': time.time(), 'count': len(new),
+                  'added': len(added), 'removed': len(removed), 'added_bytes': len(encoded_added)}
+        # the delta is written first. the snapshot exists only after its base is written
+        delta_file = self._path(DELTA_NAME_FORMAT, number)
+        with open(delta_file + '.tmp', mode='wb') as f:
+            f.write(json.dumps(header).encode('utf-8'))
+            f.write(NEWLINE.encode('utf-8'))
+            f.write(encoded_added)
+            f.write(encode_ids(removed))
+        os.replace(delta_file + '.tmp', delta_file)
+        base_file = self._path(BASE_NAME_FORMAT, number)
+        with open(base_file + '.tmp', mode='wb') as f:
+            new.tofile(f)
+        os.replace(base_file + '.tmp', base_file)
+        for old in self._numbers(BASE_NAME_REGEX):
+            if old < number:
+                os.remove(self._path(BASE_NAME_FORMAT, old))
+        return number
+
+    def snapshots(self):
+        """
+        :return: list of the headers of all snapshots (see class doc), ordered by snapshot number
+        """
+        latest = self.latest()
+        return [self._read_delta(number, header_only=True)[0]
+                for number in self._numbers(DELTA_NAME_REGEX) if number <= latest]
+
+    def changes_since(self, number):
+        """
+        the ids that were added and removed between the given snapshot and the latest one. only
+        the deltas are read, so the cost depends on the changes rather than on the size of the list
+        :param number: snapshot number. -1 to get all ids of the latest snapshot as added
+        :return: tuple (added, removed) of sets of ids
+        """
+        added = set()
+        removed = set()
+        for n in range(number + 1, self.latest() + 1):
+            header, delta_added, delta_removed = self._read_delta(n)
+            for id in delta_added:
+                if id in removed:
+                    removed.remove(id)
+                else:
+                    added.add(id)
+            for id in delta_removed:
+                if id in added:
+                    added.remove(id)
+                else:
+                    removed.add(id)
+        return added, removed
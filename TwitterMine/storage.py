@@ -0,0 +1,741 @@
+import argparse
+import gzip
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict, deque
+from queue import Empty, Queue
+from threading import Condition, Lock, Thread
+
+from TwitterMine import ids_file, neighbors_file
+from TwitterMine.layout import DataLayout, FORMATS
+
+NEWLINE = '\n'
+FILES = 'files'
+SQLITE = 'sqlite'
+STORAGES = [FILES, SQLITE]
+# the database of the sqlite storage inside the data dir. prefix '#' is necessary so this file will
+# not be in conflict with a legal twitter screen name
+DB_NAME = '#data.db'
+TMP_SUFFIX = '.tmp'
+GZIP = 'gzip'
+COMPRESSIONS = [GZIP]
+GZIP_SUFFIX = '.gz'
+# records that are compressed when the data dir has compression. these are the large records of
+# tweets, which compress well
+COMPRESSED_RECORDS = {'tweets', 'likes'}
+# records that may be kept in a binary file in the user directory instead of the storage, and the
+# suffix of the binary file (see DataWriter.read_ids and DataWriter.read_neighbors)
+BINARY_RECORDS = {'followers': ids_file.FILE_SUFFIX,
+                  'friends': ids_file.FILE_SUFFIX,
+                  'neighbors': neighbors_file.FILE_SUFFIX}
+# fsync policies of GroupCommitStorage: leave it to the OS, fsync once a second, or fsync after
+# every batch
+FSYNC_NEVER = 'never'
+FSYNC_INTERVAL = 'interval'
+FSYNC_BATCH = 'batch'
+FSYNC_POLICIES = [FSYNC_NEVER, FSYNC_INTERVAL, FSYNC_BATCH]
+FSYNC_INTERVAL_SECONDS = 1
+MAX_BATCH_SIZE = 1000  # operations that are written together by GroupCommitStorage
+MAX_OPEN_FILES = 256  # open files that are kept by FileStorage for appending
+
+
+def compress(text):
+    """
+    compress text to a single gzip frame. frames can be concatenated (e.g. appended to a file) and
+    the result is still a valid gzip stream
+    :return: bytes
+    """
+    return gzip.compress(text.encode('utf-8'))
+
+
+def decompress(data):
+    """
+    :param data: bytes of one or more gzip frames
+    :return: the text
+    """
+    return gzip.decompress(data).decode('utf-8')
+
+
+class FileStorage:
+    """
+    Stores every record of a user (e.g. 'tweets', 'followers', 'user_details') as a file in the
+    user's directory (see DataLayout).
+
+    With compression, records of tweets (see COMPRESSED_RECORDS) are kept in a '.gz' file, and every
+    append adds an independent gzip frame to it. A record that was written before compression was
+    turned on keeps its uncompressed file, and is read together with the compressed one.
+
+    Files that are appended to may be kept open for the next appends (least recently used files are
+    closed first). Appended data of open files is only visible to readers after flush().
+
+    A storage keeps named text records for every user. All storages have the same interface:
+    append(), append_batch(), write(), read(), read_lines(), exists(), size(), delete(), names(),
+    users(), flush() and close().
+    """
+
+    def __init__(self, layout, max_open_files=0):
+        """
+        :param layout: DataLayout of the data dir
+        :param max_open_files: number of files to keep open for appending. 0 to close every file
+                               after writing to it
+        """
+        self.layout = layout
+        self.compression = layout.compression
+        self.max_open_files = max_open_files
+        self.handles = OrderedDict()  # path -> file open for appending, least recently used first
+        self.handles_lock = Lock()
+        self.init_dir_lock = Lock()
+
+    def _compressed(self, name):
+        return self.compression == GZIP and name in COMPRESSED_RECORDS
+
+    def _path(self, screen_name, name):
+        return os.path.join(self.layout.user_dir(screen_name), name)
+
+    def _init_path(self, screen_name, name):
+        """
+        :return: the path of the record. the user directory is created if not exist
+        """
+        user_dir = self.layout.user_dir(screen_name)
+        with self.init_dir_lock:  # two threads may try to write different data to the same user
+            if not os.path.isdir(user_dir):
+                os.makedirs(user_dir)
+        return os.path.join(user_dir, name)
+
+    def append(self, screen_name, name, text):
+        """
+        append text to a record of the user. the record is created if not exist
+        """
+        path = self._path(screen_name, name)
+        if self._compressed(name):
+            path, data = path + GZIP_SUFFIX, compress(text)
+        else:
+            data = text.encode('utf-8')
+        with self.handles_lock:
+            f = self.handles.pop(path, None)
+            if f is None:
+                self._init_path(screen_name, name)
+                f = open(path, mode='ab')
+            try:
+                f.write(data)
+            finally:
+                self._release(path, f)
+
+    def _release(self, path, f):
+        """
+        keep a file that was appended to open, or close it. must be called while holding the
+        handles lock
+        """
+        if self.max_open_files <= 0:
+            f.close()
+            return
+        self.handles[path] = f
+        while len(self.handles) > self.max_open_files:
+            self.handles.popitem(last=False)[1].close()
+
+    def _close_handles(self, path):
+        """
+        close the open files of a record (compressed or not), before it is replaced or deleted
+        """
+        with self.handles_lock:
+            for p in [path, path + GZIP_SUFFIX]:
+                f = self.handles.pop(p, None)
+                if f is not None:
+                    f.close()
+
+    def append_batch(self, appends):
+        """
+        append texts to records. texts of the same record are joined to a single write (and a
+        single gzip frame, with compression)
+        :param appends: list of tuples (screen_name, name, text), in the order of appending
+        """
+        records = OrderedDict()
+        for screen_name, name, text in appends:
+            records.setdefault((screen_name, name), []).append(text)
+        for (screen_name, name), texts in records.items():
+            self.append(screen_name, name, ''.join(texts))
+
+    def write(self, screen_name, name, text):
+        """
+        replace a record of the user with the given text. the replacement is atomic
+        """
+        path = self._init_path(screen_name, name)
+        self._close_handles(path)
+        if self._compressed(name):
+            path, other_path = path + GZIP_SUFFIX, path
+            with open(path + TMP_SUFFIX, mode='wb') as f:
+                f.write(compress(text))
+        else:
+            other_path = path + GZIP_SUFFIX
+            with open(path + TMP_SUFFIX, mode='w', encoding='utf-8') as f:
+                f.write(text)
+        os.replace(path + TMP_SUFFIX, path)
+        if os.path.isfile(other_path):
+            os.remove(other_path)
+
+    def read(self, screen_name, name):
+        """
+        :return: the text of a record of the user, or None if not exist
+        """
+        if not self.exists(screen_name, name):
+            return None
+        path = self._path(screen_name, name)
+        text = ''
+        if os.path.isfile(path):
+            with open(path, encoding='utf-8') as f:
+                text = f.read()
+        if os.path.isfile(path + GZIP_SUFFIX):
+            with gzip.open(path + GZIP_SUFFIX, mode='rt', encoding='utf-8') as f:
+                text += f.read()
+        return text
+
+    def read_lines(self, screen_name, name):
+        """
+        :return: generator of the lines of a record of the user (without the newline). nothing if
+                 the record doesn't exist. compressed records are decompressed while reading
+        """
+        path = self._path(screen_name, name)
+        # the uncompressed file is older than the compressed one, if both exist
+        if os.path.isfile(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    yield line.rstrip(NEWLINE)
+        if os.path.isfile(path + GZIP_SUFFIX):
+            with gzip.open(path + GZIP_SUFFIX, mode='rt', encoding='utf-8') as f:
+                for line in f:
+                    yield line.rstrip(NEWLINE)
+
+    def exists(self, screen_name, name):
+        path = self._path(screen_name, name)
+        return os.path.isfile(path) or os.path.isfile(path + GZIP_SUFFIX)
+
+    def size(self, screen_name, name):
+        """
+        :return: bytes the record takes in the storage (compressed, for compressed records), without
+                 reading it. 0 if the record doesn't exist
+        """
+        path = self._path(screen_name, name)
+        return sum(os.path.getsize(p) for p in [path, path + GZIP_SUFFIX] if os.path.isfile(p))
+
+    def delete(self, screen_name, name):
+        path = self._path(screen_name, name)
+        self._close_handles(path)
+        for p in [path, path + GZIP_SUFFIX]:
+            if os.path.isfile(p):
+                os.remove(p)
+
+    def names(self, screen_name):
+        """
+        :return: list of the names of all records of the user
+        """
+        user_dir = self.layout.user_dir(screen_name)
+        if not os.path.isdir(user_dir):
+            return []
+        names = set()
+        for entry in os.scandir(user_dir):
+            # binary files are not records (see BINARY_RECORDS)
+            if entry.is_file() and not entry.name.endswith(
+                    (TMP_SUFFIX,) + tuple(BINARY_RECORDS.values())):
+                name = entry.name
+                if name.endswith(GZIP_SUFFIX):
+                    name = name[:-len(GZIP_SUFFIX)]
+                names.add(name)
+        return list(names)
+
+    def users(self):
+        """
+        :return: generator of the screen names of all users in the storage
+        """
+        for screen_name, user_dir in self.layout.users():
+            yield screen_name
+
+    def flush(self, fsync=False):
+        """
+        write the appended data of all open files to the OS
+        :param fsync: whether to also wait for the data to reach the disk
+        """
+        with self.handles_lock:
+            for f in self.handles.values():
+                f.flush()
+                if fsync:
+                    os.fsync(f.fileno())
+
+    def close(self):
+        with self.handles_lock:
+            for f in self.handles.values():
+                f.close()
+            self.handles.clear()
+
+
+class SQLiteStorage:
+    """
+    Stores the records of all users in a single SQLite file, instead of a file for every record.
+    Every append to a record is kept as a single row, so appending never rewrites the record. With
+    compression, rows of tweets records (see COMPRESSED_RECORDS) are stored as gzip frames.
+
+    The storage is thread safe. See FileStorage for the interface
+    """
+
+    def __init__(self, db_file, compression=None):
+        """
+        :param db_file: path to the SQLite file. created if not exist
+        :param compression: one of the constants in COMPRESSIONS, or None
+        """
+        self.db_file = db_file
+        self.compression = compression
+        self.lock = Lock()  # guards the connection
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS records ('
+                          'screen_name TEXT NOT NULL, '
+                          'name TEXT NOT NULL, '
+                          'data TEXT NOT NULL)')
+        # rows of a record are read in the order they were appended (rowid is part of the index)
+        self.conn.execute('CREATE INDEX IF NOT EXISTS records_by_user '
+                          'ON records (screen_name, name)')
+        self.conn.commit()
+
+    def _encode(self, name, text):
+        if self.compression == GZIP and name in COMPRESSED_RECORDS:
+            return compress(text)
+        return text
+
+    def append(self, screen_name, name, text):
+        with self.lock:
+            self.conn.execute('INSERT INTO records (screen_name, name, data) VALUES (?, ?, ?)',
+                              (screen_name, name, self._encode(name, text)))
+            self.conn.commit()
+
+    def append_batch(self, appends):
+        """
+        append texts to records in a single transaction. texts of the same record are joined to a
+        single row
+        :param appends: list of tuples (screen_name, name, text), in the order of appending
+        """
+        records = OrderedDict()
+        for screen_name, name, text in appends:
+            records.setdefault((screen_name, name), []).append(text)
+        with self.lock:
+            self.conn.executemany('INSERT INTO records (screen_name, name, data) VALUES (?, ?, ?)',
+                                  [(screen_name, name, self._encode(name, ''.join(texts)))
+                                   for (screen_name, name), texts in records.items()])
+            self.conn.commit()
+
+    def write(self, screen_name, name, text):
+        with self.lock:
+            self.conn.execute('DELETE FROM records WHERE screen_name=? AND name=?',
+                              (screen_name, name))
+            self.conn.execute('INSERT INTO records (screen_name, name, data) VALUES (?, ?, ?)',
+                              (screen_name, name, self._encode(name, text)))
+            self.conn.commit()
+
+    def _chunks(self, screen_name, name):
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT data FROM records WHERE screen_name=? AND name=? ORDER BY rowid',
+                (screen_name, name)).fetchall()
+        # compressed rows are bytes
+        return [decompress(row[0]) if isinstance(row[0], bytes) else row[0] for row in rows]
+
+    def read(self, screen_name, name):
+        chunks = self._chunks(screen_name, name)
+        return ''.join(chunks) if chunks else None
+
+    def read_lines(self, screen_name, name):
+        rest = ''
+        for chunk in self._chunks(screen_name, name):
+            lines = (rest + chunk).split(NEWLINE)
+            rest = lines.pop()
+            yield from lines
+        if rest:
+            yield rest
+
+    def exists(self, screen_name, name):
+        with self.lock:
+            return self.conn.execute('SELECT 1 FROM records WHERE screen_name=? AND name=? LIMIT 1',
+                                     (screen_name, name)).fetchone() is not None
+
+    def size(self, screen_name, name):
+        with self.lock:
+            return self.conn.execute(
+                'SELECT COALESCE(SUM(LENGTH(CAST(data AS BLOB))), 0) FROM records '
+                'WHERE screen_name=? AND name=?', (screen_name, name)).fetchone()[0]
+
+    def delete(self, screen_name, name):
+        with self.lock:
+            self.conn.execute('DELETE FROM records WHERE screen_name=? AND name=?',
+                              (screen_name, name))
+            self.conn.commit()
+
+    def names(self, screen_name):
+        with self.lock:
+            return [row[0] for row in self.conn.execute(
+                'SELECT DISTINCT name FROM records WHERE screen_name=?', (screen_name,))]
+
+    def users(self):
+        with self.lock:
+            screen_names = [row[0] for row in self.conn.execute(
+                'SELECT DISTINCT screen_name FROM records')]
+        yield from screen_names
+
+    def flush(self, fsync=False):
+        # every change is committed when it's made. with fsync, the WAL is copied to the database
+        if fsync:
+            with self.lock:
+                self.conn.execute('PRAGMA wal_checkpoint(FULL)')
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class GroupCommitStorage:
+    """
+    Wraps a storage so all changes (append, write and delete) are made by a single writer thread.
+    Changes are queued and return immediately. The writer thread takes all queued changes (up to
+    MAX_BATCH_SIZE) and writes them together: appends to the same record are joined, the storage
+    keeps files open between batches, and the batch is flushed once (with fsync, according to the
+    fsync policy). Writes and deletes are made in their order relative to the appends.
+
+    Readers always see their own writes. A record with a queued write or delete is read from the
+    queued changes, without waiting for the writer thread; a record with only queued appends is read
+    after they are written. A change that failed to be written is raised (as RuntimeError) from the
+    next use of its record, or from the next flush(). close() writes all queued changes and stops
+    the writer thread.
+
+    The storage is thread safe. See FileStorage for the interface
+    """
+
+    _STOP = object()
+
+    def __init__(self, storage, fsync=FSYNC_NEVER):
+        """
+        :param storage: the storage to write to (only the writer thread changes it)
+        :param fsync: one of the constants in FSYNC_POLICIES
+        """
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError('Unsupported fsync policy: "{0}"'.format(fsync))
+        self.storage = storage
+        self.fsync = fsync
+        self.last_fsync = time.time()
+        self.queue = Queue()
+        self.pending = {}  # (screen_name, name) -> deque of the queued changes (op, text)
+        self.failures = {}  # (screen_name, name), or None for a failed flush -> RuntimeError
+        self.pending_cond = Condition()
+        self.logger = logging.getLogger()
+        self.thread = Thread(target=self._write_batches, name='storage-writer', daemon=True)
+        self.thread.start()
+
+    def _enqueue(self, op, screen_name, name, text=None):
+        key = (screen_name, name)
+        with self.pending_cond:
+            self._raise_failure(key)
+            # queued in the same order as the record's pending changes
+            self.pending.setdefault(key, deque()).append((op, text))
+            self.queue.put((op, screen_name, name, text))
+
+    def _wait(self, key=None):
+        """
+        wait until the queued changes of a record are written. all queued changes if key is None
+        """
+        with self.pending_cond:
+            self.pending_cond.wait_for(
+                lambda: not (self.pending if key is None else self.pending.get(key)))
+
+    def _fail(self, keys, message):
+        """
+        log a change that failed to be written, and keep it to be raised to the users of its records
+        :param keys: list of (screen_name, name) of the records, or [None] for a failed flush
+        """
+        self.logger.error(message)
+        with self.pending_cond:
+            for key in keys:
+                self.failures.setdefault(key, RuntimeError(message))
+
+    def _raise_failure(self, key=None):
+        """
+        raise (once) a failed change of a record, or a failed flush. any failed change if key is
+        None
+        :raise RuntimeError: the failure
+        """
+        with self.pending_cond:
+            if key is None:
+                key = next(iter(self.failures), None)
+            failure = self.failures.pop(key, None) or self.failures.pop(None, None)
+        if failure is not None:
+            raise failure
+
+    def _queued_record(self, key):
+        """
+        :return: tuple (known, text). known is True if the queued changes of the record determine
+                 its text (a queued write or delete, and the appends after it). text is None for a
+                 deleted record
+        """
+        with self.pending_cond:
+            changes = list(self.pending.get(key, ()))
+        for i in range(len(changes) - 1, -1, -1):
+            op, text = changes[i]
+            if op != 'append':
+                if op == 'delete' and i == len(changes) - 1:
+                    return True, None
+                return True, (text or '') + ''.join(appended for _, appended in changes[i + 1:])
+        return False, None
+
+    def append(self, screen_name, name, text):
+        self._enqueue('append', screen_name, name, text)
+
+    def append_batch(self, appends):
+        for screen_name, name, text in appends:
+            self._enqueue('append', screen_name, name, text)
+
+    def write(self, screen_name, name, text):
+        self._enqueue('write', screen_name, name, text)
+
+    def delete(self, screen_name, name):
+        self._enqueue('delete', screen_name, name)
+
+    def read(self, screen_name, name):
+        key = (screen_name, name)
+        self._raise_failure(key)
+        known, text = self._queued_record(key)
+        if known:
+            return text
+        self._wait(key)
+        return self.storage.read(screen_name, name)
+
+    def read_lines(self, screen_name, name):
+        key = (screen_name, name)
+        self._raise_failure(key)
+        known, text = self._queued_record(key)
+        if known:
+            lines = text.split(NEWLINE) if text else []
+            if lines and not lines[-1]:
+                lines.pop()
+            yield from lines
+            return
+        self._wait(key)
+        yield from self.storage.read_lines(screen_name, name)
+
+    def exists(self, screen_name, name):
+        key = (screen_name, name)
+        self._raise_failure(key)
+        with self.pending_cond:
+            changes = self.pending.get(key)
+            if changes:
+                # appends and writes create the record
+                return changes[-1][0] != 'delete'
+        return self.storage.exists(screen_name, name)
+
+    def size(self, screen_name, name):
+        self._wait((screen_name, name))
+        return self.storage.size(screen_name, name)
+
+    def names(self, screen_name):
+        self._wait()
+        return self.storage.names(screen_name)
+
+    def users(self):
+        self._wait()
+        return self.storage.users()
+
+    def flush(self, fsync=False):
+        """
+        wait until all queued changes are written
+        :raise RuntimeError: if a change failed to be written since the last flush
+        """
+        self._wait()
+        if fsync:
+            self.storage.flush(fsync=True)
+        self._raise_failure()
+
+    def _write_batches(self):
+        stop = False
+        while not stop:
+            batch = [self.queue.get()]
+            while len(batch) < MAX_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Empty:
+                    break
+            stop = self._STOP in batch
+            changes = [change for change in batch if change is not self._STOP]
+            try:
+                self._write_batch(changes)
+            finally:
+                with self.pending_cond:
+                    for op, screen_name, name, text in changes:
+                        key = (screen_name, name)
+                        self.pending[key].popleft()
+                        if not self.pending[key]:
+                            del self.pending[key]
+                    self.pending_cond.notify_all()
+
+    def _write_batch(self, changes):
+        appends = []
+        for op, screen_name, name, text in changes:
+            if op == 'append':
+                appends.append((screen_name, name, text))
+                continue
+            self._append_batch(appends)
+            appends = []
+            try:
+                if op == 'write':
+                    self.storage.write(screen_name, name, text)
+                else:
+                    self.storage.delete(screen_name, name)
+            except Exception as e:
+                self._fail([(screen_name, name)], 'failed to {0} record "{1}" of {2}: {3}'.format(
+                    op, name, screen_name, e))
+        self._append_batch(appends)
+        now = time.time()
+        fsync = self.fsync == FSYNC_BATCH or (
+            self.fsync == FSYNC_INTERVAL and now - self.last_fsync >= FSYNC_INTERVAL_SECONDS)
+        try:
+            self.storage.flush(fsync)
+        except Exception as e:
+            self._fail([None], 'failed to flush the storage: {0}'.format(e))
+        if fsync:
+            self.last_fsync = now
+
+    def _append_batch(self, appends):
+        if not appends:
+            return
+        try:
+            self.storage.append_batch(appends)
+        except Exception as e:
+            self._fail([(screen_name, name) for screen_name, name, text in appends],
+                       'failed to append {0} records: {1}'.format(len(appends), e))
+
+    def close(self):
+        """
+        write all queued changes, stop the writer thread and close the storage
+        """
+        self.queue.put(self._STOP)
+        self.thread.join()
+        self.storage.flush(self.fsync != FSYNC_NEVER)
+        self.storage.close()
+
+
+def record_exists(storage, layout, screen_name, name):
+    """
+    :return: True if the user has the given record, either in the storage or as a binary file (see
+             BINARY_RECORDS)
+    """
+    if storage.exists(screen_name, name):
+        return True
+    return name in BINARY_RECORDS and os.path.isfile(
+        os.path.join(layout.user_dir(screen_name), name + BINARY_RECORDS[name]))
+
+
+def _create_storage(layout, storage, max_open_files=0):
+    if storage == SQLITE:
+        return SQLiteStorage(os.path.join(layout.data_dir, DB_NAME), layout.compression)
+    return FileStorage(layout, max_open_files)
+
+
+def open_storage(layout, group_commit=False, fsync=FSYNC_NEVER):
+    """
+    :param layout: DataLayout of the data dir
+    :param group_commit: whether changes are queued and written in batches by a writer thread (see
+                         GroupCommitStorage)
+    :param fsync: the fsync policy of group commit (one of FSYNC_POLICIES)
+    :return: the storage of the data dir (FileStorage unless the data dir was migrated to another
+             storage)
+    """
+    if group_commit:
+        return GroupCommitStorage(_create_storage(layout, layout.storage, MAX_OPEN_FILES), fsync)
+    return _create_storage(layout, layout.storage)
+
+
+def migrate_storage(data_dir, storage):
+    """
+    copy all user records of a data dir to the given storage, and remove them from the previous
+    one. the miner must not run during the migration. an interrupted migration can be completed by
+    calling this function again
+    :param data_dir: the main data directory
+    :param storage: one of the constants in STORAGES
+    :return: number of copied records
+    """
+    if storage not in STORAGES:
+        raise ValueError('Unsupported storage: "{0}"'.format(storage))
+    layout = DataLayout(data_dir)
+    copied = 0
+    if layout.storage != storage:
+        source = open_storage(layout)
+        target = _create_storage(layout, storage)
+        for screen_name in source.users():
+            for name in source.names(screen_name):
+                target.write(screen_name, name, source.read(screen_name, name))
+                copied += 1
+        source.close()
+        target.close()
+        layout.set_storage(storage)
+    # remove whatever is left in the other storage
+    if storage == SQLITE:
+        files = FileStorage(layout)
+        for screen_name, user_dir in list(layout.users()):
+            for name in files.names(screen_name):
+                files.delete(screen_name, name)
+            if not os.listdir(user_dir):
+                os.rmdir(user_dir)
+    else:
+        for suffix in ['', '-wal', '-shm']:
+            db_file = os.path.join(data_dir, DB_NAME + suffix)
+            if os.path.isfile(db_file):
+                os.remove(db_file)
+    return copied
+
+
+def parse_args():
+    """
+    parse and return the program arguments
+    """
+    parser = argparse.ArgumentParser(prog='TwitterMine storage',
+                                     usage='storage -d <data-dir> [-s <storage>] '
+                                           '[-z <compression>] [-i <ids-format>] '
+                                           '[-n <neighbors-format>]',
+                                     description='Move the user records of a data dir to another '
+                                                 'storage, or change the compression of new tweets '
+                                                 'data. Stop the daemon first')
+    parser.add_argument('-d', '--data-dir', metavar='data-dir', required=True, type=str,
+                        help='the data dir to migrate (created if not exist)')
+    parser.add_argument('-s', '--storage', metavar='storage', required=False, type=str,
+                        choices=STORAGES,
+                        help='the new storage: "files" (a file for every record) or "sqlite" (a '
+                             'single database file)')
+    parser.add_argument('-z', '--compression', metavar='compression', required=False, type=str,
+                        choices=COMPRESSIONS + ['none'],
+                        help='compression of tweets data that is written from now on: "gzip" or '
+                             '"none". existing data is not changed, unless it is moved to another '
+                             'storage')
+    parser.add_argument('-i', '--ids-format', metavar='ids-format', required=False, type=str,
+                        choices=FORMATS,
+                        help='format of followers and friends ids that are written from now on: '
+                             '"text" (a line for every id) or "binary" (uint64 array files that '
+                             'can be memory mapped)')
+    parser.add_argument('-n', '--neighbors-format', metavar='neighbors-format', required=False,
+                        type=str, choices=FORMATS,
+                        help='format of neighbors that are written from now on: "text" (a line '
+                             'for every neighbor) or "binary" (fixed size records with interned '
+                             'screen names, that can be loaded to numpy arrays)')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.compression is not None:
+        DataLayout(args.data_dir).set_compression(
+            None if args.compression == 'none' else args.compression)
+        print('tweets data will be written with compression: {0}'.format(args.compression))
+    if args.ids_format is not None:
+        DataLayout(args.data_dir).set_ids_format(args.ids_format)
+        print('ids lists will be written in {0} format'.format(args.ids_format))
+    if args.neighbors_format is not None:
+        DataLayout(args.data_dir).set_neighbors_format(args.neighbors_format)
+        print('neighbors will be written in {0} format'.format(args.neighbors_format))
+    if args.storage is not None:
+        copied = migrate_storage(args.data_dir, args.storage)
+        print('copied {0} records to the {1} storage'.format(copied, args.storage))
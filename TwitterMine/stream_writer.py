@@ -0,0 +1,182 @@
+import gzip
+import json
+import os
+import re
+import time
+
+from TwitterMine.storage import GZIP, GZIP_SUFFIX, compress
+
+NEWLINE = '\n'
+SEGMENT_PREFIX = 'tweets.'
+SEGMENT_NAME_FORMAT = SEGMENT_PREFIX + '{0:06d}'
+SEGMENT_NAME_REGEX = re.compile(re.escape(SEGMENT_PREFIX) + r'(\d+)(' + re.escape(GZIP_SUFFIX) +
+                                ')?')
+INDEX_FILE_NAME = 'index'
+LEGACY_FILE_NAME = 'tweets'  # the stream file of DataWriter.write_tweets_of_stream
+
+FLUSH_COUNT = 1000  # flush the buffer when it has this number of tweets
+FLUSH_SECONDS = 5  # flush the buffer if it wasn't flushed for this number of seconds
+SEGMENT_MAX_BYTES = 128 * 1024 * 1024
+SEGMENT_MAX_SECONDS = 24 * 60 * 60
+
+
+class StreamWriter:
+    """
+    A buffered writer for the tweets of a single stream.
+
+    Tweets are buffered and written in batches to a file that is kept open. The tweets of the
+    stream are split to segments (tweets.000000, tweets.000001, ...), and a new segment is started
+    when the current one is too large or too old. Each line in the segment is a single tweet in
+    json format.
+
+    With compression, segments are gzip files (tweets.000000.gz, ...) and every flush adds an
+    independent gzip frame to the segment, so a segment is readable even if it was not closed.
+
+    When a segment is closed, a line is appended to the 'index' file of the stream directory. Each
+    index line is a json dictionary with the keys 'segment', 'count', 'bytes', 'start' and 'end'
+    (start and end are epoch times of the first and last written tweets, bytes is the size of the
+    segment on the disk).
+
+    The writer is not thread safe. It should be used by a single thread (the listen thread).
+    """
+
+    def __init__(self, stream_dir, flush_count=FLUSH_COUNT, flush_seconds=FLUSH_SECONDS,
+                 segment_max_bytes=SEGMENT_MAX_BYTES, segment_max_seconds=SEGMENT_MAX_SECONDS,
+                 compression=None):
+        """
+        :param stream_dir: the directory of the stream. must exist
+        :param flush_count: flush the buffer when it has this number of tweets
+        :param flush_seconds: flush the buffer if it wasn't flushed for this number of seconds
+        :param segment_max_bytes: start a new segment when the current one exceeds this size
+        :param segment_max_seconds: start a new segment when the current one is this old
+        :param compression: storage.GZIP to compress the segments, or None
+        """
+        self.stream_dir = stream_dir
+        self.compression = compression
+        self.flush_count = flush_count
+        self.flush_seconds = flush_seconds
+        self.segment_max_bytes = segment_max_bytes
+        self.segment_max_seconds = segment_max_seconds
+        self.buffer = []
+        self.last_flush = time.time()
+        self.segment_number = self._last_segment_number() + 1
+        self.segment_file = None  # the open file of the current segment
+        self.segment_bytes = 0
+        self.segment_count = 0
+        self.segment_start = None
+        self.segment_end = None
+
+    def _last_segment_number(self):
+        """
+        :return: the number of the last existing segment in the stream directory, or -1
+        """
+        numbers = [int(m.group(1)) for m in map(SEGMENT_NAME_REGEX.fullmatch,
+                                                os.listdir(self.stream_dir)) if m]
+        return max(numbers, default=-1)
+
+    def write(self, tweet):
+        """
+        add a tweet to the buffer. the buffer is flushed if it is full or old enough
+        :param tweet: dictionary
+        """
+        self.buffer.append(json.dumps(tweet).replace(NEWLINE, ' ') + NEWLINE)
+        self.flush_if_needed()
+
+    def flush_if_needed(self):
+        """
+        flush the buffer if it is full or wasn't flushed for flush_seconds. should be called from
+        time to time even if no tweets are written, so buffered tweets are not kept for long
+        """
+        if len(self.buffer) >= self.flush_count or \
+                time.time() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        """
+        write all buffered tweets to the current segment
+        """
+        now = time.time()
+        self.last_flush = now
+        if not self.buffer:
+            return
+        if self.segment_file is not None and (
+                self.segment_bytes >= self.segment_max_bytes or
+                now - self.segment_start >= self.segment_max_seconds):
+            self._close_segment()
+        if self.segment_file is None:
+            self._open_segment(now)
+        data = ''.join(self.buffer)
+        if self.compression == GZIP:
+            data = compress(data)
+        else:
+            data = data.encode('utf-8')
+        self.segment_file.write(data)
+        self.segment_file.flush()
+        self.segment_bytes += len(data)
+        self.segment_count += len(self.buffer)
+        self.segment_end = now
+        self.buffer = []
+
+    def _segment_name(self):
+        name = SEGMENT_NAME_FORMAT.format(self.segment_number)
+        if self.compression == GZIP:
+            name += GZIP_SUFFIX
+        return name
+
+    def _open_segment(self, now):
+        path = os.path.join(self.stream_dir, self._segment_name())
+        self.segment_file = open(path, mode='ab')
+        self.segment_bytes = 0
+        self.segment_count = 0
+        self.segment_start = now
+        self.segment_end = now
+
+    def _close_segment(self):
+        """
+        close the current segment and add it to the index
+        """
+        self.segment_file.close()
+        self.segment_file = None
+        entry = {'segment': self._segment_name(),
+                 'count': self.segment_count,
+                 'bytes': self.segment_bytes,
+                 'start': self.segment_start,
+                 'end': self.segment_end}
+        with open(os.path.join(self.stream_dir, INDEX_FILE_NAME), mode='a') as f:
+            f.write(json.dumps(entry))
+            f.write(NEWLINE)
+        self.segment_number += 1
+
+    def close(self):
+        """
+        flush the buffer and close the current segment
+        """
+        self.flush()
+        if self.segment_file is not None:
+            self._close_segment()
+
+
+def read_stream(stream_dir):
+    """
+    read all tweets of a stream, in the order they were written: the tweets of the stream file of
+    DataWriter.write_tweets_of_stream (if exists), and then the tweets of all segments. compressed
+    files are decompressed while reading
+    :param stream_dir: the directory of the stream
+    :return: generator of tweets (dictionaries)
+    """
+    paths = []
+    for name in [LEGACY_FILE_NAME, LEGACY_FILE_NAME + GZIP_SUFFIX]:
+        if os.path.isfile(os.path.join(stream_dir, name)):
+            paths.append(os.path.join(stream_dir, name))
+    segments = [(int(m.group(1)), m.group(0)) for m in map(SEGMENT_NAME_REGEX.fullmatch,
+                                                           os.listdir(stream_dir)) if m]
+    paths += [os.path.join(stream_dir, name) for number, name in sorted(segments)]
+    for path in paths:
+        if path.endswith(GZIP_SUFFIX):
+            f = gzip.open(path, mode='rt', encoding='utf-8')
+        else:
+            f = open(path, encoding='utf-8')
+        with f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
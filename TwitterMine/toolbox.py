@@ -4,8 +4,9 @@ import sys
 
 from TwitterAPI.TwitterAPI import TwitterAPI
 from TwitterMine.data_writer import DataWriter as DW
-from TwitterMine.miner import Miner
+from TwitterMine.miner import Miner, get_credentials
 from TwitterMine.server import Server
+from TwitterMine.utils import get_neighbors
 
 logging.basicConfig(filename='server_dev.log', level=logging.DEBUG,
                     format='%(asctime)s: %(levelname)s: %(filename)s: %(message)s',
@@ -63,12 +64,25 @@ def get_writer():
 
 def get_miner():
     config = get_config()
-    return Miner(config['consumer_key'], config['consumer_secret'],
-                 config['access_token_key'], config['access_token_secret'], config['data_dir'])
+    return Miner(get_credentials(config, app_auth=False), config['data_dir'])
 
 
 def get_server():
     config = get_config()
-    return Server(config['consumer_key'], config['consumer_secret'],
-                  config['access_token_key'], config['access_token_secret'],
-                  config['data_dir'], config['port'])
+    return Server(get_credentials(config, app_auth=False), config['data_dir'], config['port'])
+
+
+def derive_neighbors(screen_names=None):
+    """
+    derive the neighbors of users from their already stored tweets, without calling the api.
+    the existing neighbors of these users are overwritten
+    :param screen_names: iterable of screen names. None for all users in the data dir that have
+                         stored tweets
+    """
+    writer = get_writer()
+    if screen_names is None:
+        screen_names = [name for name in writer.storage.users()
+                        if writer.storage.exists(name, 'tweets')]
+    for screen_name in screen_names:
+        writer.write_neighbors(get_neighbors(writer.read_tweets_of_user(screen_name), screen_name),
+                               screen_name)
@@ -53,3 +53,26 @@ def get_original_author(t):
         return t['in_reply_to_screen_name']
 
     return None
+
+
+def get_neighbors(tweets, screen_name):
+    """
+    find the neighbors of a user in its tweets.
+    B is considered a neighbor of A if one of the following holds:
+    * A retweeted a tweet by B
+    * A quoted a tweet by B
+    * A replied to B
+
+    :param tweets: iterable of tweets by the user
+    :param screen_name: the screen name of the user
+    :return: list of strings, one for each tweet that indicates some neighbor of the user, in the
+             format neighbor_screen_name;tweet_id;neighborship_type (neighborship_type is one of the
+             constants RETWEET, QUOTE or REPLY)
+    """
+    neighbors = []
+    for t in tweets:
+        neighbor_scr_name = get_original_author(t)
+        if neighbor_scr_name is not None and neighbor_scr_name != screen_name:
+            type = get_tweet_type(t)
+            neighbors.append('{0};{1};{2}'.format(neighbor_scr_name, t['id_str'], type))
+    return neighbors
@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from queue import Empty
+from threading import Lock, Thread
+
+from TwitterMine.job_queue import JobStore, STOP_SIGNAL
+
+
+class SameKeyJobsTest(unittest.TestCase):
+    """
+    jobs with the same key (the screen name) never run at the same time
+    """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = JobStore(os.path.join(self.dir, '#jobs.db'))
+        self.queue = self.store.queue('timeline')
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.dir)
+
+    def test_deferred_while_running(self):
+        first = self.queue.put({'screen_name': 'alice', 'products': {'tweets': 0}})
+        running_id, args = self.queue.get(block=False)
+        self.assertEqual(first, running_id)
+        # not covered by the running job, so it is a new pending job
+        second = self.queue.put({'screen_name': 'alice', 'products': {'neighbors': 0}})
+        self.assertNotEqual(first, second)
+        other = self.queue.put({'screen_name': 'bob', 'products': {'tweets': 0}})
+        self.assertEqual(other, self.queue.get(block=False)[0])
+        self.assertRaises(Empty, self.queue.get, block=False)
+        self.queue.task_done(first)
+        self.assertEqual(second, self.queue.get(block=False)[0])
+
+    def test_never_concurrent(self):
+        active = set()
+        overlaps = []
+        lock = Lock()
+
+        def consume():
+            while True:
+                job = self.queue.get()
+                if job is STOP_SIGNAL:
+                    return
+                job_id, args = job
+                with lock:
+                    if args['screen_name'] in active:
+                        overlaps.append(job_id)
+                    active.add(args['screen_name'])
+                time.sleep(0.05)
+                with lock:
+                    active.discard(args['screen_name'])
+                self.queue.task_done(job_id)
+
+        threads = [Thread(target=consume) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for limit in range(1, 6):
+            # every job asks for more than the previous ones, so it is never covered. the jobs
+            # are put while the previous jobs of the same users are running
+            for screen_name in ['alice', 'bob']:
+                self.queue.put({'screen_name': screen_name, 'limit': limit})
+            time.sleep(0.01)
+        for _ in threads:
+            self.queue.put(STOP_SIGNAL)
+        for t in threads:
+            t.join()
+        self.assertEqual([], overlaps)
+        self.assertEqual(0, self.queue.qsize())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import shutil
+import tempfile
+import unittest
+from threading import Event, Lock
+from unittest import mock
+
+from TwitterMine.async_miner import AsyncMiner
+from TwitterMine.miner import Miner
+
+TIMELINE_SIZE = 6
+PAGE_SIZE = 2
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+        self.status_code = 200
+        self.headers = {}
+
+    def json(self):
+        return self.data
+
+    def get_iterator(self):
+        return iter(self.data)
+
+
+class FakeTwitter:
+    """
+    answers users/lookup and user_timeline requests. the first timeline request waits until it is
+    released, so other jobs can be produced while a timeline job is running
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.timeline_requests = 0
+        self.started = Event()
+        self.release = Event()
+
+    def api(self, *args, **kwargs):
+        return self
+
+    def request(self, resource, params=None):
+        if resource == 'users/lookup':
+            return FakeResponse([{'screen_name': name, 'id': 1, 'followers_count': 1}
+                                 for name in params['screen_name'].split(',')])
+        with self.lock:
+            self.timeline_requests += 1
+        self.started.set()
+        self.release.wait(10)
+        max_id = params.get('max_id', TIMELINE_SIZE)
+        ids = [id for id in range(max_id, max(max_id - PAGE_SIZE, 0), -1)
+               if id > params.get('since_id', 0)]
+        return FakeResponse([{'id': id, 'id_str': str(id), 'user': {'screen_name': 'alice'},
+                              'in_reply_to_screen_name': 'bob', 'full_text': 'hi'}
+                             for id in ids])
+
+
+class OverlappingTimelineJobsTest(unittest.TestCase):
+    """
+    a neighbors request while the tweets of the same user are mined is handled by the running
+    timeline job, so the timeline is fetched once
+    """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def check(self, miner_class):
+        twitter = FakeTwitter()
+        with mock.patch('TwitterMine.miner.TwitterAPI', twitter.api):
+            miner = miner_class([{'consumer_key': 'key', 'consumer_secret': 'secret'}],
+                                self.dir)
+        miner.run()
+        try:
+            tweets_job = miner.produce_job('tweets', {'screen_name': 'alice', 'limit': 0})
+            self.assertTrue(twitter.started.wait(10))
+            neighbors_job = miner.produce_job('neighbors', {'screen_name': 'alice', 'limit': 0})
+            self.assertNotEqual(tweets_job, neighbors_job)
+            twitter.release.set()
+            self.assertTrue(miner.jobs_store.wait([tweets_job, neighbors_job], timeout=10))
+            states = [status['state'] for status in
+                      miner.jobs_store.job_status([tweets_job, neighbors_job])]
+            tweets = list(miner.writer.read_tweets_of_user('alice'))
+            neighbors = miner.writer.read_neighbors('alice')
+        finally:
+            miner.stop()
+        self.assertEqual(['done', 'done'], states)
+        # a page for every PAGE_SIZE tweets, and an empty page that ends the timeline
+        self.assertEqual(TIMELINE_SIZE // PAGE_SIZE + 1, twitter.timeline_requests)
+        self.assertEqual(TIMELINE_SIZE, len(tweets))
+        self.assertEqual(TIMELINE_SIZE, len(neighbors))
+
+    def test_miner(self):
+        self.check(Miner)
+
+    def test_async_miner(self):
+        self.check(AsyncMiner)
+
+
+if __name__ == '__main__':
+    unittest.main()